@@ -1,25 +1,325 @@
+# inversiones/admin.py
+"""
+Admin preparado para tablas de millones de filas (``Precio``, ``Operacion``).
+
+- Conteo estimado: exacto hasta ``ADMIN_CONTEO_EXACTO`` filas (un COUNT con
+  LIMIT); más allá, sin filtros, se estima con el rango de ids y con filtros se
+  informa "más de N". Nunca un COUNT(*) de la tabla completa.
+- Paginación por clave (keyset): el listado se ordena por una clave única
+  cubierta por un índice (``clave_keyset``) y "Siguiente"/"Anterior" siguen
+  desde la última/primera fila de la página, sin OFFSET.
+- ``date_hierarchy`` sobre ``fecha``: el filtro es un rango sobre el índice y
+  la navegación salta de período en período por el índice
+  (``FechasPorSaltosQuerySet``) en vez de truncar y agrupar todas las filas.
+- ``list_select_related`` y ``autocomplete_fields``: ni una consulta por fila
+  para el ``__str__`` de los FK ni un <select> con todos los activos.
+- Altas, cambios y borrados (también el borrado masivo) recalculan una vez por
+  lote: precios con ``refrescar_valuaciones`` en las fechas tocadas y la
+  instantánea incremental, como ``import_datos``; operaciones y cantidades
+  encolando un recálculo por portafolio (``trabajos``).
+"""
+from datetime import date
+from functools import partial
+
+from django.conf import settings
 from django.contrib import admin
-from .models import Operacion, Portafolio, Activo, Precio, Weight, Cantidad, ValorPortafolio
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import Max, Min, Q
+
+from . import matriz_precios, trabajos
+from .cache import invalidar
+from .models import Activo, Cantidad, Operacion, Portafolio, Precio, Trabajo, ValorPortafolio, Weight
+from .valuacion import refrescar_valuaciones
+
+CURSOR_SIGUIENTE, CURSOR_ANTERIOR = "despues", "antes"
+
+
+class FechasPorSaltosQuerySet(models.QuerySet):
+    """
+    ``dates()`` por saltos: una búsqueda de la primera fecha de cada período
+    (MIN sobre el índice de la fecha) en vez de truncar y agrupar todas las
+    filas. Es lo que consulta la navegación de ``date_hierarchy``.
+    """
+
+    def dates(self, field_name, kind, order="ASC"):
+        if kind not in ("year", "month", "day"):
+            return super().dates(field_name, kind, order)
+        qs = self.order_by()
+        periodos = []
+        fecha = qs.aggregate(f=Min(field_name))["f"]
+        while fecha is not None:
+            inicio = date(fecha.year, 1 if kind == "year" else fecha.month, 1 if kind != "day" else fecha.day)
+            periodos.append(inicio)
+            fecha = qs.filter(**{f"{field_name}__gte": _siguiente_periodo(inicio, kind)}).aggregate(
+                f=Min(field_name))["f"]
+        return periodos[::-1] if order == "DESC" else periodos
+
+
+def _siguiente_periodo(inicio, kind):
+    if kind == "year":
+        return date(inicio.year + 1, 1, 1)
+    if kind == "month":
+        return date(inicio.year + inicio.month // 12, inicio.month % 12 + 1, 1)
+    return date.fromordinal(inicio.toordinal() + 1)
+
+
+def contar(queryset):
+    """
+    ``(n, texto)``: filas del listado sin contar toda la tabla. Exacto hasta
+    ``ADMIN_CONTEO_EXACTO``; más allá, sin filtros, el rango de ids (cuenta
+    también los borrados: es una estimación) y con filtros una cota inferior.
+    """
+    tope = settings.ADMIN_CONTEO_EXACTO
+    n = queryset.order_by()[:tope + 1].count()
+    if n <= tope:
+        return n, f"{n:,}"
+    if queryset.query.has_filters():
+        return n, f"más de {tope:,}"
+    ids = queryset.model._default_manager.aggregate(a=Min("pk"), b=Max("pk"))
+    n = max(ids["b"] - ids["a"] + 1, n)
+    return n, f"≈ {n:,}"
+
+
+class ChangeListKeyset(ChangeList):
+    """Listado paginado por la clave ``model_admin.clave_keyset`` (descendente)."""
+
+    def get_filters_params(self, params=None):
+        parametros = super().get_filters_params(params)
+        for var in (CURSOR_SIGUIENTE, CURSOR_ANTERIOR):
+            parametros.pop(var, None)
+        return parametros
+
+    def _cursor(self, var):
+        texto = self.params.get(var)
+        if not texto:
+            return None
+        partes = texto.split(",")
+        clave = self.model_admin.clave_keyset
+        if len(partes) != len(clave):
+            raise IncorrectLookupParameters
+        try:
+            return [self.lookup_opts.get_field(c).to_python(v) for c, v in zip(clave, partes)]
+        except ValidationError:
+            raise IncorrectLookupParameters
+
+    def _desde(self, queryset, valores, op):
+        """Filas estrictamente después de ``valores`` en el orden lexicográfico de la clave (``op``: lt/gt)."""
+        clave = self.model_admin.clave_keyset
+        condicion = Q()
+        for k in range(len(clave)):
+            iguales = {c: v for c, v in zip(clave[:k], valores[:k])}
+            condicion |= Q(**iguales, **{f"{clave[k]}__{op}": valores[k]})
+        # cota redundante sobre la primera columna: el rango que el índice puede recorrer
+        return queryset.filter(condicion, **{f"{clave[0]}__{op}e": valores[0]})
+
+    def get_query_string(self, new_params=None, remove=None):
+        # los enlaces de filtros y fechas vuelven a la primera página
+        return super().get_query_string(new_params, [*(remove or []), CURSOR_SIGUIENTE, CURSOR_ANTERIOR])
+
+    def _url(self, var, fila):
+        return self.get_query_string({var: ",".join(str(getattr(fila, c)) for c in self.model_admin.clave_keyset)})
+
+    def get_results(self, request):
+        clave = self.model_admin.clave_keyset
+        por_pagina = self.list_per_page
+        self.result_count, self.conteo = contar(self.queryset)
+        despues, antes = self._cursor(CURSOR_SIGUIENTE), self._cursor(CURSOR_ANTERIOR)
+
+        if antes is not None:
+            filas = list(self._desde(self.queryset, antes, "gt").order_by(*clave)[:por_pagina + 1])
+            hay_mas, filas = len(filas) > por_pagina, filas[:por_pagina][::-1]
+            anterior, siguiente = hay_mas, True
+        else:
+            qs = self.queryset.order_by(*(f"-{c}" for c in clave))
+            if despues is not None:
+                qs = self._desde(qs, despues, "lt")
+            filas = list(qs[:por_pagina + 1])
+            siguiente, filas = len(filas) > por_pagina, filas[:por_pagina]
+            anterior = despues is not None
+
+        self.url_siguiente = self._url(CURSOR_SIGUIENTE, filas[-1]) if siguiente and filas else None
+        self.url_anterior = self._url(CURSOR_ANTERIOR, filas[0]) if anterior and filas else None
+        self.url_primera = self.get_query_string() if anterior else None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.full_result_count = None
+        self.result_list = filas
+        self.can_show_all = False
+        self.multi_page = siguiente or anterior
+        self.paginator = self.model_admin.get_paginator(request, self.queryset, por_pagina)
+        self.paginator.count = self.result_count  # sin el COUNT(*) del Paginator
+
+
+class AdminEscalable(admin.ModelAdmin):
+    """Base de los admin de tablas grandes: keyset, conteo estimado y navegación por fechas por saltos."""
+    clave_keyset = ("fecha", "id")
+    change_list_template = "admin/inversiones/keyset_change_list.html"
+    show_full_result_count = False
+    sortable_by = ()  # el orden es la clave: cualquier otro obligaría a ordenar todo el resultado
+
+    def get_changelist(self, request, **kwargs):
+        return ChangeListKeyset
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request)
+        return FechasPorSaltosQuerySet(self.model, query=qs.query, using=qs.db)
+
+
+def _precios_cambiados(fechas):
+    """Recalcula una vez un lote de precios tocados (llamar en la transacción que los modifica)."""
+    if not fechas:
+        return
+    invalidar(precios=True)
+    refrescar_valuaciones(fechas=fechas)
+    transaction.on_commit(partial(matriz_precios.generar, desde=min(fechas)))
+
+
+def _encolar_recalculos(request, modeladmin, desdes):
+    """
+    Un recálculo encolado por portafolio (``desdes``: pf_id -> fecha o None).
+    La caché la invalida el trabajo cuando recalcula.
+    """
+    if not desdes:
+        return
+    for pf_id, desde in desdes.items():
+        trabajos.encolar_recalculo(pf_id, desde)
+    modeladmin.message_user(request, f"Recálculo de valuaciones encolado para {len(desdes)} portafolio(s).")
+
+
+@admin.register(Activo)
+class ActivoAdmin(admin.ModelAdmin):
+    list_display = ("simbolo", "nombre")
+    search_fields = ("^simbolo", "nombre")
+    ordering = ("simbolo",)
+
+
+@admin.register(Portafolio)
+class PortafolioAdmin(admin.ModelAdmin):
+    list_display = ("id", "nombre")
+    search_fields = ("nombre",)
+    actions = ["recalcular_valuaciones"]
+
+    @admin.action(description="Recalcular valuaciones (en segundo plano)")
+    def recalcular_valuaciones(self, request, queryset):
+        with transaction.atomic():
+            _encolar_recalculos(request, self, {pf_id: None for pf_id in queryset.values_list("id", flat=True)})
+
+
+@admin.register(Precio)
+class PrecioAdmin(AdminEscalable):
+    # (fecha, activo) es única y la cubre precio_fecha_activo_idx
+    clave_keyset = ("fecha", "activo_id")
+    list_display = ("fecha", "activo", "precio")
+    list_select_related = ("activo",)
+    autocomplete_fields = ("activo",)
+    date_hierarchy = "fecha"
+    search_fields = ("=activo__simbolo",)
+    search_help_text = "Símbolo exacto del activo."
+
+    @transaction.atomic
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        _precios_cambiados({obj.fecha, form.initial.get("fecha", obj.fecha)})
+
+    @transaction.atomic
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        _precios_cambiados({obj.fecha})
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        fechas = set(queryset.order_by().values_list("fecha", flat=True).distinct())
+        super().delete_queryset(request, queryset)
+        _precios_cambiados(fechas)
+
+
+@admin.register(Operacion)
+class OperacionAdmin(AdminEscalable):
+    list_display = ("fecha", "portafolio", "activo", "tipo", "cantidad")
+    list_select_related = ("portafolio", "activo")
+    list_filter = ("tipo", "portafolio")
+    autocomplete_fields = ("portafolio", "activo")
+    date_hierarchy = "fecha"
+    search_fields = ("=activo__simbolo",)
+    search_help_text = "Símbolo exacto del activo."
+
+    @transaction.atomic
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        desdes = {obj.portafolio_id: min(obj.fecha, form.initial.get("fecha", obj.fecha))}
+        previo = form.initial.get("portafolio")
+        if previo is not None and previo != obj.portafolio_id:
+            desdes[previo] = form.initial["fecha"]
+        _encolar_recalculos(request, self, desdes)
+
+    @transaction.atomic
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        _encolar_recalculos(request, self, {obj.portafolio_id: obj.fecha})
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        desdes = dict(queryset.order_by().values("portafolio_id").annotate(desde=Min("fecha"))
+                      .values_list("portafolio_id", "desde"))
+        super().delete_queryset(request, queryset)
+        _encolar_recalculos(request, self, desdes)
+
+
+@admin.register(Cantidad)
+class CantidadAdmin(admin.ModelAdmin):
+    list_display = ("portafolio", "activo", "cantidad")
+    list_select_related = ("portafolio", "activo")
+    list_filter = ("portafolio",)
+    autocomplete_fields = ("portafolio", "activo")
+    search_fields = ("=activo__simbolo",)
+
+    @transaction.atomic
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        _encolar_recalculos(request, self, {obj.portafolio_id: None})
+
+    @transaction.atomic
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        _encolar_recalculos(request, self, {obj.portafolio_id: None})
+
+    @transaction.atomic
+    def delete_queryset(self, request, queryset):
+        pf_ids = set(queryset.order_by().values_list("portafolio_id", flat=True).distinct())
+        super().delete_queryset(request, queryset)
+        _encolar_recalculos(request, self, dict.fromkeys(pf_ids))
 
-# Registra el modelo Operacion
-admin.site.register(Operacion)
 
-# Registra el modelo Portafolio
-admin.site.register(Portafolio)
+@admin.register(Weight)
+class WeightAdmin(AdminEscalable):
+    list_display = ("fecha", "portafolio", "activo", "weight")
+    list_select_related = ("portafolio", "activo")
+    list_filter = ("portafolio",)
+    autocomplete_fields = ("portafolio", "activo")
+    date_hierarchy = "fecha"
+    search_fields = ("=activo__simbolo",)
 
-# Registra el modelo Activo
-admin.site.register(Activo)
 
-# Registra el modelo Precio
-admin.site.register(Precio)
+@admin.register(ValorPortafolio)
+class ValorPortafolioAdmin(AdminEscalable):
+    # derivada de refrescar_valuaciones; (portafolio, fecha) es única e indexada
+    clave_keyset = ("portafolio_id", "fecha")
+    list_display = ("fecha", "portafolio", "valor_total")
+    list_select_related = ("portafolio",)
+    list_filter = ("portafolio",)
 
-# Registra el modelo Weight
-admin.site.register(Weight)
 
-# Registra el modelo Cantidad
-admin.site.register(Cantidad)
+@admin.register(Trabajo)
+class TrabajoAdmin(admin.ModelAdmin):
+    """Cola de trabajos en segundo plano."""
+    list_display = ("id", "tipo", "estado", "portafolio", "solicitudes", "creado", "terminado")
+    list_select_related = ("portafolio",)
+    list_filter = ("estado", "tipo")
+    autocomplete_fields = ("portafolio",)
+    show_full_result_count = False
 
-# Registra el modelo ValorPortafolio
-admin.site.register(ValorPortafolio)
 
-admin.site.site_url = "/api/viz/"
\ No newline at end of file
+admin.site.site_url = "/api/viz/"
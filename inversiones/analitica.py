@@ -0,0 +1,110 @@
+# inversiones/analitica.py
+"""
+Rendimiento y riesgo de un portafolio a partir de su matriz de precios y de
+cantidades vigentes (las mismas que usa ``portafolio.evolucion``).
+
+Los rendimientos no cuentan como ganancia los cambios de tenencia: el día t
+rinde lo que rinden las cantidades vigentes en t-1,
+
+    c[t, i] = Q[t-1, i] · (P[t, i] - P[t-1, i]) / V[t-1]      r[t] = Σ_i c[t, i]
+
+y la contribución de cada activo al rendimiento acumulado G[T] - 1 es
+Σ_t c[t, i] · G[t-1], que suma exactamente G[T] - 1 (G[t] = Π_{s<=t} (1 + r[s])).
+
+Todo se calcula con operaciones vectorizadas sobre la serie completa; las
+ventanas móviles usan sumas acumuladas, O(n) sin importar el largo de la ventana.
+"""
+import numpy as np
+
+DIAS_ANIO = 252  # días hábiles para anualizar
+
+
+def rendimientos(P, Q):
+    """
+    Rendimientos diarios ``r`` (fechas) y contribuciones ``C`` (fechas × activos)
+    sin flujos de operaciones. El primer día no tiene rendimiento: r[0] = 0.
+    Un activo sin precio en t o t-1 no contribuye ese día.
+    """
+    X_previo = Q[:-1] * P[:-1]
+    V_previo = np.nansum(X_previo, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        C = Q[:-1] * (P[1:] - P[:-1]) / V_previo[:, None]
+    C = np.vstack([np.zeros((1, P.shape[1])), np.nan_to_num(C, nan=0.0, posinf=0.0, neginf=0.0)])
+    return C.sum(axis=1), C
+
+
+def volatilidad_movil(r, n):
+    """
+    Desvío estándar muestral de cada ventana de ``n`` rendimientos (NaN hasta
+    completar la primera). Sumas acumuladas de x y x², con x centrado en la
+    media para que la resta de sumas grandes no pierda precisión.
+    """
+    resultado = np.full(r.size, np.nan)
+    if n < 2 or r.size < n:
+        return resultado
+    x = r - r.mean()
+    s1 = np.concatenate(([0.0], np.cumsum(x)))
+    s2 = np.concatenate(([0.0], np.cumsum(x * x)))
+    suma, suma2 = s1[n:] - s1[:-n], s2[n:] - s2[:-n]
+    resultado[n - 1:] = np.sqrt(np.maximum((suma2 - suma * suma / n) / (n - 1), 0.0))
+    return resultado
+
+
+def drawdown(G):
+    """Caída desde el máximo previo en cada fecha, e índices ``(pico, valle)`` de la peor."""
+    dd = G / np.maximum.accumulate(G) - 1
+    valle = int(np.argmin(dd))
+    return dd, int(np.argmax(G[:valle + 1])), valle
+
+
+def _lista(arr):
+    return [None if x != x else x for x in arr.tolist()]
+
+
+def resumir(fechas, r):
+    """
+    Resumen de rendimiento y riesgo de los rendimientos diarios ``r`` (r[0] = 0)
+    alineados con ``fechas``. Devuelve ``(resumen, G, dd)``: el resumen, el
+    crecimiento acumulado y el drawdown de cada fecha.
+    """
+    G = np.cumprod(1 + r)
+    dd, pico, valle = drawdown(G)
+    n = r.size - 1  # días con rendimiento
+    total = float(G[-1] - 1)
+    resumen = {
+        "dias": n,
+        "rendimiento_total": total,
+        "rendimiento_anualizado": (1 + total) ** (DIAS_ANIO / n) - 1 if n and total > -1 else None,
+        "volatilidad_anualizada": float(r[1:].std(ddof=1) * np.sqrt(DIAS_ANIO)) if n > 1 else None,
+        "max_drawdown": {"valor": float(dd[valle]), "pico": fechas[pico].isoformat(),
+                         "valle": fechas[valle].isoformat()},
+    }
+    return resumen, G, dd
+
+
+def analizar(fechas, simbolos, P, Q, ventana=21):
+    """
+    Métricas de rendimiento y riesgo del portafolio en una pasada:
+    ``(resumen, series, contribuciones)``. ``series`` son arreglos alineados con
+    ``fechas`` (no vacía): rendimiento diario (NaN el primer día) y acumulado,
+    drawdown y volatilidad móvil anualizada de ``ventana`` días.
+    """
+    r, C = rendimientos(P, Q)
+    resumen, G, dd = resumir(fechas, r)
+    aportes = np.concatenate(([1.0], G[:-1])) @ C  # Σ_t c[t, i] · G[t-1]
+    contribuciones = sorted(
+        ({"activo": s, "contribucion": a} for s, a in zip(simbolos, aportes.tolist())),
+        key=lambda c: -c["contribucion"],
+    )
+    series = {
+        "rendimiento": np.concatenate(([np.nan], r[1:])),
+        "rendimiento_acumulado": G - 1,
+        "drawdown": dd,
+        "volatilidad_movil": np.concatenate(([np.nan], volatilidad_movil(r[1:], ventana))) * np.sqrt(DIAS_ANIO),
+    }
+    return resumen, series, contribuciones
+
+
+def serializar_series(fechas, series, idx):
+    """Series en forma columnar (``null`` donde no hay valor) para las filas ``idx``."""
+    return {"fechas": [fechas[i].isoformat() for i in idx], **{k: _lista(v[idx]) for k, v in series.items()}}
@@ -0,0 +1,171 @@
+# inversiones/asincrono.py
+"""
+Variantes async (ASGI) de la API de evolución y de los valores por defecto de
+la visualización.
+
+Las consultas independientes se lanzan a la vez con ``asyncio.gather``: cada
+una corre en un hilo del pool con su propia conexión (``en_hilo``), así que no
+se encolan detrás del hilo único que usa el ORM async de Django. Las dos tablas
+materializadas se leen juntas (``leer_evolucion``), en una transacción, para
+que vean la misma versión de los datos. La respuesta se envía en trozos (``formatos.trozos``) mientras se serializa.
+
+Es una opción de concurrencia, no de latencia: V_t y los weights se leen y se
+calculan completos antes del primer byte (la serialización necesita todas las
+fechas para cada bloque del formato), y el cálculo y la serialización ocupan
+el GIL igual que bajo WSGI. ``benchmark carga`` muestra req/s y p99 parecidos a
+la vista síncrona, y algo peores cuando el proceso está saturado. Sirve para
+atender muchas conexiones lentas o abiertas con pocos procesos, no para
+responder antes.
+
+Bajo WSGI estas vistas también funcionan, pero sin la concurrencia.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import render
+from django.utils.cache import get_conditional_response
+from django.views import View
+
+from . import cache, formatos
+from .metricas import medicion_actual, medir
+from .models import Activo, Portafolio, Precio
+from .portafolio import cargar_libros, cargar_matriz_precios, evolucion
+from .valuacion import a_centavos, leer_evolucion
+from .views import muestrear_y_paginar, parametros_evolucion
+
+
+async def en_hilo(fn, *args):
+    """
+    Ejecuta ``fn(*args)`` en un hilo del pool (no en el hilo compartido del ORM
+    async), suma sus consultas a la medición de la petición y devuelve la
+    conexión al terminar.
+    """
+    padre = medicion_actual()
+
+    def tarea():
+        try:
+            with medir() as m:
+                resultado = fn(*args)
+            if padre is not None:
+                padre.sumar(m)
+            return resultado
+        finally:
+            close_old_connections()
+
+    return await sync_to_async(tarea, thread_sensitive=False)()
+
+
+def _portafolio(pf_id):
+    return Portafolio.objects.filter(pk=pf_id).first()
+
+
+def _simbolos(activo_ids):
+    simbolos_map = dict(Activo.objects.filter(id__in=activo_ids).values_list("id", "simbolo"))
+    return [simbolos_map[aid] for aid in activo_ids]
+
+
+class EvolucionPortafolioAsyncView(View):
+    """
+    GET /api/async/portafolios/<pf_id>/evolucion/ — mismos parámetros, formatos,
+    caché y ETag que ``EvolucionPortafolioAPIView``. No responde antes que la
+    vista síncrona: los datos se leen completos antes de transmitir (ver el
+    docstring del módulo).
+    """
+
+    async def get(self, request, pf_id: int):
+        fi, ff, opciones, error = parametros_evolucion(request)
+        if error is not None:
+            return error
+
+        # portafolio y versión de datos a la vez; las series solo si no hay caché
+        pf, version = await asyncio.gather(en_hilo(_portafolio, pf_id), en_hilo(cache.version_datos, pf_id))
+        if pf is None:
+            return JsonResponse({"detail": f"Portafolio {pf_id} no existe."}, status=404)
+
+        params = {**request.GET.dict(), "formato": opciones["formato"]}
+        clave = cache.clave_respuesta("evolucion", pf_id, params, version)
+        etag = cache.etag_de(clave)
+        no_modificado = get_conditional_response(request, etag=etag)
+        if no_modificado is not None:
+            no_modificado["ETag"] = etag
+            no_modificado["Vary"] = "Accept"
+            return no_modificado
+
+        contenido = await cache.cache_evolucion().aget(clave)
+        if contenido is not None:
+            response = HttpResponse(contenido, content_type=formatos.TIPOS[opciones["formato"]])
+        else:
+            # V_t y weights en una sola lectura: con dos conexiones un refresco confirmado entre
+            # ambas dejaría fechas de W sin V_t
+            datos = await en_hilo(leer_evolucion, pf_id, fi, ff)
+            if datos is None:
+                datos = await self._calcular_en_linea(pf, fi, ff)
+                if isinstance(datos, HttpResponse):
+                    return datos
+            response = self._transmitir(pf, fi, ff, *datos, opciones, clave)
+        response["ETag"] = etag
+        response["Cache-Control"] = "private, no-cache"
+        response["Vary"] = "Accept"
+        return response
+
+    @staticmethod
+    async def _calcular_en_linea(pf, fi, ff):
+        libro = (await en_hilo(cargar_libros, [pf.id])).get(pf.id)
+        if libro is None:
+            return JsonResponse(
+                {"detail": "No hay cantidades (C_{i,0}) para este portafolio. Ejecute calc_cantidades_iniciales."},
+                status=400
+            )
+        simbolos, (fechas, P) = await asyncio.gather(
+            en_hilo(_simbolos, libro.activo_ids),
+            en_hilo(cargar_matriz_precios, libro.activo_ids, fi, ff),
+        )
+        if not fechas:
+            return JsonResponse({"detail": "No hay precios para el rango solicitado."}, status=400)
+        _, Vt, W = evolucion(P, libro.cantidades(fechas))
+        return fechas, simbolos, a_centavos(Vt), W
+
+    @staticmethod
+    def _transmitir(pf, fi, ff, fechas, simbolos, Vt, W, opciones, clave):
+        idx, siguiente = muestrear_y_paginar(fechas, Vt, opciones)
+        cabecera = {
+            "portafolio": {"id": pf.id, "nombre": pf.nombre},
+            "rango": {"inicio": fi.isoformat(), "fin": ff.isoformat()},
+        }
+        if opciones["limite"]:
+            cabecera["siguiente"] = siguiente
+        partes = formatos.trozos(opciones["formato"], cabecera, [fechas[i] for i in idx], simbolos, Vt[idx], W[idx])
+
+        async def cuerpo():
+            enviados = []
+            for parte in partes:
+                enviados.append(parte)
+                yield parte
+                await asyncio.sleep(0)  # cede el loop entre trozos
+            await sync_to_async(cache.guardar)(clave, b"".join(enviados))
+
+        return StreamingHttpResponse(cuerpo(), content_type=formatos.TIPOS[opciones["formato"]])
+
+
+def _rango_precios():
+    primera = Precio.objects.order_by("fecha").values_list("fecha", flat=True).first()
+    ultima = Precio.objects.order_by("-fecha").values_list("fecha", flat=True).first()
+    return primera, ultima
+
+
+async def viz_evolucion_async(request):
+    """Como ``viz_evolucion``: primer portafolio y rango de precios, consultados a la vez."""
+    pf, (fi, ff) = await asyncio.gather(
+        en_hilo(lambda: Portafolio.objects.order_by("id").first()),
+        en_hilo(_rango_precios),
+    )
+    ctx = {
+        "defaults": {
+            "pf_id": pf.id if pf else 1,
+            "fi": fi.isoformat() if fi else "2022-02-15",
+            "ff": ff.isoformat() if ff else "2023-02-16",
+        }
+    }
+    return render(request, "inversiones/evolucion.html", ctx)
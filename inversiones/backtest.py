@@ -0,0 +1,187 @@
+# inversiones/backtest.py
+"""
+Backtest de rebalanceo periódico hacia los weights objetivo.
+
+Invierte V0 en t0 según los ``Weight`` del portafolio (los vigentes al inicio
+del rango) y recorre la matriz fechas × activos de precios. Cada variante
+decide cuándo volver a los weights objetivo:
+
+- por calendario: al cierre de cada semana, mes o trimestre (``frecuencia``
+  "W", "M" o "Q", los mismos períodos que el remuestreo de la evolución), o
+  nunca ("ninguna": comprar y mantener);
+- con ``banda``: solo cuando algún weight se alejó del objetivo más que la
+  banda, en las fechas del calendario (o cualquier día con "ninguna").
+
+Cada rebalanceo, incluida la compra inicial, paga ``costo`` por unidad
+negociada: Σ_i |w_i · V - x_i| · costo, sobre el valor previo al pago. Lo que
+no suman los weights (Σ w < 1) queda como efectivo sin rendimiento.
+
+Entre rebalanceos las cantidades no cambian, así que el único paso secuencial
+es de rebalanceo en rebalanceo: cada uno es una operación sobre el vector de
+activos, y la búsqueda del siguiente fuera de la banda evalúa las fechas
+candidatas por bloques, como matriz. El valor diario sale al final de una sola
+expresión sobre la matriz de precios. Las variantes son independientes y se
+reparten en un pool de procesos.
+
+Los precios faltantes se arrastran desde el último conocido; todos los activos
+con weight deben tener precio en t0.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+
+import django
+import numpy as np
+from django.db.models import Max, Min
+
+from . import analitica, micro
+from .models import Weight
+from .portafolio import cargar_matriz_precios, indices_remuestreo
+
+FRECUENCIAS = ("ninguna", "W", "M", "Q")
+BLOQUE_BANDA = 256  # fechas candidatas que se evalúan por vez al buscar la salida de la banda
+
+
+def variantes(frecuencias=("M",), bandas=(None,), costos=(0.0,)):
+    """
+    Grilla de variantes: todas las combinaciones de frecuencia, banda (None o 0:
+    sin banda) y costo. ValueError si algún valor no es válido.
+    """
+    for f in frecuencias:
+        if f not in FRECUENCIAS:
+            raise ValueError(f"frecuencia debe ser uno de: {', '.join(FRECUENCIAS)}.")
+    for b in bandas:
+        if b is not None and not 0 <= b < 1:
+            raise ValueError("banda debe estar entre 0 y 1.")
+    for c in costos:
+        if not 0 <= c < 1:
+            raise ValueError("costo debe estar entre 0 y 1.")
+    return [{"frecuencia": f, "banda": b or None, "costo": c} for f, b, c in product(frecuencias, bandas, costos)]
+
+
+def cargar_insumos(pf_id, fi=None, ff=None):
+    """
+    Weights objetivo del portafolio (los de la última fecha <= ``fi``, o los
+    primeros si no hay ``fi``) y precios de sus activos en [fi, ff], con los
+    faltantes arrastrados por ``cargar_matriz_precios``. Devuelve
+    ``(fecha_weights, simbolos, w, fechas, P)``; ValueError si faltan weights o
+    precios en t0.
+    """
+    weights = Weight.objects.filter(portafolio_id=pf_id)
+    if fi is not None:
+        fecha_w = weights.filter(fecha__lte=fi).aggregate(f=Max("fecha"))["f"]
+    else:
+        fecha_w = weights.aggregate(f=Min("fecha"))["f"]
+    if fecha_w is None:
+        raise ValueError("No hay weights del portafolio al inicio del rango.")
+
+    filas = list(weights.filter(fecha=fecha_w).exclude(weight=0).order_by("activo_id")
+                 .values_list("activo_id", "activo__simbolo", micro.en_micro("weight")))
+    if not filas:
+        raise ValueError("No hay weights del portafolio al inicio del rango.")
+    activo_ids = [aid for aid, _, _ in filas]
+    simbolos = [s for _, s, _ in filas]
+    w = micro.a_float(micro.arreglo((x for _, _, x in filas), len(filas)))
+
+    fechas, P = cargar_matriz_precios(activo_ids, fi or fecha_w, ff)
+    if not fechas:
+        raise ValueError("No hay precios para el rango solicitado.")
+    sin_precio = [s for s, p in zip(simbolos, P[0].tolist()) if not p > 0]  # NaN, 0 o negativo
+    if sin_precio:
+        raise ValueError(f"Sin precio en {fechas[0].isoformat()}: {', '.join(sin_precio)}.")
+    return fecha_w, simbolos, w, fechas, P
+
+
+def candidatos(fechas, frecuencia, con_banda=False):
+    """Índices de las fechas en que la variante puede rebalancear (después de t0)."""
+    if frecuencia == "ninguna":
+        return np.arange(1, len(fechas)) if con_banda else np.empty(0, dtype=np.int64)
+    cierres = indices_remuestreo(fechas, frecuencia)[:-1]  # el último cierre es el fin del rango
+    return cierres[cierres > 0]
+
+
+def _siguiente(P, w, Q, efectivo, pendientes, banda):
+    """Primera fecha de ``pendientes`` en que algún weight sale de la banda, o None."""
+    for inicio in range(0, pendientes.size, BLOQUE_BANDA):
+        c = pendientes[inicio:inicio + BLOQUE_BANDA]
+        X = P[c] * Q
+        V = X.sum(axis=1) + efectivo
+        fuera = (np.abs(X / V[:, None] - w) > banda).any(axis=1)
+        if fuera.any():
+            return int(c[np.argmax(fuera)])
+    return None
+
+
+def simular(P, w, v0, indices, banda=None, costo=0.0):
+    """
+    Una variante sobre ``P`` (fechas × activos, sin faltantes) y weights ``w``,
+    rebalanceando en las fechas ``indices`` (ver ``candidatos``).
+    Devuelve ``(V, eventos, negociado)``: valor diario, índices de los
+    rebalanceos (el primero es la compra en t0) y monto negociado en cada uno.
+    """
+    invertido = float(w.sum())
+    eventos, tenencias, efectivos, negociado = [], [], [], []
+    Q, efectivo, k = np.zeros_like(w), float(v0), 0
+    while k is not None:
+        x = Q * P[k]
+        V = float(x.sum()) + efectivo
+        monto = float(np.abs(w * V - x).sum())
+        V -= monto * costo
+        Q, efectivo = w * V / P[k], V * (1 - invertido)
+        eventos.append(k)
+        tenencias.append(Q)
+        efectivos.append(efectivo)
+        negociado.append(monto)
+
+        pendientes = indices[np.searchsorted(indices, k, side="right"):]
+        if banda is None:
+            k = int(pendientes[0]) if pendientes.size else None
+        else:
+            k = _siguiente(P, w, Q, efectivo, pendientes, banda)
+
+    # cantidades vigentes en cada fecha: las del último rebalanceo
+    segmento = np.searchsorted(eventos, np.arange(P.shape[0]), side="right") - 1
+    V = np.einsum("da,da->d", P, np.array(tenencias)[segmento]) + np.array(efectivos)[segmento]
+    return V, np.array(eventos), np.array(negociado)
+
+
+def evaluar(fechas, P, w, v0, variante, indices):
+    """Simula una variante y resume su resultado. Devuelve ``(resumen, V)``."""
+    V, eventos, negociado = simular(P, w, v0, indices, variante["banda"], variante["costo"])
+    r = np.concatenate(([V[0] / v0 - 1], V[1:] / V[:-1] - 1))  # r[0]: el costo de la compra inicial
+    resumen, _, _ = analitica.resumir(fechas, r)
+    rotacion = float(negociado[1:].sum() / V.mean())
+    resumen.update({
+        "valor_final": float(V[-1]),
+        "rebalanceos": int(eventos.size - 1),
+        "rotacion_anualizada": rotacion * analitica.DIAS_ANIO / resumen["dias"] if resumen["dias"] else None,
+        "costos": float(negociado.sum() * variante["costo"]),
+    })
+    return resumen, V
+
+
+def _bloque(fechas, P, w, v0, lote):
+    """Trabajo de un worker: un tramo de variantes (los candidatos se calculan una vez por frecuencia)."""
+    indices = {}
+    resultados = []
+    for v in lote:
+        clave = (v["frecuencia"], v["banda"] is not None)
+        if clave not in indices:
+            indices[clave] = candidatos(fechas, *clave)
+        resultados.append(evaluar(fechas, P, w, v0, v, indices[clave]))
+    return resultados
+
+
+def ejecutar(fechas, P, w, v0, lote, procesos=1):
+    """
+    ``(resumen, V)`` de cada variante de ``lote``, en orden. Con ``procesos > 1``
+    reparte tramos de variantes en un pool; los workers no usan la base de datos.
+    """
+    if procesos <= 1 or len(lote) <= 1:
+        return _bloque(fechas, P, w, v0, lote)
+    n = min(procesos, len(lote))
+    cortes = np.linspace(0, len(lote), n + 1).astype(int)
+    tramos = [lote[a:b] for a, b in zip(cortes[:-1], cortes[1:])]
+    # initializer: con "spawn" el worker necesita configurar Django antes de importar este módulo
+    with ProcessPoolExecutor(max_workers=n, initializer=django.setup) as pool:
+        partes = pool.map(_bloque, *zip(*[(fechas, P, w, v0, t) for t in tramos]))
+        return [r for parte in partes for r in parte]
@@ -0,0 +1,663 @@
+# inversiones/benchmarks.py
+"""
+Benchmarks de rendimiento del motor de portafolios.
+
+Cada caso devuelve un dict con tiempos y métricas para que el comando
+``python manage.py benchmark <caso>`` los imprima. Los casos que usan la base
+de datos corren sobre una base temporal (como el test runner de Django), nunca
+sobre la configurada.
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+
+import django
+import numpy as np
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment,
+)
+
+from . import formatos
+from .cache import cache_evolucion
+from .metricas import REGISTRO
+from .models import Activo, Cantidad, Operacion, Portafolio, Precio, ValorActivo, Weight
+from .portafolio import matriz_desde_filas, evolucion, series_evolucion
+
+
+def filas_sinteticas(n_activos, n_dias, semilla=42, fecha_inicial=date(2015, 1, 1)):
+    """
+    Genera filas (activo_id, fecha, precio) como las entrega ``Precio.values_list``:
+    un paseo aleatorio geométrico por activo con precios ``Decimal`` de 6 decimales.
+    """
+    rng = np.random.default_rng(semilla)
+    retornos = rng.normal(0.0003, 0.01, size=(n_dias, n_activos))
+    precios = 100 * np.exp(np.cumsum(retornos, axis=0))
+    fechas = [fecha_inicial + timedelta(days=d) for d in range(n_dias)]
+    filas = []
+    for d, fch in enumerate(fechas):
+        for i in range(n_activos):
+            filas.append((i + 1, fch, Decimal(f"{precios[d, i]:.6f}")))
+    cantidades = {i + 1: Decimal(f"{q:.6f}") for i, q in enumerate(rng.uniform(1, 1000, n_activos))}
+    return filas, cantidades
+
+
+def calculo_decimal(filas, cantidades):
+    """Cálculo de referencia con ``Decimal`` fila por fila (implementación original)."""
+    by_date = {}
+    for aid, fch, p in filas:
+        ci = cantidades.get(aid)
+        if ci is None:
+            continue
+        xi = p * ci
+        d = by_date.setdefault(fch, {"xi": {}, "Vt": Decimal("0")})
+        d["xi"][aid] = xi
+        d["Vt"] += xi
+
+    resultado = {}
+    for fch in sorted(by_date.keys()):
+        Vt = by_date[fch]["Vt"]
+        w = {aid: xi / Vt for aid, xi in by_date[fch]["xi"].items()} if Vt != 0 else {}
+        resultado[fch] = (Vt, w)
+    return resultado
+
+
+def evolucion_decimal(filas, cantidades):
+    """Respuesta completa (cálculo + serialización) con el camino ``Decimal``."""
+    vt_series, weights_series = [], []
+    for fch, (Vt, w) in calculo_decimal(filas, cantidades).items():
+        vt_series.append({"fecha": fch.isoformat(), "valor": float(Vt)})
+        w_list = [{"activo": str(aid), "valor": float(wi)} for aid, wi in w.items()]
+        weights_series.append({"fecha": fch.isoformat(), "w": w_list})
+    return vt_series, weights_series
+
+
+def calculo_vectorizado(filas, cantidades):
+    """Mismo cálculo con el motor NumPy, incluida la construcción de la matriz."""
+    activo_ids = list(cantidades.keys())
+    fechas, P = matriz_desde_filas(activo_ids, filas)
+    _, Vt, W = evolucion(P, [cantidades[a] for a in activo_ids])
+    return activo_ids, fechas, Vt, W
+
+
+def evolucion_vectorizada(filas, cantidades):
+    """Respuesta completa (cálculo + serialización) con el motor NumPy."""
+    activo_ids, fechas, Vt, W = calculo_vectorizado(filas, cantidades)
+    return series_evolucion(fechas, [str(a) for a in activo_ids], Vt, W)
+
+
+def _mejor_tiempo(fn, repeticiones):
+    mejor, resultado = float("inf"), None
+    for _ in range(repeticiones):
+        t = time.perf_counter()
+        resultado = fn()
+        mejor = min(mejor, time.perf_counter() - t)
+    return mejor, resultado
+
+
+def _discrepancia(ref, nuevo):
+    """Máximo error relativo en V_t y absoluto en w_{i,t} entre dos series."""
+    vt_ref, w_ref = ref
+    vt_new, w_new = nuevo
+    err_vt = max((abs(a["valor"] - b["valor"]) / abs(a["valor"])
+                  for a, b in zip(vt_ref, vt_new) if a["valor"]), default=0.0)
+    err_w = 0.0
+    for a, b in zip(w_ref, w_new):
+        wb = {w["activo"]: w["valor"] for w in b["w"]}
+        for w in a["w"]:
+            err_w = max(err_w, abs(w["valor"] - wb[w["activo"]]))
+    return err_vt, err_w
+
+
+def bench_evolucion(n_activos=200, n_dias=2520, repeticiones=3, semilla=42):
+    """Compara el loop ``Decimal`` original contra el motor vectorizado."""
+    filas, cantidades = filas_sinteticas(n_activos, n_dias, semilla)
+    t_calc_dec, _ = _mejor_tiempo(lambda: calculo_decimal(filas, cantidades), repeticiones)
+    t_calc_vec, _ = _mejor_tiempo(lambda: calculo_vectorizado(filas, cantidades), repeticiones)
+    t_dec, ref = _mejor_tiempo(lambda: evolucion_decimal(filas, cantidades), repeticiones)
+    t_vec, nuevo = _mejor_tiempo(lambda: evolucion_vectorizada(filas, cantidades), repeticiones)
+    err_vt, err_w = _discrepancia(ref, nuevo)
+    return {
+        "filas": len(filas),
+        "calculo_decimal_s": t_calc_dec,
+        "calculo_vectorizado_s": t_calc_vec,
+        "speedup_calculo": t_calc_dec / t_calc_vec if t_calc_vec else float("inf"),
+        "decimal_s": t_dec,
+        "vectorizado_s": t_vec,
+        "speedup": t_dec / t_vec if t_vec else float("inf"),
+        "max_err_rel_Vt": err_vt,
+        "max_err_abs_w": err_w,
+    }
+
+
+def bench_formatos(n_activos=200, n_dias=2520, repeticiones=3, semilla=42):
+    """Bytes y tiempo de serialización de la respuesta de evolución en cada formato."""
+    filas, cantidades = filas_sinteticas(n_activos, n_dias, semilla)
+    activo_ids, fechas, Vt, W = calculo_vectorizado(filas, cantidades)
+    simbolos = [f"A{a}" for a in activo_ids]
+    cabecera = {"portafolio": {"id": 1, "nombre": "Portafolio 1"},
+                "rango": {"inicio": fechas[0].isoformat(), "fin": fechas[-1].isoformat()}}
+    resultados = []
+    for formato in formatos.TIPOS:
+        t, (contenido, _) = _mejor_tiempo(
+            lambda: formatos.codificar(formato, cabecera, fechas, simbolos, Vt, W), repeticiones
+        )
+        resultados.append({"formato": formato, "bytes": len(contenido), "segundos": t})
+    return resultados
+
+
+@contextmanager
+def base_temporal(perfil=None):
+    """
+    Crea y migra una base de pruebas temporal; la destruye al salir. Con
+    ``perfil`` (clave de ``DB_PERFILES``) la base es un archivo con esas
+    opciones: en la base en memoria de las pruebas el journal y el lock de
+    SQLite no se comportan como en disco.
+    """
+    ajustes = connection.settings_dict  # el mismo dict que usan las conexiones de otros hilos
+    originales = {k: ajustes[k] for k in ("NAME", "OPTIONS", "CONN_MAX_AGE", "CONN_HEALTH_CHECKS", "TEST")}
+    directorio = None
+    if perfil is not None:
+        directorio = tempfile.mkdtemp(prefix="bench-db-")
+        connection.close()
+        ajustes.update({"OPTIONS": {}, "CONN_MAX_AGE": 0, "CONN_HEALTH_CHECKS": False,
+                        **settings.DB_PERFILES[perfil]})
+        ajustes["TEST"] = {**ajustes["TEST"], "NAME": os.path.join(directorio, "bench.sqlite3")}
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(originales["NAME"], verbosity=0)
+        teardown_test_environment()
+        ajustes.update(originales)
+        if directorio is not None:
+            shutil.rmtree(directorio, ignore_errors=True)
+
+
+def poblar_base(n_activos, n_dias, n_portafolios=1, semilla=42, fecha_inicial=date(2015, 1, 1)):
+    """
+    Carga activos, precios sintéticos y cantidades en la base actual.
+    Devuelve ``(portafolios, simbolos, fechas)``.
+    """
+    filas, _ = filas_sinteticas(n_activos, n_dias, semilla, fecha_inicial)
+    rng = np.random.default_rng(semilla + 1)
+    Activo.objects.bulk_create([Activo(nombre=f"A{i}", simbolo=f"A{i}") for i in range(1, n_activos + 1)])
+    ids = dict(Activo.objects.values_list("simbolo", "id"))
+    Precio.objects.bulk_create(
+        [Precio(activo_id=ids[f"A{aid}"], fecha=fch, precio=p) for aid, fch, p in filas],
+        batch_size=2000,
+    )
+    portafolios = [Portafolio.objects.create(nombre=f"Portafolio {k}") for k in range(1, n_portafolios + 1)]
+    Cantidad.objects.bulk_create([
+        Cantidad(portafolio=pf, activo_id=aid, cantidad=Decimal(f"{rng.uniform(1, 1000):.6f}"))
+        for pf in portafolios for aid in ids.values()
+    ])
+    fechas = [fecha_inicial + timedelta(days=d) for d in range(n_dias)]
+    return portafolios, list(ids), fechas
+
+
+def operaciones_sinteticas(n, simbolos, fechas, semilla=42):
+    """Lote de ``n`` operaciones aleatorias con el formato del endpoint."""
+    rng = np.random.default_rng(semilla)
+    idx_s = rng.integers(0, len(simbolos), n)
+    idx_f = rng.integers(0, len(fechas), n)
+    cantidades = np.round(rng.uniform(1, 100, n), 2)
+    tipos = rng.random(n) < 0.6
+    return [
+        {"activo": simbolos[i], "fecha": fechas[f].isoformat(), "cantidad": float(c),
+         "tipo": "compra" if t else "venta"}
+        for i, f, c, t in zip(idx_s.tolist(), idx_f.tolist(), cantidades.tolist(), tipos.tolist())
+    ]
+
+
+def bench_operaciones(tamanos=(1000, 10000, 100000), n_activos=50, n_dias=500, semilla=42):
+    """
+    Throughput (ops/seg) de ``RegistrarOperacionAPIView`` con lotes de distintos
+    tamaños, incluido el recálculo de la valuación materializada.
+    """
+    resultados = []
+    with base_temporal():
+        portafolios, simbolos, fechas = poblar_base(n_activos, n_dias, semilla=semilla)
+        pf = portafolios[0]
+        client = Client()
+        for n in tamanos:
+            body = json.dumps(operaciones_sinteticas(n, simbolos, fechas, semilla))
+            with CaptureQueriesContext(connection) as q:
+                t = time.perf_counter()
+                r = client.post(f"/api/portafolios/{pf.id}/operaciones/", body,
+                                content_type="application/json")
+                dt = time.perf_counter() - t
+            resultados.append({
+                "operaciones": n, "status": r.status_code, "segundos": dt,
+                "ops_por_seg": n / dt, "consultas": len(q),
+            })
+    return resultados
+
+
+# ---------------------------------------------------------------------------
+# Suite: N activos × D días × P portafolios × K operaciones
+# ---------------------------------------------------------------------------
+
+METRICAS_COMPARABLES = ("p50_ms", "p95_ms", "consultas", "memoria_pico_mb")
+
+
+def escenario_sintetico(n_activos, n_dias, n_portafolios=2, n_operaciones=1000, semilla=42):
+    """
+    Puebla la base actual con un escenario completo: precios, weights en t0,
+    cantidades y ``n_operaciones`` repartidas entre los portafolios, con la
+    valuación ya materializada. Devuelve ``(portafolios, simbolos, fechas)``.
+    """
+    from .valuacion import refrescar_valuaciones
+
+    portafolios, simbolos, fechas = poblar_base(n_activos, n_dias, n_portafolios, semilla)
+    ids = dict(Activo.objects.values_list("simbolo", "id"))
+    w = Decimal(1) / n_activos
+    Weight.objects.bulk_create([
+        Weight(portafolio=pf, activo_id=ids[s], fecha=fechas[0], weight=w.quantize(Decimal("0.000001")))
+        for pf in portafolios for s in simbolos
+    ], batch_size=2000)
+    ops = operaciones_sinteticas(n_operaciones, simbolos, fechas, semilla)
+    Operacion.objects.bulk_create([
+        Operacion(portafolio=portafolios[k % len(portafolios)], activo_id=ids[op["activo"]],
+                  fecha=op["fecha"], cantidad=Decimal(str(op["cantidad"])), tipo=op["tipo"])
+        for k, op in enumerate(ops)
+    ], batch_size=2000)
+    refrescar_valuaciones()
+    return portafolios, simbolos, fechas
+
+
+def escribir_csv_precios(path, simbolos, fechas, semilla=42):
+    """Escribe la tabla ancha de precios del escenario (fecha + una columna por activo)."""
+    filas, _ = filas_sinteticas(len(simbolos), len(fechas), semilla, fechas[0])
+    precios = np.array([float(p) for _, _, p in filas]).reshape(len(fechas), len(simbolos))
+    with open(path, "w") as f:
+        f.write("fecha," + ",".join(simbolos) + "\n")
+        for fch, fila in zip(fechas, precios):
+            f.write(fch.isoformat() + "," + ",".join(f"{p:.6f}" for p in fila) + "\n")
+
+
+def medir(fn, repeticiones=5, preparar=None):
+    """
+    Ejecuta ``fn`` ``repeticiones`` veces (``preparar`` corre antes de cada una,
+    fuera del tiempo medido) y devuelve percentiles de latencia, consultas SQL
+    de la última corrida y memoria pico de Python en una corrida extra con
+    tracemalloc (aparte, para no inflar los tiempos).
+    """
+    tiempos, consultas = [], 0
+    for _ in range(repeticiones):
+        if preparar:
+            preparar()
+        with CaptureQueriesContext(connection) as q:
+            t = time.perf_counter()
+            fn()
+            tiempos.append(time.perf_counter() - t)
+        consultas = len(q)
+
+    if preparar:
+        preparar()
+    tracemalloc.start()
+    try:
+        fn()
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    ms = np.array(tiempos) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99]).tolist()
+    return {
+        "repeticiones": repeticiones,
+        "p50_ms": p50, "p95_ms": p95, "p99_ms": p99,
+        "min_ms": float(ms.min()), "max_ms": float(ms.max()),
+        "consultas": consultas,
+        "memoria_pico_mb": pico / 2 ** 20,
+    }
+
+
+def ejecutar_suite(n_activos=50, n_dias=500, n_portafolios=2, n_operaciones=1000, repeticiones=5, semilla=42):
+    """
+    Corre la suite sobre la base actual (que debe estar vacía): import_datos,
+    calc_cantidades_iniciales, registro de operaciones y evolución (en frío y
+    desde caché). Devuelve ``{caso: métricas}``.
+    """
+    portafolios, simbolos, fechas = escenario_sintetico(n_activos, n_dias, n_portafolios, n_operaciones, semilla)
+    pf = portafolios[0]
+    client = Client()
+    resultados = {}
+
+    directorio = tempfile.mkdtemp()
+    try:
+        csv = os.path.join(directorio, "precios.csv")
+        escribir_csv_precios(csv, simbolos, fechas, semilla)
+        resultados["import_datos"] = medir(
+            lambda: call_command("import_datos", csv, stdout=StringIO()),
+            repeticiones, preparar=lambda: Precio.objects.all().delete(),
+        )
+    finally:
+        shutil.rmtree(directorio)
+
+    resultados["calc_cantidades_iniciales"] = medir(
+        lambda: call_command("calc_cantidades_iniciales", "--t0", fechas[0].isoformat(), "--overwrite",
+                             stdout=StringIO()),
+        repeticiones,
+    )
+
+    lote = json.dumps(operaciones_sinteticas(n_operaciones, simbolos, fechas, semilla + 1))
+    url_ops = f"/api/portafolios/{pf.id}/operaciones/"
+
+    def registrar():
+        r = client.post(url_ops, lote, content_type="application/json")
+        assert r.status_code == 201, r.content[:200]
+    resultados["registrar_operaciones"] = medir(registrar, repeticiones)
+
+    url_ev = f"/api/portafolios/{pf.id}/evolucion/?fecha_inicio={fechas[0]}&fecha_fin={fechas[-1]}"
+
+    def evolucion_get():
+        r = client.get(url_ev)
+        assert r.status_code == 200, r.content[:200]
+    resultados["evolucion"] = medir(evolucion_get, repeticiones, preparar=cache_evolucion().clear)
+    resultados["evolucion_cache"] = medir(evolucion_get, repeticiones)
+
+    url_lote = f"/api/portafolios/evolucion/?fecha_inicio={fechas[0]}&fecha_fin={fechas[-1]}"
+
+    def lote_get():
+        r = client.get(url_lote)
+        assert r.status_code == 200, r.content[:200]
+    resultados["evolucion_lote"] = medir(lote_get, repeticiones, preparar=cache_evolucion().clear)
+    return resultados
+
+
+def bench_lote(n_activos=50, n_dias=500, n_portafolios=20, n_operaciones=1000, repeticiones=3, semilla=42):
+    """
+    Evolución de todos los portafolios: una petición por portafolio (desde la
+    tabla materializada y en línea) contra una sola petición de lote.
+    """
+    with base_temporal():
+        portafolios, _, fechas = escenario_sintetico(n_activos, n_dias, n_portafolios, n_operaciones, semilla)
+        client = Client()
+        rango = f"fecha_inicio={fechas[0]}&fecha_fin={fechas[-1]}"
+
+        def individuales():
+            for pf in portafolios:
+                r = client.get(f"/api/portafolios/{pf.id}/evolucion/?{rango}")
+                assert r.status_code == 200, r.content[:200]
+
+        def lote():
+            r = client.get(f"/api/portafolios/evolucion/?{rango}")
+            assert r.status_code == 200, r.content[:200]
+
+        resultados = {"individual_materializada": medir(individuales, repeticiones, cache_evolucion().clear)}
+        ValorActivo.objects.all().delete()
+        resultados["individual_en_linea"] = medir(individuales, repeticiones, cache_evolucion().clear)
+        resultados["lote"] = medir(lote, repeticiones, cache_evolucion().clear)
+    return resultados
+
+
+def _commit_actual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def bench_suite(n_activos=50, n_dias=500, n_portafolios=2, n_operaciones=1000, repeticiones=5, semilla=42):
+    """``ejecutar_suite`` sobre una base temporal, con metadatos para comparar entre commits."""
+    parametros = {"activos": n_activos, "dias": n_dias, "portafolios": n_portafolios,
+                  "operaciones": n_operaciones, "repeticiones": repeticiones, "semilla": semilla}
+    with base_temporal():
+        resultados = ejecutar_suite(n_activos, n_dias, n_portafolios, n_operaciones, repeticiones, semilla)
+    return {
+        "meta": {
+            "commit": _commit_actual(),
+            "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "base_de_datos": connection.vendor,
+            "parametros": parametros,
+        },
+        "resultados": resultados,
+    }
+
+
+def comparar_resultados(base, actual, umbral=0.2):
+    """
+    Compara dos salidas de ``bench_suite``. Devuelve filas
+    ``(caso, métrica, antes, después, cambio_relativo, es_regresion)``: tiempos y
+    memoria son regresión si empeoran más que ``umbral``; consultas, con
+    cualquier aumento.
+    """
+    filas = []
+    for caso, metricas in actual["resultados"].items():
+        previas = base["resultados"].get(caso)
+        if previas is None:
+            continue
+        for m in METRICAS_COMPARABLES:
+            antes, despues = previas.get(m), metricas.get(m)
+            if antes is None or despues is None:
+                continue
+            cambio = (despues - antes) / antes if antes else (0.0 if despues == antes else float("inf"))
+            regresion = despues > antes if m == "consultas" else cambio > umbral
+            filas.append((caso, m, antes, despues, cambio, regresion))
+    return filas
+
+
+# ---------------------------------------------------------------------------
+# Carga concurrente: WSGI (wsgi.py + vista síncrona) vs ASGI (asgi.py + vista async)
+# ---------------------------------------------------------------------------
+
+def _peticion_wsgi(app, path, query, cuerpo=None):
+    """GET a la app WSGI, o POST de ``cuerpo`` (JSON) si se da. Devuelve ``(status, bytes)``."""
+    environ = {
+        "REQUEST_METHOD": "GET", "PATH_INFO": path, "QUERY_STRING": query, "SCRIPT_NAME": "",
+        "SERVER_NAME": "testserver", "SERVER_PORT": "80", "HTTP_HOST": "testserver",
+        "REMOTE_ADDR": "127.0.0.1", "SERVER_PROTOCOL": "HTTP/1.1",
+        "wsgi.input": BytesIO(), "wsgi.errors": StringIO(), "wsgi.url_scheme": "http",
+        "wsgi.version": (1, 0), "wsgi.multithread": True, "wsgi.multiprocess": False, "wsgi.run_once": False,
+    }
+    if cuerpo is not None:
+        environ.update({"REQUEST_METHOD": "POST", "wsgi.input": BytesIO(cuerpo),
+                        "CONTENT_TYPE": "application/json", "CONTENT_LENGTH": str(len(cuerpo))})
+    estado = []
+    cuerpo = app(environ, lambda status, headers, exc_info=None: estado.append(int(status[:3])))
+    try:
+        n_bytes = sum(len(b) for b in cuerpo)
+    finally:
+        if hasattr(cuerpo, "close"):
+            cuerpo.close()
+    return estado[0], n_bytes
+
+
+async def _peticion_asgi(app, path, query):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": query.encode(),
+        "root_path": "", "headers": [(b"host", b"testserver")],
+        "client": ("127.0.0.1", 50000), "server": ("testserver", 80),
+    }
+    recibido = False
+    desconexion = asyncio.Event()
+
+    async def receive():
+        nonlocal recibido
+        if not recibido:
+            recibido = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await desconexion.wait()
+        return {"type": "http.disconnect"}
+
+    resultado = {"status": None, "bytes": 0}
+
+    async def send(mensaje):
+        if mensaje["type"] == "http.response.start":
+            resultado["status"] = mensaje["status"]
+        elif mensaje["type"] == "http.response.body":
+            resultado["bytes"] += len(mensaje.get("body", b""))
+
+    await app(scope, receive, send)
+    desconexion.set()
+    return resultado["status"], resultado["bytes"]
+
+
+def _resumen_carga(servidor, concurrencia, latencias, estados, duracion):
+    ms = np.array(latencias) * 1000
+    p50, p99 = np.percentile(ms, [50, 99]).tolist()
+    return {
+        "servidor": servidor, "concurrencia": concurrencia, "peticiones": len(latencias),
+        "rps": len(latencias) / duracion, "p50_ms": p50, "p99_ms": p99,
+        "errores": sum(1 for e in estados if e != 200),
+    }
+
+
+def carga_wsgi(app, path, consultas, concurrencia):
+    """``consultas`` (query strings) contra la app WSGI desde ``concurrencia`` hilos."""
+    def una(query):
+        t = time.perf_counter()
+        estado, _ = _peticion_wsgi(app, path, query)
+        return time.perf_counter() - t, estado
+
+    t = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+        resultados = list(pool.map(una, consultas))
+    duracion = time.perf_counter() - t
+    return _resumen_carga("wsgi", concurrencia, [r[0] for r in resultados], [r[1] for r in resultados], duracion)
+
+
+def carga_asgi(app, path, consultas, concurrencia):
+    """``consultas`` contra la app ASGI con a lo más ``concurrencia`` peticiones en vuelo."""
+    async def todas():
+        limite = asyncio.Semaphore(concurrencia)
+
+        async def una(query):
+            async with limite:
+                t = time.perf_counter()
+                estado, _ = await _peticion_asgi(app, path, query)
+                return time.perf_counter() - t, estado
+
+        return await asyncio.gather(*(una(q) for q in consultas))
+
+    t = time.perf_counter()
+    resultados = asyncio.run(todas())
+    duracion = time.perf_counter() - t
+    return _resumen_carga("asgi", concurrencia, [r[0] for r in resultados], [r[1] for r in resultados], duracion)
+
+
+def bench_carga(n_activos=50, n_dias=500, n_portafolios=2, concurrencias=(1, 8, 32), peticiones=200,
+                en_cache=False, semilla=42):
+    """
+    Requests/seg y latencias p50/p99 de la API de evolución bajo concurrencia:
+    la app de ``wsgi.py`` con la vista síncrona contra la de ``asgi.py`` con la
+    vista async, en el mismo proceso (sin servidor HTTP de por medio). Sin
+    ``en_cache`` cada petición usa parámetros distintos y se calcula.
+    """
+    from portafolio_project.asgi import application as app_asgi
+    from portafolio_project.wsgi import application as app_wsgi
+
+    resultados = []
+    with base_temporal():
+        portafolios, _, fechas = escenario_sintetico(n_activos, n_dias, n_portafolios, n_operaciones=100,
+                                                     semilla=semilla)
+        for c in concurrencias:
+            for servidor, path, correr, app in (
+                ("wsgi", "/api/portafolios/{}/evolucion/", carga_wsgi, app_wsgi),
+                ("asgi", "/api/async/portafolios/{}/evolucion/", carga_asgi, app_asgi),
+            ):
+                consultas = [
+                    f"fecha_inicio={fechas[0]}&fecha_fin={fechas[-1]}&formato=columnar"
+                    + ("" if en_cache else f"&n={servidor}{c}-{k}")
+                    for k in range(peticiones)
+                ]
+                cache_evolucion().clear()
+                pf = portafolios[0]
+                resultados.append(correr(app, path.format(pf.id), consultas, c))
+    return resultados
+
+
+# ---------------------------------------------------------------------------
+# Concurrencia de lectores y escritores por perfil de base de datos
+# ---------------------------------------------------------------------------
+
+def _cliente_concurrencia(tipo, trabajos):
+    """Un cliente del benchmark de concurrencia, en su propio proceso: ``(medidas, reintentos)``."""
+    from portafolio_project.wsgi import application as app
+
+    logging.getLogger("django.request").setLevel(logging.CRITICAL)  # los 500 esperados se cuentan
+    reintentos_antes = sum(REGISTRO.reintentos.series.values())
+    medidas = []
+    for path, query, cuerpo in trabajos:
+        t = time.perf_counter()
+        estado, _ = _peticion_wsgi(app, path, query, cuerpo)
+        medidas.append((tipo, time.perf_counter() - t, estado))
+    return medidas, sum(REGISTRO.reintentos.series.values()) - reintentos_antes
+
+
+def bench_concurrencia(perfiles=("desarrollo", "produccion"), lectores=6, escritores=3, peticiones=20,
+                       n_activos=20, n_dias=250, n_portafolios=3, ops_por_lote=10, reintentos=None, semilla=42):
+    """
+    Carga mixta sobre una base en disco por perfil de ``DB_PERFILES``:
+    ``lectores`` clientes piden la evolución (sin caché) mientras
+    ``escritores`` registran lotes de ``ops_por_lote`` operaciones con el
+    recálculo síncrono; cada uno hace ``peticiones`` peticiones a la app de
+    ``wsgi.py``. Cada cliente es un proceso (como los workers de un servidor
+    WSGI), así que compiten por el lock de SQLite y no por el GIL; usa
+    ``fork`` (Linux). ``reintentos`` fija ``DB_REINTENTOS`` (None: el
+    configurado). Informa, por perfil y tipo, peticiones/s, latencias,
+    errores (status inesperado) y reintentos.
+    """
+    contexto = multiprocessing.get_context("fork")
+    reintentos = settings.DB_REINTENTOS if reintentos is None else reintentos
+    resultados = []
+    for perfil in perfiles:
+        with base_temporal(perfil), override_settings(DB_REINTENTOS=reintentos):
+            portafolios, simbolos, fechas = escenario_sintetico(n_activos, n_dias, n_portafolios,
+                                                                n_operaciones=100, semilla=semilla)
+            with connection.cursor() as cursor:
+                journal = cursor.execute("PRAGMA journal_mode").fetchone()[0]
+            clientes = [("lectura", [
+                (f"/api/portafolios/{portafolios[(h + k) % n_portafolios].id}/evolucion/",
+                 f"fecha_inicio={fechas[0]}&fecha_fin={fechas[-1]}&formato=columnar&n={perfil}-{h}-{k}", None)
+                for k in range(peticiones)
+            ]) for h in range(lectores)]
+            clientes += [("escritura", [
+                (f"/api/portafolios/{portafolios[(h + k) % n_portafolios].id}/operaciones/", "",
+                 json.dumps(operaciones_sinteticas(ops_por_lote, simbolos, fechas, semilla + h * peticiones + k))
+                 .encode())
+                for k in range(peticiones)
+            ]) for h in range(escritores)]
+            connection.close()  # cada proceso abre su propia conexión
+
+            t = time.perf_counter()
+            with contexto.Pool(len(clientes)) as pool:
+                por_cliente = pool.starmap(_cliente_concurrencia, clientes)
+            duracion = time.perf_counter() - t
+
+            medidas = [m for ms, _ in por_cliente for m in ms]
+            for tipo, esperado in (("lectura", 200), ("escritura", 201)):
+                latencias = [d for tp, d, _ in medidas if tp == tipo]
+                if not latencias:
+                    continue
+                ms = np.array(latencias) * 1000
+                p50, p99 = np.percentile(ms, [50, 99]).tolist()
+                resultados.append({
+                    "perfil": perfil, "journal": journal, "tipo": tipo, "peticiones": len(latencias),
+                    "por_seg": len(latencias) / duracion, "p50_ms": p50, "p99_ms": p99,
+                    "errores": sum(1 for tp, _, e in medidas if tp == tipo and e != esperado),
+                    "reintentos": sum(r for (ms, r), (tp, _) in zip(por_cliente, clientes) if tp == tipo),
+                })
+    return resultados
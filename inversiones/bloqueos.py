@@ -0,0 +1,46 @@
+# inversiones/bloqueos.py
+"""
+Reintentos cuando SQLite responde "database is locked".
+
+SQLite admite un solo escritor. Con el journal de rollback (perfil
+"desarrollo") una transacción que leyó y luego quiere escribir falla de
+inmediato si otra ya escribe, sin esperar el timeout; con WAL e IMMEDIATE
+(perfil "produccion") espera, pero puede agotar el timeout bajo carga. En ambos
+casos repetir la transacción completa un poco después suele bastar.
+
+``reintentar_si_bloqueada`` repite la función con espera exponencial y algo de
+azar (para que los que chocaron no vuelvan a chocar). La función debe abrir
+su propia transacción: dentro de un ``atomic`` externo el error se propaga,
+porque la transacción de afuera ya no sirve y es ella la que hay que repetir.
+"""
+import functools
+import random
+import time
+
+from django.conf import settings
+from django.db import OperationalError, connection
+
+from .metricas import REGISTRO
+
+MENSAJES = ("database is locked", "database table is locked", "database is busy")
+
+
+def bloqueada(exc):
+    return isinstance(exc, OperationalError) and any(m in str(exc) for m in MENSAJES)
+
+
+def reintentar_si_bloqueada(fn):
+    """Decorador: repite ``fn`` hasta ``DB_REINTENTOS`` veces si la base está bloqueada."""
+    @functools.wraps(fn)
+    def envoltorio(*args, **kwargs):
+        intentos = getattr(settings, "DB_REINTENTOS", 4)
+        espera = getattr(settings, "DB_REINTENTO_ESPERA", 0.05)
+        for intento in range(intentos + 1):
+            try:
+                return fn(*args, **kwargs)
+            except OperationalError as e:
+                if not bloqueada(e) or intento == intentos or connection.in_atomic_block:
+                    raise
+            REGISTRO.registrar_reintento(fn.__qualname__)
+            time.sleep(espera * 2 ** intento * random.uniform(0.5, 1.5))
+    return envoltorio
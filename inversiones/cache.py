@@ -0,0 +1,109 @@
+# inversiones/cache.py
+"""
+Caché de respuestas de la API de evolución con invalidación por versión.
+
+Cada respuesta se guarda bajo una clave que incluye la versión de los datos
+(``VersionDatos``: "precios" global y "pf:<id>" por portafolio). Importar
+precios u operar incrementa la versión, así que las entradas viejas quedan
+inalcanzables y el backend las desaloja por LRU. La versión vive en la base de
+datos para que todos los procesos la compartan aunque cada uno tenga su propia
+caché local. El backend es el alias ``evolucion`` de ``settings.CACHES``
+(memoria local, archivo o Redis).
+
+``respuesta_con_cache`` es el protocolo que comparten las vistas de lectura:
+ETag derivado de la clave, 304 ante ``If-None-Match`` y cuerpo en caché.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+
+from .models import VersionDatos
+
+ALIAS = "evolucion"
+
+
+def cache_evolucion():
+    return caches[ALIAS]
+
+
+def version_datos(pf_id):
+    """Versión combinada "precios.pf" de los datos de un portafolio (una consulta)."""
+    versiones = dict(VersionDatos.objects
+                     .filter(clave__in=["precios", f"pf:{pf_id}"])
+                     .values_list("clave", "version"))
+    return f"{versiones.get('precios', 0)}.{versiones.get(f'pf:{pf_id}', 0)}"
+
+
+def version_lote(pf_ids):
+    """Como ``version_datos`` para varios portafolios: "precios.pf1.pf2..." (una consulta)."""
+    claves = ["precios"] + [f"pf:{pf_id}" for pf_id in pf_ids]
+    versiones = dict(VersionDatos.objects.filter(clave__in=claves).values_list("clave", "version"))
+    return ".".join(str(versiones.get(c, 0)) for c in claves)
+
+
+def clave_respuesta(prefijo, pf_id, params, version):
+    """Clave (y ETag) de una respuesta: portafolio, parámetros normalizados y versión."""
+    normalizados = "&".join(f"{k}={v}" for k, v in sorted(params.items()))
+    digest = hashlib.sha1(f"{pf_id}|{normalizados}|{version}".encode()).hexdigest()
+    return f"{prefijo}:{pf_id}:{digest}"
+
+
+def etag_de(clave):
+    return '"%s"' % clave.rsplit(":", 1)[1]
+
+
+def respuesta_con_cache(request, clave, calcular, content_type="application/json", vary=None, guardar_cuerpo=True):
+    """
+    Respuesta de una vista de lectura bajo ``clave`` (``clave_respuesta``):
+    304 si el cliente ya tiene el ETag; si no, el cuerpo guardado o el de
+    ``calcular()``. Una respuesta de ``calcular`` distinta de 200 se devuelve tal
+    cual, sin guardarla. Con ``guardar_cuerpo=False`` (respuestas en streaming)
+    solo se usa el ETag.
+    """
+    etag = etag_de(clave)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        contenido = obtener(clave) if guardar_cuerpo else None
+        if contenido is not None:
+            response = HttpResponse(contenido, content_type=content_type)
+        else:
+            response = calcular()
+            if response.status_code != 200:
+                return response
+            if guardar_cuerpo:
+                guardar(clave, response.content)
+        response["Cache-Control"] = "private, no-cache"  # el navegador revalida con If-None-Match
+    response["ETag"] = etag
+    if vary:
+        response["Vary"] = vary
+    return response
+
+
+def obtener(clave):
+    return cache_evolucion().get(clave)
+
+
+def guardar(clave, contenido):
+    """Guarda el cuerpo de la respuesta si no supera EVOLUCION_CACHE_MAX_BYTES."""
+    if len(contenido) <= getattr(settings, "EVOLUCION_CACHE_MAX_BYTES", 5 * 1024 * 1024):
+        cache_evolucion().set(clave, contenido)
+
+
+def invalidar(pf_ids=(), precios=False):
+    """
+    Incrementa la versión de los portafolios dados y/o la global de precios.
+    Llamar dentro de la misma transacción que modifica los datos.
+    """
+    claves = [f"pf:{pf_id}" for pf_id in pf_ids] + (["precios"] if precios else [])
+    if not claves:
+        return
+    existentes = set(VersionDatos.objects.filter(clave__in=claves).values_list("clave", flat=True))
+    VersionDatos.objects.filter(clave__in=existentes).update(version=F("version") + 1)
+    VersionDatos.objects.bulk_create(
+        [VersionDatos(clave=c, version=1) for c in claves if c not in existentes],
+        ignore_conflicts=True,
+    )
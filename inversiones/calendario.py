@@ -0,0 +1,115 @@
+# inversiones/calendario.py
+"""
+Calendario de negociación y precios as-of.
+
+El calendario son las fechas con al menos un ``Precio`` de cualquier activo. En
+una fecha del calendario, un activo sin precio propio (feriado de su mercado,
+dato atrasado) vale su último precio conocido: así x_{i,t} y V_t cubren
+siempre todas las tenencias en vez de perder el activo ese día.
+
+El índice as-of U (fechas × activos) guarda la fila del último precio válido
+de cada activo en o antes de cada fecha, o -1 si todavía no tiene. Con él el
+arrastre es un solo gather vectorizado, ``P[U, columnas]``, en lugar de una
+consulta por fecha. La instantánea de ``matriz_precios`` lo guarda precalculado
+(``ultimo.npy``) e ``import_datos`` lo extiende desde la primera fecha
+importada; sin instantánea se arma desde la base con tres consultas.
+"""
+import numpy as np
+from django.db.models import OuterRef, Subquery
+
+from . import micro
+from .models import Activo, Precio
+
+
+def indice_asof(P, inicio=0, previo=None):
+    """
+    Índice as-of de ``P`` (NaN donde no hay precio), con filas numeradas desde
+    ``inicio``. ``previo`` (una fila por activo, -1 sin precio) continúa el
+    índice de las filas anteriores a ``P``.
+    """
+    U = np.where(np.isnan(P), -1, np.arange(inicio, inicio + P.shape[0], dtype=np.int64)[:, None])
+    if previo is not None and U.shape[0]:
+        U[0] = np.maximum(U[0], previo)
+    np.maximum.accumulate(U, axis=0, out=U)
+    return U
+
+
+def asof(P, U, previo=None):
+    """
+    Precios de ``P`` arrastrados según ``U`` (índice relativo a las filas de
+    ``P``); donde U es -1 se usa ``previo`` (último precio anterior a ``P``,
+    NaN si no hay).
+    """
+    if not U.size:
+        return np.array(P, dtype=np.float64)
+    resultado = P[np.maximum(U, 0), np.arange(U.shape[1])]
+    faltan = U < 0
+    if faltan.any():
+        relleno = np.nan if previo is None else np.broadcast_to(previo, U.shape)[faltan]
+        resultado[faltan] = relleno
+    return resultado
+
+
+def recortar(fechas, P, U):
+    """
+    Descarta las primeras fechas, en que ningún activo tiene precio todavía,
+    y reajusta U a las filas que quedan. Después de la primera fecha con precio
+    siempre hay alguno (arrastrado), así que basta con el prefijo.
+    """
+    con_precio = ~np.isnan(P).all(axis=1)
+    k = int(con_precio.argmax()) if con_precio.any() else len(fechas)
+    if k:
+        fechas, P, U = fechas[k:], P[k:], np.where(U[k:] >= k, U[k:] - k, -1)
+    return fechas, P, U
+
+
+def fechas_negociacion(fi=None, ff=None):
+    """Fechas del calendario en [fi, ff], ordenadas (una consulta sobre el índice por fecha)."""
+    qs = Precio.objects.order_by("fecha").values_list("fecha", flat=True).distinct()
+    if fi is not None:
+        qs = qs.filter(fecha__gte=fi)
+    if ff is not None:
+        qs = qs.filter(fecha__lte=ff)
+    return list(qs)
+
+
+def ultimos_precios(activo_ids, antes_de):
+    """
+    Último precio de cada activo estrictamente antes de ``antes_de``, en el
+    orden de ``activo_ids`` (NaN si no tiene). Una consulta: por activo, una
+    búsqueda hacia atrás en el índice (activo, fecha).
+    """
+    ultimo = (Precio.objects.filter(activo_id=OuterRef("pk"), fecha__lt=antes_de)
+              .order_by("-fecha").values(p=micro.en_micro("precio"))[:1])
+    valores = dict(Activo.objects.filter(id__in=list(activo_ids))
+                   .annotate(p=Subquery(ultimo)).values_list("id", "p"))
+    return np.array([np.nan if valores.get(aid) is None else valores[aid] for aid in activo_ids],
+                    dtype=np.float64) / micro.ESCALA
+
+
+def cargar_asof(activo_ids, fi=None, ff=None):
+    """
+    Precios de ``activo_ids`` en las fechas del calendario en [fi, ff], con los
+    faltantes arrastrados (también desde antes de ``fi``). Devuelve
+    ``(fechas, P, U)``; U es relativo a las filas devueltas y vale -1 donde el
+    precio viene de antes del rango o no hay ninguno. Las fechas previas al
+    primer precio de estos activos no se informan.
+    """
+    from . import matriz_precios
+    from .portafolio import matriz_desde_filas
+
+    instantanea = matriz_precios.matriz_asof(activo_ids, fi, ff)
+    if instantanea is not None:
+        return instantanea
+    fechas = fechas_negociacion(fi, ff)
+    qs = Precio.objects.filter(activo_id__in=list(activo_ids))
+    if fi is not None:
+        qs = qs.filter(fecha__gte=fi)
+    if ff is not None:
+        qs = qs.filter(fecha__lte=ff)
+    _, P = matriz_desde_filas(activo_ids, qs.values_list("activo_id", "fecha", micro.en_micro("precio")),
+                              en_micro=True, fechas=fechas)
+    U = indice_asof(P)
+    previo = ultimos_precios(activo_ids, fi) if fi is not None and fechas else None
+    return recortar(fechas, asof(P, U, previo), U)
+
@@ -0,0 +1,144 @@
+# inversiones/cantidades.py
+"""
+Cantidades iniciales C_{i,0} = w_{i,0} · V0 / P_{i,0} (más el neto de las
+operaciones ya registradas) para cualquier número de portafolios.
+
+Los weights y precios en t0 se leen con un número fijo de consultas y se
+alinean como arreglos; el cálculo es una sola expresión de NumPy y la
+escritura un ``bulk_create`` con upsert. Con ``procesos > 1`` el cálculo y la
+conversión a ``Decimal`` se reparten por bloques de portafolios en un pool de
+procesos; los workers no usan la base de datos y la escritura queda en el
+proceso principal (SQLite admite un solo escritor).
+
+Precisión: los insumos se leen como enteros en micro-unidades
+(``inversiones/micro.py``; el neto de operaciones se suma en la base, exacto),
+el cálculo es en float64 y C_{i,0} se redondea en int64 a los 6 decimales de
+``Cantidad.cantidad``. Frente al cálculo con ``Decimal`` la diferencia es a lo
+más una unidad en el sexto decimal.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
+
+import django
+import numpy as np
+from django.db.models import Case, F, Sum, When
+
+from . import micro
+from .micro import en_micro
+from .models import Cantidad, Operacion, Precio, Weight
+
+BATCH_SIZE = 1000
+
+
+def _alinear(claves, claves_ref, valores_ref, defecto=np.nan):
+    """``valores_ref`` en el orden de ``claves`` (``defecto`` donde la clave no está)."""
+    resultado = np.full(claves.size, defecto)
+    if claves_ref.size == 0:
+        return resultado
+    orden = np.argsort(claves_ref)
+    pos = np.minimum(np.searchsorted(claves_ref, claves, sorter=orden), claves_ref.size - 1)
+    encontradas = claves_ref[orden[pos]] == claves
+    resultado[encontradas] = valores_ref[orden[pos[encontradas]]]
+    return resultado
+
+
+def cargar_insumos(t0, portafolio_ids=None):
+    """
+    Weights en t0 de los portafolios (todos si es None), alineados por fila con
+    el precio del activo en t0 y el neto de operaciones del par (portafolio,
+    activo). Tres consultas. Devuelve arreglos ``(pf_ids, activo_ids, w, P, neto)``
+    ordenados por portafolio; ``P`` es NaN donde el activo no tiene precio.
+    """
+    weights = Weight.objects.filter(fecha=t0)
+    operaciones = Operacion.objects.all()
+    if portafolio_ids is not None:
+        weights = weights.filter(portafolio_id__in=list(portafolio_ids))
+        operaciones = operaciones.filter(portafolio_id__in=list(portafolio_ids))
+
+    filas = list(weights.order_by("portafolio_id", "activo_id")
+                 .values_list("portafolio_id", "activo_id", en_micro("weight")))
+    n = len(filas)
+    pfs = np.fromiter(map(itemgetter(0), filas), dtype=np.int64, count=n)
+    aids = np.fromiter(map(itemgetter(1), filas), dtype=np.int64, count=n)
+    w = micro.a_float(micro.arreglo(map(itemgetter(2), filas), n))
+
+    precios = list(Precio.objects.filter(fecha=t0).values_list("activo_id", en_micro("precio")))
+    P = _alinear(
+        aids,
+        np.fromiter(map(itemgetter(0), precios), dtype=np.int64, count=len(precios)),
+        micro.a_float(micro.arreglo(map(itemgetter(1), precios), len(precios))),
+    )
+
+    # Cantidad guarda la tenencia actual: C_{i,0} más compras y menos ventas posteriores
+    netos = list(operaciones.values_list("portafolio_id", "activo_id").annotate(
+        neto=Sum(Case(When(tipo="venta", then=en_micro(-F("cantidad"))), default=en_micro("cantidad")))
+    ))
+    base = int(aids.max(initial=0)) + 1
+    claves_netos = np.fromiter((pf * base + aid for pf, aid, _ in netos if aid < base), dtype=np.int64)
+    valores_netos = micro.arreglo((x for _, aid, x in netos if aid < base))
+    neto = _alinear(pfs * base + aids, claves_netos, micro.a_float(valores_netos), defecto=0.0)
+    return pfs, aids, w, P, neto
+
+
+def calcular(w, P, neto, V0):
+    """
+    C_{i,0} por fila y máscara de filas válidas (con precio distinto de 0).
+    Devuelve ``(C, validas)``.
+    """
+    validas = ~np.isnan(P) & (P != 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        C = w * float(V0) / P + neto
+    return C, validas
+
+
+def _bloque(w, P, neto, V0):
+    """Trabajo de un worker: cálculo, redondeo a micro-unidades y conversión a Decimal (None en filas inválidas)."""
+    C, validas = calcular(w, P, neto, V0)
+    decimales = micro.a_decimal(micro.redondear(np.where(validas, C, 0.0)))
+    return [d if v else None for d, v in zip(decimales, validas.tolist())]
+
+
+def cantidades_decimales(pfs, w, P, neto, V0, procesos=1):
+    """
+    C_{i,0} como ``Decimal`` (None donde no hay precio), en el orden de las filas.
+    Con ``procesos > 1`` reparte bloques de portafolios completos en un pool.
+    """
+    if procesos <= 1 or pfs.size == 0:
+        return _bloque(w, P, neto, V0)
+
+    # tramos de portafolios completos con un número parecido de filas
+    inicios = np.flatnonzero(np.diff(pfs)) + 1  # donde empieza cada portafolio salvo el primero
+    objetivo = np.arange(1, procesos) * pfs.size / procesos
+    cortes = sorted({int(inicios[i]) for i in np.searchsorted(inicios, objetivo) if i < inicios.size})
+    tramos = list(zip([0, *cortes], [*cortes, pfs.size]))
+
+    # initializer: con "spawn" el worker necesita configurar Django antes de importar este módulo
+    with ProcessPoolExecutor(max_workers=min(procesos, len(tramos)), initializer=django.setup) as pool:
+        partes = pool.map(_bloque, *zip(*[(w[a:b], P[a:b], neto[a:b], V0) for a, b in tramos]))
+        return [c for parte in partes for c in parte]
+
+
+def guardar_cantidades(pfs, aids, cantidades, sobrescribir=False):
+    """
+    Escribe las cantidades con ``bulk_create``: upsert sobre (portafolio, activo)
+    con ``sobrescribir``, o solo las filas nuevas sin él. Devuelve
+    ``(creadas, actualizadas, omitidas)``; las filas sin cantidad cuentan como omitidas.
+    """
+    existentes = set(Cantidad.objects.filter(portafolio_id__in=np.unique(pfs).tolist())
+                     .values_list("portafolio_id", "activo_id"))
+    objetos, creadas, actualizadas, omitidas = [], 0, 0, 0
+    for pf_id, aid, c in zip(pfs.tolist(), aids.tolist(), cantidades):
+        if c is None:
+            omitidas += 1
+        elif (pf_id, aid) not in existentes:
+            creadas += 1
+            objetos.append(Cantidad(portafolio_id=pf_id, activo_id=aid, cantidad=c))
+        elif sobrescribir:
+            actualizadas += 1
+            objetos.append(Cantidad(portafolio_id=pf_id, activo_id=aid, cantidad=c))
+        else:
+            omitidas += 1  # ya existe y no se sobreescribe
+
+    Cantidad.objects.bulk_create(objetos, batch_size=BATCH_SIZE, update_conflicts=True,
+                                 unique_fields=["portafolio", "activo"], update_fields=["cantidad"])
+    return creadas, actualizadas, omitidas
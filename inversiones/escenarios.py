@@ -0,0 +1,153 @@
+# inversiones/escenarios.py
+"""
+Escenarios de precios y VaR/CVaR de las tenencias actuales de los portafolios.
+
+Un escenario es un vector de rendimientos logarítmicos a ``horizonte`` días,
+uno por activo y todos a la vez (así conserva la correlación entre activos),
+derivado de los rendimientos diarios de las últimas ``ventana`` fechas de
+``Precio``:
+
+- "bootstrap": suma ``horizonte`` días de la historia tomados al azar, con
+  reposición;
+- "normal": normal multivariada con la media y la covarianza diarias de la
+  historia, escaladas al horizonte;
+- "historico": cada tramo de ``horizonte`` días consecutivos de la historia
+  (sin azar: la cantidad de escenarios la fija la historia).
+
+La exposición actual X (portafolios × activos) es ``Cantidad`` por el último
+precio, y la ganancia de todos los portafolios en todos los escenarios de un
+bloque es un producto matricial: PnL = (exp(R) - 1) @ Xᵀ. VaR y CVaR al
+``nivel`` son el cuantil de la pérdida y la pérdida media desde ese cuantil.
+
+Los escenarios se generan y valúan por bloques de ``bloque`` filas: la memoria
+la acota el bloque (escenarios × activos) y solo se guarda el PnL (escenarios ×
+portafolios). Los bloques se reparten en un pool de procesos; cada uno usa su
+propio generador de ``SeedSequence(semilla).spawn``, así la misma semilla y el
+mismo ``bloque`` dan el mismo resultado con cualquier número de procesos.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+import numpy as np
+
+from . import micro
+from .models import Cantidad, Precio
+from .portafolio import cargar_matriz_precios
+
+METODOS = ("bootstrap", "normal", "historico")
+BLOQUE = 10000  # escenarios por bloque: con 200 activos, 16 MB de rendimientos
+
+
+def cargar_insumos(pf_ids=None, hasta=None, ventana=500):
+    """
+    Exposición actual de los portafolios con cantidades (todos si ``pf_ids`` es
+    None) y rendimientos logarítmicos diarios de sus activos en las últimas
+    ``ventana`` fechas con precios hasta ``hasta``. Devuelve
+    ``(fecha, pf_ids, simbolos, X, R)``: fecha de los precios de valuación,
+    filas y columnas de X (portafolios × activos) y R (días × activos).
+    ValueError si no hay cantidades o precios suficientes.
+    """
+    cantidades = Cantidad.objects.exclude(cantidad=0)
+    if pf_ids is not None:
+        cantidades = cantidades.filter(portafolio_id__in=list(pf_ids))
+    filas = list(cantidades.values_list("portafolio_id", "activo_id", "activo__simbolo",
+                                        micro.en_micro("cantidad")))
+    if not filas:
+        raise ValueError("No hay cantidades (C_{i,0}). Ejecute calc_cantidades_iniciales.")
+    pfs = sorted({pf for pf, _, _, _ in filas})
+    simbolo_de = {aid: s for _, aid, s, _ in filas}
+    activo_ids = sorted(simbolo_de)
+    fila, col = {pf: i for i, pf in enumerate(pfs)}, {aid: j for j, aid in enumerate(activo_ids)}
+    Q = np.zeros((len(pfs), len(activo_ids)), dtype=np.int64)
+    for pf, aid, _, c in filas:
+        Q[fila[pf], col[aid]] = c
+
+    fechas_qs = Precio.objects.order_by("-fecha").values_list("fecha", flat=True).distinct()
+    if hasta is not None:
+        fechas_qs = fechas_qs.filter(fecha__lte=hasta)
+    inicio = list(fechas_qs[ventana:ventana + 1])  # la fecha previa a la ventana: base del primer rendimiento
+    fechas, P = cargar_matriz_precios(activo_ids, inicio[0] if inicio else None, hasta)
+    if len(fechas) < 2:
+        raise ValueError("Se necesitan al menos dos fechas con precios.")
+    sin_precio = [simbolo_de[aid] for aid, p in zip(activo_ids, P[-1].tolist()) if not p > 0]
+    if sin_precio:
+        raise ValueError(f"Sin precio al {fechas[-1].isoformat()}: {', '.join(sin_precio)}.")
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        R = np.nan_to_num(np.diff(np.log(P), axis=0), nan=0.0)  # sin precio aún: sin rendimiento
+    return fechas[-1], pfs, [simbolo_de[aid] for aid in activo_ids], micro.a_float(Q) * P[-1], R
+
+
+def _factor(R):
+    """Media diaria y factor L (L·Lᵀ = covarianza) de los rendimientos, tolerando covarianzas singulares."""
+    cov = np.atleast_2d(np.cov(R, rowvar=False))
+    valores, vectores = np.linalg.eigh(cov)
+    return R.mean(axis=0), vectores * np.sqrt(np.clip(valores, 0.0, None))
+
+
+def _bloque(R, X, metodo, horizonte, normal, inicio, n, semilla):
+    """Trabajo de un worker: genera ``n`` escenarios y devuelve su PnL (n × portafolios)."""
+    if metodo == "historico":
+        C = np.vstack([np.zeros((1, R.shape[1])), np.cumsum(R, axis=0)])
+        escenarios = C[inicio + horizonte:inicio + horizonte + n] - C[inicio:inicio + n]
+    else:
+        rng = np.random.default_rng(semilla)
+        if metodo == "bootstrap":
+            dias = rng.integers(0, R.shape[0], size=(horizonte, n))
+            escenarios = R[dias[0]]
+            for d in dias[1:]:
+                escenarios += R[d]
+        else:
+            mu, L = normal
+            escenarios = mu * horizonte + (rng.standard_normal((n, L.shape[1])) @ L.T) * np.sqrt(horizonte)
+    return np.expm1(escenarios) @ X.T
+
+
+def simular(R, X, metodo="bootstrap", escenarios=10000, horizonte=1, semilla=42, procesos=1, bloque=BLOQUE):
+    """
+    PnL de cada escenario para cada portafolio (escenarios × filas de ``X``).
+    Con "historico" ``escenarios`` se ignora: hay uno por tramo de la historia.
+    Con ``procesos > 1`` reparte los bloques en un pool.
+    """
+    if metodo == "historico":
+        escenarios = R.shape[0] - horizonte + 1
+        if escenarios < 1:
+            raise ValueError(f"La historia tiene {R.shape[0]} rendimientos: menos que el horizonte.")
+    normal = _factor(R) if metodo == "normal" else None
+    inicios = range(0, escenarios, bloque)
+    semillas = np.random.SeedSequence(semilla).spawn(len(inicios))
+    tareas = [(R, X, metodo, horizonte, normal, a, min(bloque, escenarios - a), s)
+              for a, s in zip(inicios, semillas)]
+
+    if procesos <= 1 or len(tareas) <= 1:
+        return np.vstack([_bloque(*t) for t in tareas])
+    # initializer: con "spawn" el worker necesita configurar Django antes de importar este módulo
+    with ProcessPoolExecutor(max_workers=min(procesos, len(tareas)), initializer=django.setup) as pool:
+        return np.vstack(list(pool.map(_bloque, *zip(*tareas))))
+
+
+def medidas(pnl, X, niveles=(0.95, 0.99)):
+    """
+    Resumen del PnL de cada portafolio (columnas de ``pnl``): valor actual,
+    media, desvío, peor escenario, y VaR y CVaR (pérdidas positivas, en moneda y
+    como fracción del valor) a cada nivel.
+    """
+    perdidas = -pnl
+    valores = X.sum(axis=1)
+    cuantiles = np.quantile(perdidas, niveles, axis=0)  # niveles × portafolios
+    resultados = []
+    for j, valor in enumerate(valores.tolist()):
+        riesgo = []
+        for nivel, var in zip(niveles, cuantiles[:, j].tolist()):
+            cola = perdidas[:, j][perdidas[:, j] >= var]
+            cvar = float(cola.mean())
+            riesgo.append({"nivel": nivel, "var": var, "cvar": cvar,
+                           "var_pct": var / valor if valor else None, "cvar_pct": cvar / valor if valor else None})
+        resultados.append({
+            "valor": valor,
+            "pnl_medio": float(pnl[:, j].mean()),
+            "pnl_desvio": float(pnl[:, j].std(ddof=1)) if pnl.shape[0] > 1 else None,
+            "peor": float(pnl[:, j].min()),
+            "riesgo": riesgo,
+        })
+    return resultados
@@ -0,0 +1,163 @@
+# inversiones/exportacion.py
+"""
+Exportación masiva de V_t y w_{i,t} en streaming: CSV, NDJSON o Parquet.
+
+Es una tabla larga con una fila por (portafolio, fecha, activo con precio).
+Sus columnas son ``COLUMNAS``: x_{i,t} en ``valor``, w_{i,t} en ``weight`` y
+V_t en ``valor_total``.
+
+La memoria no depende del rango pedido:
+
+- El cálculo y la serialización avanzan de a ``dias`` fechas del calendario
+  de negociación.
+- Los precios de cada bloque se leen con una consulta acotada a su rango de
+  fechas y se consumen con ``.iterator(chunk_size=...)``.
+- De un bloque al siguiente solo pasa el último precio de cada activo, que da
+  el arrastre as-of de ``calendario``.
+- Las cantidades vigentes de cada bloque salen del ``LibroPosiciones``.
+
+Parquet requiere pyarrow. Se escribe un row group por bloque y los bytes se
+entregan a medida que el escritor los produce.
+"""
+import io
+import json
+
+import numpy as np
+import pandas as pd
+
+from . import micro
+from .calendario import asof, fechas_negociacion, indice_asof, ultimos_precios
+from .models import Activo, Precio
+from .portafolio import cargar_libros, evolucion, matriz_desde_filas
+
+FORMATOS = {"csv": "text/csv", "ndjson": "application/x-ndjson", "parquet": "application/vnd.apache.parquet"}
+EXTENSIONES = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson", ".parquet": "parquet"}
+COLUMNAS = ("portafolio", "fecha", "activo", "valor", "weight", "valor_total")
+DIAS_POR_BLOQUE = 250
+CHUNK_SIZE = 20000  # filas de Precio por lectura del cursor
+
+
+class ErrorExportacion(Exception):
+    pass
+
+
+def verificar_formato(formato):
+    """ErrorExportacion si ``formato`` no existe o falta la dependencia que lo escribe."""
+    if formato not in FORMATOS:
+        raise ErrorExportacion(f"formato debe ser uno de: {', '.join(FORMATOS)}.")
+    if formato == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError as e:
+            raise ErrorExportacion(f"Exportar Parquet requiere pyarrow: {e}")
+
+
+def bloques(pf_ids=None, fi=None, ff=None, dias=DIAS_POR_BLOQUE):
+    """
+    Genera, de a ``dias`` fechas, un dict columna -> arreglo con las filas de
+    ``COLUMNAS`` de los portafolios ``pf_ids`` (todos los que tienen
+    cantidades si es None) en [fi, ff].
+    """
+    libros = cargar_libros(pf_ids)
+    if not libros:
+        return
+    activo_ids = sorted({aid for libro in libros.values() for aid in libro.activo_ids})
+    col = {aid: j for j, aid in enumerate(activo_ids)}
+    simbolo_de = dict(Activo.objects.filter(id__in=activo_ids).values_list("id", "simbolo"))
+    simbolos = np.array([simbolo_de[aid] for aid in activo_ids], dtype=object)
+    columnas = {pf_id: np.array([col[aid] for aid in libro.activo_ids], dtype=np.int64)
+                for pf_id, libro in libros.items()}
+
+    calendario = fechas_negociacion(fi, ff)
+    previo = ultimos_precios(activo_ids, fi) if fi is not None and calendario else None
+    for i in range(0, len(calendario), dias):
+        fechas = calendario[i:i + dias]
+        filas = (Precio.objects.filter(activo_id__in=activo_ids, fecha__range=(fechas[0], fechas[-1]))
+                 .values_list("activo_id", "fecha", micro.en_micro("precio")).iterator(chunk_size=CHUNK_SIZE))
+        _, P = matriz_desde_filas(activo_ids, filas, en_micro=True, fechas=fechas)
+        P = asof(P, indice_asof(P), previo)
+        previo = P[-1]
+        bloque = _filas(libros, columnas, simbolos, fechas, P)
+        if bloque["portafolio"].size:
+            yield bloque
+
+
+def _filas(libros, columnas, simbolos, fechas, P):
+    """Filas del bloque ordenadas por fecha, portafolio y activo: el archivo no depende de ``dias``."""
+    dias = np.array(fechas, dtype="datetime64[D]")
+    partes = []
+    for pf_id, libro in sorted(libros.items()):
+        cols = columnas[pf_id]
+        X, Vt, W = evolucion(P[:, cols], libro.cantidades(fechas))
+        ks, js = np.nonzero(~np.isnan(X))  # sin precio todavía: sin fila, como ValorActivo
+        partes.append((np.full(ks.size, pf_id, dtype=np.int64), dias[ks], simbolos[cols][js],
+                       X[ks, js], W[ks, js], Vt[ks]))
+    bloque = {c: np.concatenate(v) for c, v in zip(COLUMNAS, zip(*partes))}
+    orden = np.argsort(bloque["fecha"], kind="stable")  # estable: conserva portafolio y activo
+    return {c: v[orden] for c, v in bloque.items()}
+
+
+def _tabla_texto(bloque):
+    return pd.DataFrame({**bloque, "fecha": np.datetime_as_string(bloque["fecha"], unit="D")}, columns=COLUMNAS)
+
+
+def _csv(bloques_):
+    yield (",".join(COLUMNAS) + "\n").encode()
+    for bloque in bloques_:
+        yield _tabla_texto(bloque).to_csv(index=False, header=False).encode()
+
+
+def _ndjson(bloques_):
+    for bloque in bloques_:
+        # json.dumps escribe los float con repr (ida y vuelta exacta); NaN, que no es JSON, va como null
+        tabla = _tabla_texto(bloque).astype(object).where(lambda t: t.notna(), None)
+        yield "".join(json.dumps(dict(zip(COLUMNAS, fila)), ensure_ascii=False, separators=(",", ":")) + "\n"
+                      for fila in tabla.itertuples(index=False, name=None)).encode()
+
+
+class _Sumidero(io.RawIOBase):
+    """Destino del escritor Parquet: junta los bytes hasta que se retiran, sin perder la posición."""
+
+    def __init__(self):
+        super().__init__()
+        self._partes, self._posicion = [], 0
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        self._posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self._posicion
+
+    def retirar(self):
+        datos = b"".join(self._partes)
+        self._partes.clear()
+        return datos
+
+
+def _parquet(bloques_):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    esquema = pa.schema([("portafolio", pa.int64()), ("fecha", pa.date32()), ("activo", pa.string()),
+                         ("valor", pa.float64()), ("weight", pa.float64()), ("valor_total", pa.float64())])
+    sumidero = _Sumidero()
+    escritor = pq.ParquetWriter(sumidero, esquema)
+    for bloque in bloques_:
+        escritor.write_table(pa.table({c: pa.array(bloque[c], type=esquema.field(c).type, from_pandas=True)
+                                       for c in COLUMNAS}, schema=esquema))
+        yield sumidero.retirar()
+    escritor.close()
+    yield sumidero.retirar()
+
+
+ESCRITORES = {"csv": _csv, "ndjson": _ndjson, "parquet": _parquet}
+
+
+def trozos(formato, bloques_):
+    """Bytes del archivo en ``formato``, en trozos, a partir de ``bloques``."""
+    return ESCRITORES[formato](bloques_)
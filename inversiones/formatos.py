@@ -0,0 +1,177 @@
+# inversiones/formatos.py
+"""
+Formatos de respuesta de la API de evolución.
+
+- ``json`` (por defecto): objetos ``{"fecha", "valor"}`` y ``{"activo", "valor"}``
+  por fecha, el formato original.
+- ``columnar``: JSON compacto con un arreglo de fechas, uno de símbolos, V_t y
+  la matriz de weights aplanada por filas (``null`` donde no hay peso).
+- ``binario``: el mismo contenido en little-endian, sin texto por celda:
+
+      0   "PFEV"            magia
+      4   uint16 versión    (1)
+      6   uint16 reservado
+      8   uint32 D          fechas
+      12  uint32 A          activos
+      16  uint32 H          bytes del encabezado JSON (portafolio, rango, simbolos, siguiente)
+      20  encabezado UTF-8, relleno con espacios hasta que 20 + H sea múltiplo de 8
+      ..  int32  dias[D]    días desde 1970-01-01, relleno a múltiplo de 8
+      ..  float64 Vt[D]
+      ..  float64 W[D*A]    por filas, NaN donde no hay peso
+
+  Los bloques numéricos quedan alineados a 8 bytes para leerlos en el
+  navegador con ``Int32Array``/``Float64Array`` sin copiar.
+
+Se eligen con ``?formato=`` o por ``Accept`` (ver ``TIPOS``).
+"""
+import json
+import struct
+from datetime import date
+
+import numpy as np
+
+from .portafolio import series_evolucion
+
+COLUMNAR = "application/vnd.portafolio.columnar+json"
+BINARIO = "application/vnd.portafolio.evolucion"
+TIPOS = {"json": "application/json", "columnar": COLUMNAR, "binario": BINARIO}
+
+MAGIA = b"PFEV"
+VERSION_BINARIO = 1
+_PREFIJO = struct.Struct("<4sHHIII")
+_EPOCH = date(1970, 1, 1).toordinal()
+
+
+def negociar(request, validos=tuple(TIPOS)):
+    """
+    Formato pedido por ``?formato=`` o, si no viene, por el encabezado ``Accept``,
+    entre ``validos``. None si ``?formato=`` no es uno de ellos.
+    """
+    formato = request.GET.get("formato")
+    if formato:
+        return formato if formato in validos else None
+    preferido = request.get_preferred_type([TIPOS[f] for f in validos])
+    return {v: k for k, v in TIPOS.items()}.get(preferido, "json")
+
+
+def _nulos(arr):
+    """Lista de floats con None en lugar de NaN (JSON no admite NaN)."""
+    lista = arr.tolist()
+    for i in np.flatnonzero(np.isnan(arr)).tolist():
+        lista[i] = None
+    return lista
+
+
+def como_json(cabecera, fechas, simbolos, Vt, W):
+    vt_series, weights_series = series_evolucion(fechas, simbolos, Vt, W)
+    return json.dumps({**cabecera, "Vt": vt_series, "weights": weights_series}, ensure_ascii=False).encode()
+
+
+def como_columnar(cabecera, fechas, simbolos, Vt, W):
+    data = {
+        **cabecera,
+        "fechas": [f.isoformat() for f in fechas],
+        "simbolos": list(simbolos),
+        "Vt": _nulos(Vt),
+        "weights": _nulos(W.ravel()),
+    }
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def _rellenar(b, relleno=b"\0", inicio=0):
+    return b + relleno * (-(inicio + len(b)) % 8)
+
+
+def _binario_sin_w(cabecera, fechas, simbolos, Vt, A):
+    """Prefijo, encabezado, días y V_t: todo lo que precede al bloque W."""
+    encabezado = json.dumps({**cabecera, "simbolos": list(simbolos)}, ensure_ascii=False).encode()
+    encabezado = _rellenar(encabezado, b" ", inicio=_PREFIJO.size)
+    D = len(fechas)
+    dias = np.fromiter((f.toordinal() - _EPOCH for f in fechas), dtype="<i4", count=D)
+    return b"".join((
+        _PREFIJO.pack(MAGIA, VERSION_BINARIO, 0, D, A, len(encabezado)),
+        encabezado,
+        _rellenar(dias.tobytes()),
+        np.ascontiguousarray(Vt, dtype="<f8").tobytes(),
+    ))
+
+
+def como_binario(cabecera, fechas, simbolos, Vt, W):
+    return _binario_sin_w(cabecera, fechas, simbolos, Vt, W.shape[1]) + np.ascontiguousarray(W, dtype="<f8").tobytes()
+
+
+def leer_binario(contenido):
+    """Inverso de ``como_binario``: ``(cabecera, fechas, Vt, W)``."""
+    magia, version, _, D, A, H = _PREFIJO.unpack_from(contenido)
+    if magia != MAGIA or version != VERSION_BINARIO:
+        raise ValueError("No es una respuesta binaria de evolución v1.")
+    off = _PREFIJO.size
+    cabecera = json.loads(contenido[off:off + H])
+    off += H
+    dias = np.frombuffer(contenido, dtype="<i4", count=D, offset=off)
+    off += D * 4 + (-(D * 4) % 8)
+    Vt = np.frombuffer(contenido, dtype="<f8", count=D, offset=off)
+    off += D * 8
+    W = np.frombuffer(contenido, dtype="<f8", count=D * A, offset=off).reshape(D, A)
+    fechas = [date.fromordinal(int(d) + _EPOCH) for d in dias]
+    return cabecera, fechas, Vt, W
+
+
+# ---------------------------------------------------------------------------
+# En trozos, para respuestas en streaming: b"".join(trozos(...)) == codificar(...)[0]
+# ---------------------------------------------------------------------------
+
+def _abrir(cabecera, separador):
+    """JSON de la cabecera sin la llave de cierre, listo para agregar más campos."""
+    return json.dumps(cabecera, ensure_ascii=False, separators=separador)[:-1]
+
+
+def _lista_en_trozos(items, a_texto, separador, filas):
+    for i in range(0, len(items), filas):
+        bloque = separador.join(a_texto(x) for x in items[i:i + filas])
+        yield ((separador if i else "") + bloque).encode()
+
+
+def _json_en_trozos(cabecera, fechas, simbolos, Vt, W, filas):
+    vt_series, weights_series = series_evolucion(fechas, simbolos, Vt, W)
+    dumps = lambda x: json.dumps(x, ensure_ascii=False)
+    yield (_abrir(cabecera, None) + ', "Vt": [').encode()
+    yield from _lista_en_trozos(vt_series, dumps, ", ", filas)
+    yield b'], "weights": ['
+    yield from _lista_en_trozos(weights_series, dumps, ", ", filas)
+    yield b"]}"
+
+
+def _columnar_en_trozos(cabecera, fechas, simbolos, Vt, W, filas):
+    sep = (",", ":")
+    dumps = lambda x: json.dumps(x, ensure_ascii=False, separators=sep)
+    yield (_abrir(cabecera, sep) + ',"fechas":' + dumps([f.isoformat() for f in fechas])
+           + ',"simbolos":' + dumps(list(simbolos)) + ',"Vt":' + dumps(_nulos(Vt)) + ',"weights":[').encode()
+    for i in range(0, W.shape[0], filas):
+        bloque = dumps(_nulos(W[i:i + filas].ravel()))[1:-1]
+        if bloque:
+            yield (("," if i else "") + bloque).encode()
+    yield b"]}"
+
+
+def _binario_en_trozos(cabecera, fechas, simbolos, Vt, W, filas):
+    yield _binario_sin_w(cabecera, fechas, simbolos, Vt, W.shape[1])
+    W = np.ascontiguousarray(W, dtype="<f8")
+    for i in range(0, W.shape[0], filas):
+        yield W[i:i + filas].tobytes()
+
+
+TROZOS = {"json": _json_en_trozos, "columnar": _columnar_en_trozos, "binario": _binario_en_trozos}
+
+
+def trozos(formato, cabecera, fechas, simbolos, Vt, W, filas=256):
+    """Genera la misma serialización que ``codificar`` en trozos de ``filas`` fechas."""
+    return TROZOS[formato](cabecera, fechas, simbolos, Vt, W, filas)
+
+
+CODIFICADORES = {"json": como_json, "columnar": como_columnar, "binario": como_binario}
+
+
+def codificar(formato, cabecera, fechas, simbolos, Vt, W):
+    """Serializa la evolución en ``formato``. Devuelve ``(bytes, content_type)``."""
+    return CODIFICADORES[formato](cabecera, fechas, simbolos, Vt, W), TIPOS[formato]
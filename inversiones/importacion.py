@@ -0,0 +1,153 @@
+# inversiones/importacion.py
+"""
+Lectura por bloques de la tabla ancha de precios (fecha + una columna por
+activo) desde Excel, CSV o Parquet, y conversión vectorizada a filas de
+``Precio``. La memoria queda acotada por el tamaño del bloque, no del archivo.
+"""
+import os
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+FORMATOS = {".xlsx": "excel", ".xlsm": "excel", ".csv": "csv", ".parquet": "parquet", ".pq": "parquet"}
+
+
+class ErrorImportacion(Exception):
+    pass
+
+
+def formato_de(path):
+    ext = os.path.splitext(str(path))[1].lower()
+    if ext not in FORMATOS:
+        raise ErrorImportacion(f"Formato no soportado: {ext!r}. Use .xlsx, .csv o .parquet.")
+    return FORMATOS[ext]
+
+
+def hoja_excel(path, nombre):
+    """Resuelve el nombre real de una hoja (sin distinguir mayúsculas) o None."""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True)
+    try:
+        return {s.lower(): s for s in wb.sheetnames}.get(nombre.lower())
+    finally:
+        wb.close()
+
+
+def leer_tabla(path, hoja=None):
+    """Lee completa una tabla pequeña (p. ej. weights) en cualquiera de los formatos."""
+    formato = formato_de(path)
+    if formato == "excel":
+        return pd.read_excel(path, hoja)
+    if formato == "csv":
+        return pd.read_csv(path)
+    return _leer_parquet_completo(path)
+
+
+def _leer_parquet_completo(path):
+    try:
+        return pd.read_parquet(path)
+    except ImportError as e:
+        raise ErrorImportacion(f"Leer Parquet requiere pyarrow: {e}")
+
+
+def bloques_precios(path, hoja=None, filas_por_bloque=500):
+    """
+    Genera DataFrames de a lo más ``filas_por_bloque`` fechas con las columnas
+    de la hoja de precios. Excel se lee en modo streaming (openpyxl read_only),
+    CSV con ``chunksize`` y Parquet por lotes de registros.
+    """
+    formato = formato_de(path)
+    if formato == "excel":
+        yield from _bloques_excel(path, hoja, filas_por_bloque)
+    elif formato == "csv":
+        yield from pd.read_csv(path, chunksize=filas_por_bloque)
+    else:
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ErrorImportacion(f"Leer Parquet requiere pyarrow: {e}")
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=filas_por_bloque):
+            yield batch.to_pandas()
+
+
+def _bloques_excel(path, hoja, filas_por_bloque):
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        filas = wb[hoja].iter_rows(values_only=True)
+        header = next(filas, None)
+        if header is None:
+            return
+        # columnas sin encabezado (celdas vacías a la derecha) se descartan
+        n = max((i + 1 for i, c in enumerate(header) if c is not None), default=0)
+        columnas = [str(c).strip() for c in header[:n]]
+        while True:
+            bloque = [fila[:n] for fila in islice(filas, filas_por_bloque)]
+            if not bloque:
+                break
+            yield pd.DataFrame(bloque, columns=columnas)
+    finally:
+        wb.close()
+
+
+def fundir_precios(df, col_fecha, col_ids, despues_de=None):
+    """
+    Convierte un bloque ancho a formato largo sin iterar filas.
+
+    ``col_ids`` mapea cada columna de activo a su ``activo_id``. Devuelve
+    ``(activo_ids, fechas, precios)`` como arreglos alineados, sin celdas vacías
+    y con precios redondeados a los 6 decimales de ``Precio.precio``.
+
+    ``despues_de`` (activo_id -> fecha) deja solo los precios posteriores a esa
+    fecha para cada activo (modo delta). Las filas que ningún activo necesita se
+    descartan antes de convertir sus valores.
+    """
+    dias = pd.to_datetime(df[col_fecha]).to_numpy(dtype="datetime64[D]")
+    cols = list(col_ids)
+    ids = np.array([col_ids[c] for c in cols], dtype=np.int64)
+
+    corte = None
+    if despues_de:
+        minimo = np.datetime64("0001-01-01", "D")
+        corte = np.array([despues_de.get(a, minimo) or minimo for a in ids.tolist()], dtype="datetime64[D]")
+        utiles = dias > corte.min()
+        if not utiles.all():
+            df, dias = df[utiles], dias[utiles]
+
+    valores = df[cols].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64)
+    validas = ~np.isnan(valores) & ~np.isnat(dias)[:, None]
+    if corte is not None:
+        validas &= dias[:, None] > corte[None, :]
+    fila, col = np.nonzero(validas)
+    fechas = dias[fila].astype(object)  # datetime.date
+    return ids[col], fechas, np.round(valores[fila, col], 6)
+
+
+def memoria_pico_mb():
+    """Memoria residente máxima del proceso en MB (ru_maxrss está en KB en Linux), o None."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def memoria_actual_mb():
+    """
+    Memoria residente actual del proceso en MB, o None donde no hay
+    ``/proc/self/statm`` (fuera de Linux). A diferencia de ``memoria_pico_mb``
+    puede bajar, así que sirve para vigilar un límite en un proceso que ya hizo
+    otros trabajos.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            paginas = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return paginas * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
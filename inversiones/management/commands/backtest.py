@@ -0,0 +1,86 @@
+import json
+from datetime import datetime
+
+from django.core.management.base import CommandError
+
+from inversiones import backtest
+from inversiones.metricas import ComandoInstrumentado
+from inversiones.models import Portafolio
+
+
+def _fecha(valor, nombre):
+    try:
+        return datetime.strptime(valor, "%Y-%m-%d").date() if valor else None
+    except ValueError:
+        raise CommandError(f"Parámetro {nombre} inválido. Use formato YYYY-MM-DD.")
+
+
+def _porcentaje(x):
+    return f"{x:.2%}" if x is not None else "-"
+
+
+class Command(ComandoInstrumentado):
+    help = (
+        "Simula el rebalanceo periódico hacia los weights del portafolio sobre la historia de precios, "
+        "para cada combinación de frecuencia, banda y costo, y compara los resultados."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("pf_id", type=int, help="Id del portafolio.")
+        parser.add_argument("--desde", help="Inicio (YYYY-MM-DD). Default: fecha de los primeros weights.")
+        parser.add_argument("--hasta", help="Fin (YYYY-MM-DD). Default: último precio.")
+        parser.add_argument("--v0", type=float, default=1000000000,
+                            help="Valor inicial del portafolio. Default: 1,000,000,000")
+        parser.add_argument("--frecuencias", nargs="+", default=["M"], choices=backtest.FRECUENCIAS,
+                            help="Rebalanceo por calendario: ninguna, W, M y/o Q. Default: M")
+        parser.add_argument("--bandas", nargs="+", type=float, default=[0.0],
+                            help="Desvío máximo de cada weight antes de rebalancear (0: sin banda). Default: 0")
+        parser.add_argument("--costos", nargs="+", type=float, default=[0.0],
+                            help="Costo por unidad negociada (0.001 = 10 pb). Default: 0")
+        parser.add_argument("--procesos", type=int, default=1,
+                            help="Reparte las variantes en N procesos. Default: 1")
+        parser.add_argument("--top", type=int, default=20,
+                            help="Variantes a mostrar, por rendimiento total. Default: 20")
+        parser.add_argument("--salida", help="Guarda el resumen y el valor diario de cada variante en JSON.")
+
+    def handle(self, *args, **opts):
+        desde, hasta = _fecha(opts["desde"], "--desde"), _fecha(opts["hasta"], "--hasta")
+        if opts["procesos"] < 1:
+            raise CommandError("--procesos debe ser al menos 1.")
+        if not opts["v0"] > 0:
+            raise CommandError("--v0 debe ser positivo.")
+        pf = Portafolio.objects.filter(pk=opts["pf_id"]).first()
+        if pf is None:
+            raise CommandError(f"Portafolio {opts['pf_id']} no existe.")
+        try:
+            lote = backtest.variantes(opts["frecuencias"], opts["bandas"], opts["costos"])
+            fecha_w, simbolos, w, fechas, P = backtest.cargar_insumos(pf.id, desde, hasta)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        resultados = backtest.ejecutar(fechas, P, w, opts["v0"], lote, procesos=opts["procesos"])
+
+        self.stdout.write(
+            f"{pf.nombre}: {len(simbolos)} activos (weights del {fecha_w}), "
+            f"{fechas[0]} a {fechas[-1]} ({len(fechas)} fechas), {len(lote)} variantes."
+        )
+        self.stdout.write(f"{'frecuencia':>10} {'banda':>6} {'costo':>7} {'rend.':>9} {'anual':>8} "
+                          f"{'vol.':>7} {'max dd':>8} {'rebal.':>6} {'costos':>14}")
+        orden = sorted(range(len(lote)), key=lambda i: -resultados[i][0]["rendimiento_total"])
+        for i in orden[:opts["top"]]:
+            v, (r, _) = lote[i], resultados[i]
+            self.stdout.write(
+                f"{v['frecuencia']:>10} {v['banda'] or 0:>6.3f} {v['costo']:>7.4f} "
+                f"{_porcentaje(r['rendimiento_total']):>9} {_porcentaje(r['rendimiento_anualizado']):>8} "
+                f"{_porcentaje(r['volatilidad_anualizada']):>7} {_porcentaje(r['max_drawdown']['valor']):>8} "
+                f"{r['rebalanceos']:>6} {r['costos']:>14,.2f}"
+            )
+
+        if opts["salida"]:
+            with open(opts["salida"], "w") as f:
+                json.dump({
+                    "portafolio": pf.id, "v0": opts["v0"], "fechas": [d.isoformat() for d in fechas],
+                    "weights": {"fecha": fecha_w.isoformat(), "activos": dict(zip(simbolos, w.tolist()))},
+                    "variantes": [{**v, "resumen": r, "valores": V.tolist()} for v, (r, V) in zip(lote, resultados)],
+                }, f)
+            self.stdout.write(self.style.SUCCESS(f"Resultados guardados en {opts['salida']}."))
@@ -0,0 +1,172 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from inversiones import benchmarks
+
+
+class Command(BaseCommand):
+    help = "Ejecuta benchmarks de rendimiento con datos sintéticos (no toca la base de datos configurada)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("caso", choices=["evolucion", "operaciones", "formatos", "suite", "carga", "lote", "concurrencia"],
+                            help="Benchmark a ejecutar")
+        parser.add_argument("--activos", type=int, default=None,
+                            help="Número de activos. Default: 200 (50 en 'suite', 'carga' y 'lote'; "
+                                 "20 en 'concurrencia')")
+        parser.add_argument("--dias", type=int, default=None,
+                            help="Número de días de precios. Default: 2520 (500 en 'suite', 'carga' y 'lote'; "
+                                 "250 en 'concurrencia')")
+        parser.add_argument("--repeticiones", type=int, default=3,
+                            help="Repeticiones por medición (se informa la mejor). Default: 3")
+        parser.add_argument("--tamanos", type=int, nargs="+", default=[1000, 10000, 100000],
+                            help="Tamaños de lote para 'operaciones'. Default: 1000 10000 100000")
+        parser.add_argument("--semilla", type=int, default=42, help="Semilla del generador. Default: 42")
+        parser.add_argument("--portafolios", type=int, default=None,
+                            help="Portafolios en 'suite' y 'carga' (default 2) y en 'lote' (default 20)")
+        parser.add_argument("--operaciones", type=int, default=1000,
+                            help="Operaciones precargadas y por lote en 'suite'. Default: 1000")
+        parser.add_argument("--salida", default=None, help="Guarda los resultados de 'suite' en este JSON")
+        parser.add_argument("--comparar", default=None,
+                            help="JSON de una corrida anterior de 'suite'; falla si hay regresiones")
+        parser.add_argument("--concurrencias", type=int, nargs="+", default=[1, 8, 32],
+                            help="Peticiones simultáneas en 'carga'. Default: 1 8 32")
+        parser.add_argument("--peticiones", type=int, default=None,
+                            help="Peticiones por concurrencia y servidor en 'carga' (default 200) "
+                                 "y por cliente en 'concurrencia' (default 20)")
+        parser.add_argument("--en-cache", action="store_true",
+                            help="En 'carga', repite la misma petición (respuestas desde caché).")
+        parser.add_argument("--lectores", type=int, default=6,
+                            help="Procesos que leen la evolución en 'concurrencia'. Default: 6")
+        parser.add_argument("--escritores", type=int, default=3,
+                            help="Procesos que registran operaciones en 'concurrencia'. Default: 3")
+        parser.add_argument("--perfiles", nargs="+", default=["desarrollo", "produccion"],
+                            help="Perfiles de DB_PERFILES a comparar en 'concurrencia'. Default: desarrollo produccion")
+        parser.add_argument("--reintentos", type=int, default=None,
+                            help="DB_REINTENTOS durante 'concurrencia'. Default: el configurado")
+        parser.add_argument("--umbral", type=float, default=0.2,
+                            help="Empeoramiento relativo tolerado en tiempos y memoria. Default: 0.2")
+
+    def handle(self, *args, **opts):
+        chico = opts["caso"] in ("suite", "carga", "lote")
+        opts["portafolios"] = opts["portafolios"] or (20 if opts["caso"] == "lote" else 2)
+        opts["peticiones"] = opts["peticiones"] or (20 if opts["caso"] == "concurrencia" else 200)
+        concurrencia = opts["caso"] == "concurrencia"
+        opts["activos"] = opts["activos"] or (20 if concurrencia else 50 if chico else 200)
+        opts["dias"] = opts["dias"] or (250 if concurrencia else 500 if chico else 2520)
+        if opts["repeticiones"] < 1:
+            raise CommandError("--repeticiones debe ser al menos 1.")
+        desconocidos = set(opts["perfiles"]) - set(settings.DB_PERFILES)
+        if desconocidos:
+            raise CommandError(f"Perfiles desconocidos: {', '.join(sorted(desconocidos))}. "
+                               f"Use {', '.join(settings.DB_PERFILES)}.")
+
+        if opts["caso"] == "evolucion":
+            r = benchmarks.bench_evolucion(
+                n_activos=opts["activos"], n_dias=opts["dias"],
+                repeticiones=opts["repeticiones"], semilla=opts["semilla"],
+            )
+            self.stdout.write(f"Filas de precios: {r['filas']}")
+            self.stdout.write(f"Cálculo Decimal (original): {r['calculo_decimal_s']:.3f} s")
+            self.stdout.write(f"Cálculo NumPy (vectorizado): {r['calculo_vectorizado_s']:.3f} s")
+            self.stdout.write(f"Respuesta completa Decimal: {r['decimal_s']:.3f} s")
+            self.stdout.write(f"Respuesta completa NumPy: {r['vectorizado_s']:.3f} s")
+            self.stdout.write(f"Error máx. relativo V_t: {r['max_err_rel_Vt']:.2e}")
+            self.stdout.write(f"Error máx. absoluto w_i,t: {r['max_err_abs_w']:.2e}")
+            self.stdout.write(self.style.SUCCESS(
+                f"Speedup cálculo: {r['speedup_calculo']:.1f}x, respuesta completa: {r['speedup']:.1f}x"
+            ))
+
+        elif opts["caso"] == "operaciones":
+            for r in benchmarks.bench_operaciones(opts["tamanos"], semilla=opts["semilla"]):
+                self.stdout.write(
+                    f"{r['operaciones']:>7} ops: {r['segundos']:.2f} s, "
+                    f"{r['ops_por_seg']:,.0f} ops/s, {r['consultas']} consultas (HTTP {r['status']})"
+                )
+
+        elif opts["caso"] == "formatos":
+            resultados = benchmarks.bench_formatos(
+                n_activos=opts["activos"], n_dias=opts["dias"],
+                repeticiones=opts["repeticiones"], semilla=opts["semilla"],
+            )
+            base = resultados[0]
+            for r in resultados:
+                self.stdout.write(
+                    f"{r['formato']:>9}: {r['bytes'] / 1e6:8.2f} MB "
+                    f"({r['bytes'] / base['bytes']:.2f}x), codificación {r['segundos']:.3f} s "
+                    f"({base['segundos'] / r['segundos']:.1f}x más rápido)"
+                )
+
+        elif opts["caso"] == "suite":
+            base = None
+            if opts["comparar"]:
+                try:
+                    with open(opts["comparar"]) as f:
+                        base = json.load(f)
+                except (OSError, ValueError) as e:
+                    raise CommandError(f"No se pudo leer {opts['comparar']}: {e}")
+
+            r = benchmarks.bench_suite(
+                n_activos=opts["activos"], n_dias=opts["dias"], n_portafolios=opts["portafolios"],
+                n_operaciones=opts["operaciones"], repeticiones=opts["repeticiones"], semilla=opts["semilla"],
+            )
+            for caso, m in r["resultados"].items():
+                self.stdout.write(
+                    f"{caso:>26}: p50 {m['p50_ms']:9.1f} ms, p95 {m['p95_ms']:9.1f} ms, "
+                    f"p99 {m['p99_ms']:9.1f} ms, {m['consultas']:>4} consultas, "
+                    f"pico {m['memoria_pico_mb']:7.1f} MB"
+                )
+            if opts["salida"]:
+                with open(opts["salida"], "w") as f:
+                    json.dump(r, f, indent=2)
+                self.stdout.write(f"Resultados guardados en {opts['salida']}")
+
+            if base is not None:
+                filas = benchmarks.comparar_resultados(base, r, opts["umbral"])
+                self.stdout.write(f"\nComparación contra {base['meta'].get('commit') or opts['comparar']}:")
+                for caso, metrica, antes, despues, cambio, regresion in filas:
+                    marca = self.style.ERROR("REGRESIÓN") if regresion else ""
+                    self.stdout.write(f"{caso:>26} {metrica:>16}: {antes:10.2f} -> {despues:10.2f} "
+                                      f"({cambio:+.0%}) {marca}")
+                regresiones = [f for f in filas if f[-1]]
+                if regresiones:
+                    raise CommandError(f"{len(regresiones)} regresiones sobre el umbral de {opts['umbral']:.0%}.")
+                self.stdout.write(self.style.SUCCESS("Sin regresiones."))
+
+        elif opts["caso"] == "carga":
+            for r in benchmarks.bench_carga(
+                n_activos=opts["activos"], n_dias=opts["dias"], n_portafolios=opts["portafolios"],
+                concurrencias=opts["concurrencias"], peticiones=opts["peticiones"],
+                en_cache=opts["en_cache"], semilla=opts["semilla"],
+            ):
+                self.stdout.write(
+                    f"{r['servidor']} x{r['concurrencia']:<3}: {r['rps']:8.1f} req/s, "
+                    f"p50 {r['p50_ms']:8.1f} ms, p99 {r['p99_ms']:8.1f} ms, errores {r['errores']}"
+                )
+
+        elif opts["caso"] == "lote":
+            r = benchmarks.bench_lote(
+                n_activos=opts["activos"], n_dias=opts["dias"], n_portafolios=opts["portafolios"],
+                n_operaciones=opts["operaciones"], repeticiones=opts["repeticiones"], semilla=opts["semilla"],
+            )
+            for caso, m in r.items():
+                self.stdout.write(
+                    f"{caso:>24}: p50 {m['p50_ms']:9.1f} ms, {m['consultas']:>4} consultas, "
+                    f"pico {m['memoria_pico_mb']:7.1f} MB"
+                )
+            self.stdout.write(f"Speedup del lote: {r['individual_en_linea']['p50_ms'] / r['lote']['p50_ms']:.1f}x "
+                              f"(en línea), {r['individual_materializada']['p50_ms'] / r['lote']['p50_ms']:.1f}x "
+                              f"(materializada)")
+
+        elif opts["caso"] == "concurrencia":
+            for r in benchmarks.bench_concurrencia(
+                perfiles=opts["perfiles"], lectores=opts["lectores"], escritores=opts["escritores"],
+                peticiones=opts["peticiones"], n_activos=opts["activos"], n_dias=opts["dias"],
+                reintentos=opts["reintentos"], semilla=opts["semilla"],
+            ):
+                self.stdout.write(
+                    f"{r['perfil']:>11} ({r['journal']}) {r['tipo']:>9}: {r['por_seg']:6.1f} req/s, "
+                    f"p50 {r['p50_ms']:8.1f} ms, p99 {r['p99_ms']:8.1f} ms, "
+                    f"errores {r['errores']}, reintentos {r['reintentos']}"
+                )
@@ -1,13 +1,19 @@
-from django.core.management.base import BaseCommand, CommandError
+import argparse
+
+from django.core.management.base import CommandError
 from django.db import transaction
 from decimal import Decimal, InvalidOperation
 from datetime import datetime
 
-from inversiones.models import (
-    Activo, Portafolio, Precio, Weight, Cantidad, ValorPortafolio
-)
+import numpy as np
+
+from inversiones.cache import invalidar
+from inversiones.cantidades import cantidades_decimales, cargar_insumos, guardar_cantidades
+from inversiones.metricas import ComandoInstrumentado
+from inversiones.models import Portafolio
+from inversiones.valuacion import refrescar_valuaciones
 
-class Command(BaseCommand):
+class Command(ComandoInstrumentado):
     help = (
         "Calcula C_{i,0} = (w_{i,0} * V0) / P_{i,0} para todos los activos y portafolios "
         "en la fecha t0 y guarda en la tabla Cantidad."
@@ -18,10 +24,13 @@ class Command(BaseCommand):
                             help="Fecha inicial t0 (YYYY-MM-DD). Default: 2022-02-15")
         parser.add_argument("--v0", default="1000000000",
                             help="Valor inicial del portafolio (entero o decimal). Default: 1,000,000,000")
-        parser.add_argument("--pf1", default="Portafolio 1",
-                            help="Nombre del portafolio 1 (debe existir o se creará).")
-        parser.add_argument("--pf2", default="Portafolio 2",
-                            help="Nombre del portafolio 2 (debe existir o se creará).")
+        parser.add_argument("--pf", type=int, action="append", dest="pf_ids",
+                            help="Id de portafolio a calcular (repetible). Default: todos los que tienen weights en t0.")
+        # Alias obsoletos (nombre del portafolio, se crea si no existe): se suman a --pf
+        parser.add_argument("--pf1", action="append", dest="pf_nombres", help=argparse.SUPPRESS)
+        parser.add_argument("--pf2", action="append", dest="pf_nombres", help=argparse.SUPPRESS)
+        parser.add_argument("--procesos", type=int, default=1,
+                            help="Reparte el cálculo en N procesos por bloques de portafolios. Default: 1")
         parser.add_argument("--overwrite", action="store_true",
                             help="Si existe una Cantidad para (portafolio, activo), la reemplaza.")
 
@@ -35,72 +44,33 @@ class Command(BaseCommand):
             V0 = Decimal(str(opts["v0"]))
         except InvalidOperation:
             raise CommandError("Parámetro --v0 inválido.")
+        if opts["procesos"] < 1:
+            raise CommandError("--procesos debe ser al menos 1.")
 
-        pf_names = [opts["pf1"], opts["pf2"]]
-
-        # Asegura portafolios
-        pfs = []
-        for name in pf_names:
-            pf, _ = Portafolio.objects.get_or_create(nombre=name)
-            pfs.append(pf)
+        pf_ids = opts["pf_ids"]
+        if opts["pf_nombres"]:
+            self.stderr.write(self.style.WARNING("--pf1/--pf2 están obsoletos: use --pf <id> (repetible)."))
+            pf_ids = (pf_ids or []) + [Portafolio.objects.get_or_create(nombre=nombre)[0].id
+                                       for nombre in opts["pf_nombres"]]
 
-        # Trae weights y precios en t0
-        weights = Weight.objects.filter(fecha=t0).select_related("portafolio", "activo")
-        if not weights.exists():
+        # Weights y precios en t0 y netos de operaciones, alineados como arreglos
+        pfs, aids, w, P, neto = cargar_insumos(t0, pf_ids)
+        if not pfs.size:
             raise CommandError(f"No hay weights en t0={t0}. Importe primero los datos.")
-
-        precios = {
-            (pr.activo_id, pr.fecha): pr.precio
-            for pr in Precio.objects.filter(fecha=t0).only("activo_id", "fecha", "precio")
-        }
-        if not precios:
+        if np.isnan(P).all():
             raise CommandError(f"No hay precios en t0={t0}.")
 
-        creados = 0
-        actualizados = 0
-        omitidos = 0
+        cantidades = cantidades_decimales(pfs, w, P, neto, V0, procesos=opts["procesos"])
 
         with transaction.atomic():
-            # procesa por portafolio-activo
-            for w in weights:
-                key = (w.activo_id, t0)
-                if key not in precios:
-                    omitidos += 1
-                    continue
-                Pi0 = precios[key]              # precio P_{i,0}
-                wi0 = w.weight                  # weight w_{i,0}
-                try:
-                    Ci0 = (wi0 * V0) / Pi0
-                except (InvalidOperation, ZeroDivisionError):
-                    omitidos += 1
-                    continue
-
-                if opts["overwrite"]:
-                    obj, created = Cantidad.objects.update_or_create(
-                        portafolio=w.portafolio, activo=w.activo,
-                        defaults={"cantidad": Ci0}
-                    )
-                    if created:
-                        creados += 1
-                    else:
-                        actualizados += 1
-                else:
-                    obj, created = Cantidad.objects.get_or_create(
-                        portafolio=w.portafolio, activo=w.activo,
-                        defaults={"cantidad": Ci0}
-                    )
-                    if created:
-                        creados += 1
-                    else:
-                        # ya existe y no se sobreescribe
-                        omitidos += 1
+            creados, actualizados, omitidos = guardar_cantidades(pfs, aids, cantidades, opts["overwrite"])
 
-            # Guarda el valor total del portafolio en t0 (útil para checks posteriores)
-            for pf in pfs:
-                ValorPortafolio.objects.update_or_create(
-                    portafolio=pf, fecha=t0, defaults={"valor_total": V0}
-                )
+            # Materializa V_t y w_{i,t} con las nuevas cantidades (incluye V_0 en t0)
+            pf_ids = sorted(set(pfs.tolist()))
+            refrescar_valuaciones(pf_ids)
+            invalidar(pf_ids=pf_ids)
 
         self.stdout.write(self.style.SUCCESS(
-            f"Listo. Cantidades creadas: {creados}, actualizadas: {actualizados}, omitidas: {omitidos}."
+            f"Listo. Portafolios: {len(pf_ids)}. Cantidades creadas: {creados}, "
+            f"actualizadas: {actualizados}, omitidas: {omitidos}."
         ))
@@ -0,0 +1,78 @@
+import json
+from datetime import datetime
+
+from django.core.management.base import CommandError
+
+from inversiones import escenarios
+from inversiones.metricas import ComandoInstrumentado
+from inversiones.models import Portafolio
+
+
+class Command(ComandoInstrumentado):
+    help = (
+        "VaR y CVaR de las tenencias actuales de cada portafolio bajo escenarios de precios "
+        "simulados (bootstrap, normal) o históricos derivados de los rendimientos de Precio."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--metodo", default="bootstrap", choices=escenarios.METODOS,
+                            help="Generación de escenarios. Default: bootstrap")
+        parser.add_argument("--escenarios", type=int, default=10000,
+                            help="Número de escenarios (ignorado con 'historico'). Default: 10000")
+        parser.add_argument("--horizonte", type=int, default=1, help="Días del horizonte. Default: 1")
+        parser.add_argument("--ventana", type=int, default=500,
+                            help="Fechas de historia de las que salen los rendimientos. Default: 500")
+        parser.add_argument("--hasta", help="Fecha de valuación (YYYY-MM-DD). Default: último precio.")
+        parser.add_argument("--niveles", nargs="+", type=float, default=[0.95, 0.99],
+                            help="Niveles de confianza. Default: 0.95 0.99")
+        parser.add_argument("--semilla", type=int, default=42, help="Semilla del generador. Default: 42")
+        parser.add_argument("--pf", type=int, action="append", dest="pf_ids",
+                            help="Id de portafolio (repetible). Default: todos los que tienen cantidades.")
+        parser.add_argument("--procesos", type=int, default=1,
+                            help="Reparte los bloques de escenarios en N procesos. Default: 1")
+        parser.add_argument("--bloque", type=int, default=escenarios.BLOQUE,
+                            help=f"Escenarios por bloque (acota la memoria). Default: {escenarios.BLOQUE}")
+        parser.add_argument("--salida", help="Guarda el resultado en JSON.")
+
+    def handle(self, *args, **opts):
+        for nombre in ("escenarios", "horizonte", "procesos", "bloque"):
+            if opts[nombre] < 1:
+                raise CommandError(f"--{nombre} debe ser al menos 1.")
+        if opts["ventana"] < 2:
+            raise CommandError("--ventana debe ser al menos 2.")
+        if not all(0 < n < 1 for n in opts["niveles"]):
+            raise CommandError("--niveles deben estar entre 0 y 1.")
+        try:
+            hasta = datetime.strptime(opts["hasta"], "%Y-%m-%d").date() if opts["hasta"] else None
+        except ValueError:
+            raise CommandError("Parámetro --hasta inválido. Use formato YYYY-MM-DD.")
+
+        try:
+            fecha, pf_ids, simbolos, X, R = escenarios.cargar_insumos(opts["pf_ids"], hasta, opts["ventana"])
+            pnl = escenarios.simular(R, X, opts["metodo"], opts["escenarios"], opts["horizonte"], opts["semilla"],
+                                     procesos=opts["procesos"], bloque=opts["bloque"])
+        except ValueError as e:
+            raise CommandError(str(e))
+        resultados = escenarios.medidas(pnl, X, opts["niveles"])
+        nombres = dict(Portafolio.objects.filter(id__in=pf_ids).values_list("id", "nombre"))
+
+        self.stdout.write(
+            f"Valuación al {fecha}: {len(pf_ids)} portafolios, {len(simbolos)} activos, {R.shape[0]} rendimientos "
+            f"diarios; {pnl.shape[0]} escenarios '{opts['metodo']}' a {opts['horizonte']} días (semilla {opts['semilla']})."
+        )
+        for pf_id, r in zip(pf_ids, resultados):
+            riesgo = "  ".join(
+                f"VaR {m['nivel']:.1%} {m['var']:,.2f} ({m['var_pct']:.2%}) CVaR {m['cvar']:,.2f} ({m['cvar_pct']:.2%})"
+                if r["valor"] else f"VaR {m['nivel']:.1%} -"
+                for m in r["riesgo"]
+            )
+            self.stdout.write(f"{nombres.get(pf_id, pf_id)}: valor {r['valor']:,.2f}  {riesgo}")
+
+        if opts["salida"]:
+            with open(opts["salida"], "w") as f:
+                json.dump({
+                    "fecha": fecha.isoformat(), "metodo": opts["metodo"], "escenarios": pnl.shape[0],
+                    "horizonte": opts["horizonte"], "ventana": R.shape[0], "semilla": opts["semilla"],
+                    "portafolios": [{"id": pf_id, **r} for pf_id, r in zip(pf_ids, resultados)],
+                }, f)
+            self.stdout.write(self.style.SUCCESS(f"Resultados guardados en {opts['salida']}."))
@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+from datetime import datetime
+
+from django.core.management.base import CommandError
+
+from inversiones import exportacion
+from inversiones.importacion import memoria_pico_mb
+from inversiones.metricas import ComandoInstrumentado
+
+
+class Command(ComandoInstrumentado):
+    help = (
+        "Exporta V_t y w_{i,t} de los portafolios (una fila por portafolio, fecha y activo) "
+        "a CSV, NDJSON o Parquet, calculando y escribiendo de a bloques de fechas."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("salida", help="Archivo de salida, o - para la salida estándar.")
+        parser.add_argument("--formato", choices=list(exportacion.FORMATOS), default=None,
+                            help="Default: según la extensión de la salida (csv si no se reconoce).")
+        parser.add_argument("--pf", type=int, action="append", dest="pf_ids",
+                            help="Id de portafolio a exportar (repetible). Default: todos.")
+        parser.add_argument("--desde", default=None, help="Primera fecha (YYYY-MM-DD). Default: la primera con precios.")
+        parser.add_argument("--hasta", default=None, help="Última fecha (YYYY-MM-DD). Default: la última con precios.")
+        parser.add_argument("--dias", type=int, default=exportacion.DIAS_POR_BLOQUE,
+                            help=f"Fechas por bloque (default {exportacion.DIAS_POR_BLOQUE}).")
+
+    def handle(self, *args, **opts):
+        salida = opts["salida"]
+        formato = opts["formato"] or exportacion.EXTENSIONES.get(os.path.splitext(salida)[1].lower(), "csv")
+        fechas = []
+        for nombre in ("desde", "hasta"):
+            try:
+                fechas.append(datetime.strptime(opts[nombre], "%Y-%m-%d").date() if opts[nombre] else None)
+            except ValueError:
+                raise CommandError(f"Parámetro --{nombre} inválido. Use formato YYYY-MM-DD.")
+        if opts["dias"] < 1:
+            raise CommandError("--dias debe ser al menos 1.")
+        try:
+            exportacion.verificar_formato(formato)
+        except exportacion.ErrorExportacion as e:
+            raise CommandError(str(e))
+
+        filas = 0
+
+        def contados(bloques_):
+            nonlocal filas
+            for bloque in bloques_:
+                filas += bloque["portafolio"].size
+                yield bloque
+
+        inicio = time.perf_counter()
+        destino = sys.stdout.buffer if salida == "-" else open(salida, "wb")
+        escritos = 0
+        try:
+            for trozo in exportacion.trozos(formato, contados(exportacion.bloques(opts["pf_ids"], *fechas,
+                                                                                     dias=opts["dias"]))):
+                destino.write(trozo)
+                escritos += len(trozo)
+        finally:
+            if destino is not sys.stdout.buffer:
+                destino.close()
+
+        duracion = time.perf_counter() - inicio
+        pico = memoria_pico_mb()
+        pico_txt = f", memoria pico {pico:.0f} MB" if pico is not None else ""
+        # con salida estándar el resumen va a stderr para no mezclarse con los datos
+        informe = self.stderr if salida == "-" else self.stdout
+        informe.write(self.style.SUCCESS(
+            f"Exportación {formato} completada: {filas} filas, {escritos / 2 ** 20:.1f} MB "
+            f"en {duracion:.1f} s{pico_txt}."
+        ))
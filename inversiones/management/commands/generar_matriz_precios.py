@@ -0,0 +1,24 @@
+from django.core.management.base import CommandError
+
+from inversiones import matriz_precios
+from inversiones.metricas import ComandoInstrumentado
+
+
+class Command(ComandoInstrumentado):
+    help = (
+        "Genera la instantánea en disco de la matriz de precios (fechas × activos) que "
+        "leen las valuaciones con numpy.memmap. import_datos la regenera automáticamente."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--forzar", action="store_true",
+                            help="La regenera aunque ya exista una vigente.")
+
+    def handle(self, *args, **opts):
+        ruta = matriz_precios.generar(forzar=opts["forzar"])
+        if ruta is None:
+            raise CommandError("PRECIOS_MATRIZ_DIR no está definido.")
+        fechas, activo_ids, P, _ = matriz_precios.abrir()
+        self.stdout.write(self.style.SUCCESS(
+            f"Listo. {ruta}: {len(fechas)} fechas × {len(activo_ids)} activos ({P.nbytes / 2 ** 20:.1f} MB)."
+        ))
@@ -1,53 +1,224 @@
-from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.core.management.base import CommandError
 from django.db import transaction
+from django.db.models import Max
 from inversiones.models import Activo, Portafolio, Precio, Weight
+from inversiones.importacion import (
+    ErrorImportacion, bloques_precios, formato_de, fundir_precios, hoja_excel, leer_tabla, memoria_actual_mb
+)
+from inversiones import matriz_precios
+from inversiones.cache import invalidar
+from inversiones.metricas import ComandoInstrumentado
+from inversiones.trabajos import encolar_importacion
+from inversiones.valuacion import refrescar_valuaciones
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from decimal import Decimal
+from functools import partial
+import os
+import time
 import pandas as pd
 
+TOLERANCIA_PRECIO = 5e-7  # medio micro: Precio.precio tiene 6 decimales
+# opciones que se guardan con el trabajo al usar --encolar
+OPCIONES_ENCOLABLES = ("weights_sheet", "precios_sheet", "weights_path", "fecha_inicial", "pf1", "pf2",
+                       "chunk", "batch_size", "delta", "desde", "upsert", "memoria_max")
 
-class Command(BaseCommand):
-    help = "Importa activos, precios y weights desde un Excel (datos.xlsx)."
+
+class Command(ComandoInstrumentado):
+    help = (
+        "Importa activos, precios y weights desde un Excel (datos.xlsx), o precios desde CSV/Parquet. "
+        "Los precios se leen y se insertan por bloques, con memoria acotada."
+    )
+    # progreso(avance, total=None, mensaje=""): lo pasa el worker de trabajos (inversiones.trabajos)
+    stealth_options = ("progreso",)
 
     def add_arguments(self, parser):
-        parser.add_argument("xlsx_path", type=str, help="Ruta al archivo datos.xlsx")
+        parser.add_argument("archivo", type=str,
+                            help="Ruta al archivo de datos (.xlsx con hojas Weights/Precios, o precios en .csv/.parquet)")
         parser.add_argument("--weights-sheet", default="Weights", help="Nombre de la hoja con weights")
         parser.add_argument("--precios-sheet", default="Precios", help="Nombre de la hoja con precios")
+        parser.add_argument("--weights-path", default=None,
+                            help="Archivo de weights (.xlsx/.csv/.parquet). Default: el mismo Excel; "
+                                 "para CSV/Parquet sin este parámetro no se importan weights.")
         parser.add_argument("--fecha-inicial", default="2022-02-15", help="Fecha inicial t0 (YYYY-MM-DD)")
         parser.add_argument("--pf1", default="Portafolio 1", help="Nombre del primer portafolio")
         parser.add_argument("--pf2", default="Portafolio 2", help="Nombre del segundo portafolio")
+        parser.add_argument("--chunk", type=int, default=500,
+                            help="Fechas (filas de la tabla de precios) leídas por bloque. Default: 500")
+        parser.add_argument("--batch-size", type=int, default=5000,
+                            help="Filas de Precio por INSERT. Default: 5000")
+        parser.add_argument("--delta", action="store_true",
+                            help="Solo importa precios posteriores a la última fecha cargada de cada activo.")
+        parser.add_argument("--desde", default=None,
+                            help="Solo importa precios con fecha >= a esta (YYYY-MM-DD), p. ej. ventana de correcciones.")
+        parser.add_argument("--upsert", action="store_true",
+                            help="Actualiza los precios existentes que cambiaron (por defecto se ignoran).")
+        parser.add_argument("--memoria-max", type=int, default=None,
+                            help="Aborta (sin importar nada) si la memoria residente supera estos MB al terminar "
+                                 "un bloque. Default: IMPORTACION_MEMORIA_MAX_MB (0: sin límite).")
+        parser.add_argument("--encolar", action="store_true",
+                            help="No importa ahora: encola la importación para procesar_trabajos y termina.")
 
     def handle(self, *args, **opts):
-        xlsx_path = opts["xlsx_path"]
-        hoja_w = opts["weights_sheet"]
-        hoja_p = opts["precios_sheet"]
+        archivo = opts["archivo"]
+        if opts["encolar"]:
+            opciones = {k: opts[k] for k in OPCIONES_ENCOLABLES}
+            if opciones["weights_path"]:
+                opciones["weights_path"] = os.path.abspath(opciones["weights_path"])
+            trabajo = encolar_importacion(archivo, opciones)
+            self.stdout.write(self.style.SUCCESS(
+                f"Importación encolada: trabajo {trabajo.id}. La ejecuta procesar_trabajos."
+            ))
+            return
+        progreso = opts.get("progreso") or (lambda *a, **k: None)
+        memoria_max = opts["memoria_max"]
+        if memoria_max is None:
+            memoria_max = settings.IMPORTACION_MEMORIA_MAX_MB
+        memoria_obs = memoria_actual_mb()  # máximo observado al terminar cada bloque
         fecha_inicial = datetime.strptime(opts["fecha_inicial"], "%Y-%m-%d").date()
         pf1_name = opts["pf1"]
         pf2_name = opts["pf2"]
+        inicio = time.perf_counter()
+        desde = None
+        if opts["desde"]:
+            try:
+                desde = datetime.strptime(opts["desde"], "%Y-%m-%d").date()
+            except ValueError:
+                raise CommandError("Parámetro --desde inválido. Use formato YYYY-MM-DD.")
 
-        # Abre el Excel (case-insensitive para nombres de hoja)
         try:
-            xls = pd.ExcelFile(xlsx_path)
-        except Exception as e:
-            raise CommandError(f"No se pudo abrir el Excel: {e}")
+            formato = formato_de(archivo)
+        except ErrorImportacion as e:
+            raise CommandError(str(e))
 
-        sheets_lower = {s.lower(): s for s in xls.sheet_names}
-        if hoja_w.lower() not in sheets_lower or hoja_p.lower() not in sheets_lower:
-            raise CommandError(f"No se encontraron las hojas requeridas. Disponibles: {xls.sheet_names}")
+        # Excel: ambas hojas del mismo libro (case-insensitive para nombres de hoja)
+        hoja_p_real = hoja_w_real = None
+        weights_path = opts["weights_path"]
+        if formato == "excel":
+            try:
+                hoja_p_real = hoja_excel(archivo, opts["precios_sheet"])
+                hoja_w_real = hoja_excel(weights_path or archivo, opts["weights_sheet"])
+            except Exception as e:
+                raise CommandError(f"No se pudo abrir el Excel: {e}")
+            if hoja_p_real is None or hoja_w_real is None:
+                raise CommandError("No se encontraron las hojas requeridas (weights y precios).")
+            weights_path = weights_path or archivo
+        elif weights_path and formato_de(weights_path) == "excel":
+            hoja_w_real = hoja_excel(weights_path, opts["weights_sheet"])
 
-        hoja_w_real = sheets_lower[hoja_w.lower()]
-        hoja_p_real = sheets_lower[hoja_p.lower()]
+        df_w = None
+        if weights_path:
+            try:
+                df_w = leer_tabla(weights_path, hoja_w_real)
+            except Exception as e:
+                raise CommandError(f"Error leyendo weights: {e}")
+            df_w.columns = [str(c).strip() for c in df_w.columns]
+        else:
+            self.stdout.write(self.style.WARNING("Sin --weights-path: solo se importan precios."))
 
-        try:
-            df_w = pd.read_excel(xls, hoja_w_real)
-            df_p = pd.read_excel(xls, hoja_p_real)
-        except Exception as e:
-            raise CommandError(f"Error leyendo hojas: {e}")
+        weights_are_percent = False
+        if df_w is not None:
+            col_activo_w, col_pf1, col_pf2, weights_are_percent = self._columnas_weights(df_w)
+        percent_divisor = Decimal("100") if weights_are_percent else Decimal("1")
+
+        filas_leidas = filas_escritas = 0
+        fechas_nuevas = set()
+        with transaction.atomic():
+            pf1, _ = Portafolio.objects.get_or_create(nombre=pf1_name)
+            pf2, _ = Portafolio.objects.get_or_create(nombre=pf2_name)
+
+            # Carga precios por bloques: melt vectorizado + bulk_create acotado
+            activos = {}  # simbolo -> activo_id
+            col_fecha_p = None
+            try:
+                for df_p in bloques_precios(archivo, hoja_p_real, opts["chunk"]):
+                    df_p.columns = [str(c).strip() for c in df_p.columns]
+                    if col_fecha_p is None:
+                        # --- Precios: primera columna fecha ---
+                        col_fecha_p = df_p.columns[0]
+                        activos_cols = list(df_p.columns[1:])
+                        if not activos_cols:
+                            raise CommandError("La hoja Precios debe tener columnas de activos.")
+                        activos = self._asegurar_activos(activos_cols)
+                        despues_de = self._cortes(activos, opts["delta"], desde)
+
+                    try:
+                        ids, fechas, precios = fundir_precios(df_p, col_fecha_p,
+                                                              {c: activos[c] for c in activos_cols},
+                                                              despues_de)
+                    except (ValueError, TypeError):
+                        raise CommandError("La primera columna de Precios debe ser una fecha válida.")
+                    if not len(ids):
+                        continue
+                    filas_leidas += len(ids)
+                    escritas, fechas_bloque = self._insertar_precios(ids, fechas, precios, opts["batch_size"],
+                                                                     upsert=opts["upsert"])
+                    filas_escritas += escritas
+                    fechas_nuevas |= fechas_bloque
+                    progreso(filas_leidas, mensaje=f"{filas_leidas} precios leídos")
+                    memoria_obs = self._vigilar_memoria(memoria_obs, memoria_max)
+            except ErrorImportacion as e:
+                raise CommandError(str(e))
+            if col_fecha_p is None:
+                raise CommandError("La hoja Precios está vacía.")
+
+            # Carga weights en t0 (normalizando si venían en %)
+            weights_bulk = []
+            if df_w is not None:
+                faltantes = {str(s).strip() for s in df_w[col_activo_w]} - activos.keys()
+                activos.update(self._asegurar_activos(faltantes))
+                for simbolo, w1, w2 in zip(df_w[col_activo_w], df_w[col_pf1], df_w[col_pf2]):
+                    a_id = activos[str(simbolo).strip()]
+                    if pd.notna(w1):
+                        w1_dec = (Decimal(str(w1)) / percent_divisor).quantize(Decimal("0.000000"))
+                        weights_bulk.append(
+                            Weight(portafolio=pf1, activo_id=a_id, fecha=fecha_inicial, weight=w1_dec)
+                        )
+                    if pd.notna(w2):
+                        w2_dec = (Decimal(str(w2)) / percent_divisor).quantize(Decimal("0.000000"))
+                        weights_bulk.append(
+                            Weight(portafolio=pf2, activo_id=a_id, fecha=fecha_inicial, weight=w2_dec)
+                        )
+
+            if weights_bulk:
+                #inserta la operación en la base de datos
+                Weight.objects.bulk_create(weights_bulk, ignore_conflicts=True)
+                invalidar(pf_ids=[pf1.id, pf2.id])  # el backtest en caché parte de los weights
 
-        df_w.columns = [str(c).strip() for c in df_w.columns]
-        df_p.columns = [str(c).strip() for c in df_p.columns]
+            # Recalcula la valuación materializada solo en las fechas con precios nuevos o corregidos.
+            # La versión sube antes: así la instantánea de precios anterior deja de ser vigente.
+            if fechas_nuevas:
+                invalidar(precios=True)
+            progreso(filas_leidas, mensaje=f"Recalculando valuaciones en {len(fechas_nuevas)} fechas", forzar=True)
+            refrescar_valuaciones(fechas=fechas_nuevas)
+            # incremental: respecto de la versión anterior solo cambian precios desde la primera fecha importada
+            transaction.on_commit(partial(matriz_precios.generar, desde=min(fechas_nuevas) if fechas_nuevas else None))
+
+        duracion = time.perf_counter() - inicio
+        escala_txt = " (normalizados desde %)" if weights_are_percent else ""
+        pico_txt = f", memoria máx. {memoria_obs:.0f} MB" if memoria_obs is not None else ""
+        if memoria_obs is not None and memoria_max:
+            pico_txt += f" de {memoria_max} MB"
+        self.stdout.write(self.style.SUCCESS(
+            f"Importación completada correctamente{escala_txt}. "
+            f"{filas_leidas} precios leídos en {duracion:.1f} s "
+            f"({filas_leidas / duracion if duracion else 0:,.0f} filas/s{pico_txt}); "
+            f"{filas_escritas} nuevos o corregidos en {len(fechas_nuevas)} fechas."
+        ))
 
+    @staticmethod
+    def _vigilar_memoria(observada, maxima):
+        """Máximo de la memoria residente observada; CommandError (y rollback) si pasa ``maxima`` MB."""
+        actual = memoria_actual_mb()
+        if actual is None:
+            return observada
+        if maxima and actual > maxima:
+            raise CommandError(f"La importación superó el límite de memoria ({actual:.0f} MB > {maxima} MB); "
+                               "no se importó nada. Reduzca --chunk o --batch-size.")
+        return max(observada or 0, actual)
+
+    def _columnas_weights(self, df_w):
         # --- Detectar columnas de Weights ---
         # numéricas (dos pesos pf1/pf2)
         num_cols_w = df_w.select_dtypes(include="number").columns.tolist()
@@ -72,71 +243,55 @@ class Command(BaseCommand):
         pf2_max = pd.to_numeric(df_w[col_pf2], errors="coerce").max()
         # Si cualquiera supera 1, asumimos porcentaje (ej: 25 -> 0.25)
         weights_are_percent = (pd.notna(pf1_max) and pf1_max > 1) or (pd.notna(pf2_max) and pf2_max > 1)
-        percent_divisor = Decimal("100") if weights_are_percent else Decimal("1")
-
-        # --- Precios: primera columna fecha ---
-        col_fecha_p = df_p.columns[0]
-        try:
-            df_p[col_fecha_p] = pd.to_datetime(df_p[col_fecha_p]).dt.date
-        except Exception:
-            raise CommandError("La primera columna de Precios debe ser una fecha válida.")
-
-        activos_cols = df_p.columns[1:]
-        if len(activos_cols) == 0:
-            raise CommandError("La hoja Precios debe tener columnas de activos.")
+        return col_activo_w, col_pf1, col_pf2, weights_are_percent
 
-        with transaction.atomic():
-            pf1, _ = Portafolio.objects.get_or_create(nombre=pf1_name)
-            pf2, _ = Portafolio.objects.get_or_create(nombre=pf2_name)
+    def _asegurar_activos(self, simbolos):
+        """Crea los activos faltantes en bloque y devuelve simbolo -> activo_id."""
+        simbolos = [str(s).strip() for s in simbolos]
+        existentes = dict(Activo.objects.filter(simbolo__in=simbolos).values_list("simbolo", "id"))
+        nuevos = [Activo(simbolo=s, nombre=s) for s in dict.fromkeys(simbolos) if s not in existentes]
+        if nuevos:
+            Activo.objects.bulk_create(nuevos, ignore_conflicts=True)
+            existentes = dict(Activo.objects.filter(simbolo__in=simbolos).values_list("simbolo", "id"))
+        return existentes
 
-            # Crea/obtiene activos a partir de columnas de Precios
-            activos = {}
-            for col in activos_cols:
-                simbolo = str(col).strip()
-                a, _ = Activo.objects.get_or_create(simbolo=simbolo, defaults={"nombre": simbolo})
-                activos[simbolo] = a
-
-            # Carga precios
-            precios_bulk = []
-            for _, row in df_p.iterrows():
-                fecha = row[col_fecha_p]
-                for col in activos_cols:
-                    val = row[col]
-                    if pd.isna(val):
-                        continue
-                    precios_bulk.append(
-                        Precio(activo=activos[str(col)], fecha=fecha, precio=Decimal(str(val)))
-                    )
-            if precios_bulk:
-                #inserta la operación en la base de datos
-                Precio.objects.bulk_create(precios_bulk, ignore_conflicts=True)
+    def _cortes(self, activos, delta, desde):
+        """
+        activo_id -> fecha de corte (se importan solo precios posteriores), o None
+        para importar todo. En modo delta es la última fecha cargada de cada activo.
+        """
+        if not delta and desde is None:
+            return None
+        cortes = {}
+        if delta:
+            cortes = dict(Precio.objects.filter(activo_id__in=list(activos.values()))
+                          .values("activo_id").annotate(ultima=Max("fecha"))
+                          .values_list("activo_id", "ultima"))
+        if desde is not None:
+            dia_previo = desde - timedelta(days=1)
+            cortes = {a: max(cortes.get(a, dia_previo), dia_previo) for a in activos.values()}
+        return cortes
 
-            # Carga weights en t0 (normalizando si venían en %)
-            weights_bulk = []
-            for _, row in df_w.iterrows():
-                simbolo = str(row[col_activo_w]).strip()
-                if simbolo not in activos:
-                    a, _ = Activo.objects.get_or_create(simbolo=simbolo, defaults={"nombre": simbolo})
-                    activos[simbolo] = a
-                a = activos[simbolo]
-
-                w1 = row[col_pf1]
-                w2 = row[col_pf2]
-
-                if pd.notna(w1):
-                    w1_dec = (Decimal(str(w1)) / percent_divisor).quantize(Decimal("0.000000"))
-                    weights_bulk.append(
-                        Weight(portafolio=pf1, activo=a, fecha=fecha_inicial, weight=w1_dec)
-                    )
-                if pd.notna(w2):
-                    w2_dec = (Decimal(str(w2)) / percent_divisor).quantize(Decimal("0.000000"))
-                    weights_bulk.append(
-                        Weight(portafolio=pf2, activo=a, fecha=fecha_inicial, weight=w2_dec)
-                    )
-
-            if weights_bulk:
-                #inserta la operación en la base de datos
-                Weight.objects.bulk_create(weights_bulk, ignore_conflicts=True)
-
-        escala_txt = " (normalizados desde %)" if weights_are_percent else ""
-        self.stdout.write(self.style.SUCCESS(f"Importación completada correctamente{escala_txt}."))
+    def _insertar_precios(self, ids, fechas, precios, batch_size, upsert=False):
+        """
+        Inserta un bloque de precios y devuelve ``(filas_escritas, fechas)`` con
+        las fechas que recibieron precios nuevos o corregidos. Sin ``upsert`` los existentes se ignoran; con ``upsert`` se
+        reescriben solo los que cambiaron de valor.
+        """
+        existentes = {
+            (a, f): p for a, f, p in Precio.objects
+            .filter(activo_id__in=set(ids.tolist()), fecha__range=(fechas.min(), fechas.max()))
+            .values_list("activo_id", "fecha", "precio")
+        }
+        cambios = []
+        for a, f, p in zip(ids.tolist(), fechas.tolist(), precios.tolist()):
+            previo = existentes.get((a, f))
+            if previo is None or (upsert and abs(float(previo) - p) > TOLERANCIA_PRECIO):
+                cambios.append(Precio(activo_id=a, fecha=f, precio=p))
+        #inserta la operación en la base de datos
+        if upsert:
+            Precio.objects.bulk_create(cambios, batch_size=batch_size, update_conflicts=True,
+                                       unique_fields=["activo", "fecha"], update_fields=["precio"])
+        else:
+            Precio.objects.bulk_create(cambios, batch_size=batch_size, ignore_conflicts=True)
+        return len(cambios), {p.fecha for p in cambios}
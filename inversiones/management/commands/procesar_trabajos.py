@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from inversiones import trabajos
+from inversiones.metricas import REGISTRO, escribir_textfile, medir
+
+
+class Command(BaseCommand):
+    help = (
+        "Worker de la cola de trabajos: ejecuta los recálculos e importaciones encolados por la API "
+        "o por import_datos --encolar. Pueden correr varios a la vez."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--una-vez", action="store_true",
+                            help="Procesa los trabajos pendientes y termina en vez de esperar nuevos.")
+        parser.add_argument("--intervalo", type=float, default=1.0,
+                            help="Segundos de espera cuando la cola está vacía. Default: 1")
+
+    def handle(self, *args, **opts):
+        procesados = 0
+        while True:
+            close_old_connections()  # el worker vive mucho: igual que entre peticiones
+            trabajo = trabajos.tomar_siguiente()
+            if trabajo is None:
+                if opts["una_vez"]:
+                    break
+                time.sleep(opts["intervalo"])
+                continue
+
+            # cada trabajo se mide como un comando propio: trabajo_recalcular / trabajo_importar
+            comando = f"trabajo_{trabajo.tipo}"
+            with medir() as m:
+                ok = trabajos.ejecutar(trabajo)
+            REGISTRO.registrar_comando(comando, m, ok)
+            escribir_textfile(comando, m, ok)
+            procesados += 1
+
+            estilo = self.style.SUCCESS if ok else self.style.ERROR
+            self.stdout.write(estilo(f"{trabajo}: {m.total:.2f} s"))
+            if not ok and opts["verbosity"] >= 2:
+                self.stderr.write(trabajo.error)
+
+        self.stdout.write(f"Sin trabajos pendientes. Procesados: {procesados}.")
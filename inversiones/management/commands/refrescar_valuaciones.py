@@ -0,0 +1,37 @@
+from django.core.management.base import CommandError
+from django.db import transaction
+from datetime import datetime
+
+from inversiones.cache import invalidar
+from inversiones.metricas import ComandoInstrumentado
+from inversiones.valuacion import refrescar_valuaciones
+
+
+class Command(ComandoInstrumentado):
+    help = (
+        "Recalcula la tabla materializada de valuaciones (V_t, x_{i,t}, w_{i,t}) "
+        "que lee la API de evolución."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pf", type=int, action="append", dest="pf_ids",
+                            help="Id de portafolio a recalcular (repetible). Default: todos.")
+        parser.add_argument("--desde", default=None,
+                            help="Recalcula solo desde esta fecha (YYYY-MM-DD), en portafolios ya materializados. "
+                                 "Default: historia completa.")
+
+    def handle(self, *args, **opts):
+        desde = None
+        if opts["desde"]:
+            try:
+                desde = datetime.strptime(opts["desde"], "%Y-%m-%d").date()
+            except ValueError:
+                raise CommandError("Parámetro --desde inválido. Use formato YYYY-MM-DD.")
+
+        with transaction.atomic():
+            n = refrescar_valuaciones(opts["pf_ids"], desde=desde)
+            if opts["pf_ids"]:
+                invalidar(pf_ids=opts["pf_ids"])
+            else:
+                invalidar(precios=True)
+        self.stdout.write(self.style.SUCCESS(f"Listo. Fechas de portafolio recalculadas: {n}."))
@@ -0,0 +1,218 @@
+# inversiones/matriz_precios.py
+"""
+Instantánea en disco de la matriz de precios fechas × activos.
+
+``generar()`` vuelca todos los precios a ``PRECIOS_MATRIZ_DIR/<base>/v<versión>-<token>/``
+(``<base>`` identifica la base de datos):
+
+- ``precios.npy``: float64 (fechas × activos), NaN donde no hay precio.
+- ``fechas.npy``: datetime64[D] ordenadas (índice de filas).
+- ``activos.npy``: int64, ids de ``Activo`` ordenados (índice de columnas).
+- ``ultimo.npy``: int32 (fechas × activos), índice as-of: fila del último
+  precio de cada activo en o antes de cada fecha, -1 si aún no tiene (ver
+  ``calendario``).
+- ``meta.json``: versión, token, forma y símbolos en el orden de las columnas.
+
+``cargar_matriz_precios`` abre la vigente con ``numpy.load(mmap_mode="r")``:
+los procesos que la leen comparten las páginas del sistema operativo sin
+copiarlas, y un rango de fechas es un corte de la matriz en vez de una consulta.
+
+La instantánea es derivada: vale solo si coincide con la versión "precios" de
+``VersionDatos`` y con el token "matriz" que ``generar`` guarda en la misma
+base (así una base distinta, p. ej. la de pruebas, nunca lee la de otra). Si no
+coincide se lee de la base de datos como antes. ``import_datos`` la regenera al
+confirmar la importación; ``generar_matriz_precios`` lo hace a mano.
+
+Con ``desde`` la regeneración es incremental: si la instantánea de la versión
+anterior sigue en disco, se conservan sus filas previas a ``desde`` y de la base
+solo se leen los precios desde esa fecha; el índice as-of se continúa desde la
+última fila conservada en vez de recalcularse entero.
+"""
+import hashlib
+import json
+import os
+import secrets
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+
+from . import calendario
+from .micro import en_micro
+from .models import Activo, Precio, VersionDatos
+
+CLAVE_TOKEN = "matriz"
+
+_lock = threading.Lock()
+_abierta = {}  # ruta -> (fechas, activo_ids, P, U); solo la última versión abierta
+
+
+def directorio():
+    """Directorio de las instantáneas de esta base de datos, o None si están deshabilitadas."""
+    raiz = getattr(settings, "PRECIOS_MATRIZ_DIR", None)
+    if not raiz:
+        return None
+    return os.path.join(str(raiz), hashlib.sha1(str(connection.settings_dict["NAME"]).encode()).hexdigest()[:12])
+
+
+def _versiones():
+    return dict(VersionDatos.objects.filter(clave__in=["precios", CLAVE_TOKEN]).values_list("clave", "version"))
+
+
+def _ruta_vigente(base, versiones=None):
+    """Ruta de la instantánea que corresponde a los datos actuales (una consulta)."""
+    versiones = _versiones() if versiones is None else versiones
+    if CLAVE_TOKEN not in versiones:
+        return None
+    return os.path.join(base, f"v{versiones.get('precios', 0)}-{versiones[CLAVE_TOKEN]:x}")
+
+
+def _leer(ruta):
+    P = np.load(os.path.join(ruta, "precios.npy"), mmap_mode="r")
+    ultimo = os.path.join(ruta, "ultimo.npy")
+    # las instantáneas anteriores al índice as-of lo calculan al abrirse
+    U = np.load(ultimo, mmap_mode="r") if os.path.exists(ultimo) else calendario.indice_asof(P).astype(np.int32)
+    return np.load(os.path.join(ruta, "fechas.npy")), np.load(os.path.join(ruta, "activos.npy")), P, U
+
+
+def abrir():
+    """
+    ``(fechas, activo_ids, P, U)`` de la instantánea vigente (``P`` y el índice
+    as-of ``U`` mapeados en memoria), o None.
+    """
+    base = directorio()
+    if base is None:
+        return None
+    ruta = _ruta_vigente(base)
+    if ruta is None:
+        return None
+    with _lock:
+        if ruta in _abierta:
+            return _abierta[ruta]
+    if not os.path.isdir(ruta):
+        return None
+    abierta = _leer(ruta)
+    with _lock:
+        _abierta.clear()
+        _abierta[ruta] = abierta
+    return abierta
+
+
+def _corte(fechas, ids, activo_ids, fi, ff):
+    """Filas [lo, hi) del rango y columna de cada activo pedido (``presentes``: los que están)."""
+    activo_ids = np.asarray(activo_ids, dtype=np.int64)
+    lo = 0 if fi is None else int(np.searchsorted(fechas, np.datetime64(fi, "D"), side="left"))
+    hi = fechas.size if ff is None else int(np.searchsorted(fechas, np.datetime64(ff, "D"), side="right"))
+    pos = np.minimum(np.searchsorted(ids, activo_ids), max(ids.size - 1, 0))
+    presentes = ids[pos] == activo_ids if ids.size else np.zeros(activo_ids.size, dtype=bool)
+    return lo, hi, pos, presentes
+
+
+def matriz_asof(activo_ids, fi=None, ff=None):
+    """
+    Como ``calendario.cargar_asof`` pero cortando la instantánea con su índice
+    as-of: ``(fechas, P, U)`` o None si no hay una vigente. Los precios
+    arrastrados salen de un solo gather sobre las filas que indica U, aunque
+    estén antes de ``fi``.
+    """
+    abierta = abrir()
+    if abierta is None:
+        return None
+    fechas, ids, P, U = abierta
+    lo, hi, pos, presentes = _corte(fechas, ids, activo_ids, fi, ff)
+
+    filas = np.full((hi - lo, len(activo_ids)), -1, dtype=np.int64)
+    if presentes.any():
+        filas[:, presentes] = U[lo:hi, pos[presentes]]
+    sub = np.full(filas.shape, np.nan)
+    hay = filas >= 0
+    sub[hay] = P[filas[hay], np.broadcast_to(pos, filas.shape)[hay]]
+    return calendario.recortar(fechas[lo:hi].astype(object).tolist(), sub, np.where(filas >= lo, filas - lo, -1))
+
+
+def _extender(anterior, activo_ids, desde):
+    """
+    Fechas, matriz e índice as-of completos a partir de la instantánea
+    ``anterior``: sus filas previas a ``desde`` (con las columnas llevadas a
+    ``activo_ids``) más los precios de la base desde esa fecha.
+    """
+    from .portafolio import matriz_desde_filas
+
+    fechas_prev, ids_prev, P_prev, U_prev = anterior
+    lo = int(np.searchsorted(fechas_prev, np.datetime64(desde, "D"), side="left"))
+    _, _, pos, presentes = _corte(fechas_prev, ids_prev, activo_ids, None, None)
+    P = np.full((lo, len(activo_ids)), np.nan)
+    U = np.full((lo, len(activo_ids)), -1, dtype=np.int64)
+    if presentes.any():
+        P[:, presentes] = P_prev[:lo, pos[presentes]]
+        U[:, presentes] = U_prev[:lo, pos[presentes]]
+
+    filas = (Precio.objects.filter(fecha__gte=desde)
+             .values_list("activo_id", "fecha", en_micro("precio")).iterator(chunk_size=20000))
+    fechas_n, P_n = matriz_desde_filas(activo_ids, filas, en_micro=True)
+    U_n = calendario.indice_asof(P_n, inicio=lo, previo=U[-1] if lo else None)
+    fechas = fechas_prev[:lo].astype(object).tolist() + fechas_n
+    return fechas, np.vstack([P, P_n]), np.vstack([U, U_n])
+
+
+def generar(forzar=False, desde=None):
+    """
+    Escribe la instantánea de los precios actuales y descarta las anteriores.
+    Devuelve la ruta, o None si ``PRECIOS_MATRIZ_DIR`` no está definido.
+
+    ``desde`` declara que, respecto de la versión anterior, solo cambiaron
+    precios en esa fecha o después (``import_datos`` pasa la primera fecha
+    importada): si esa instantánea sigue en disco se extiende en vez de leer
+    toda la tabla; si no, se genera completa.
+    """
+    from .portafolio import matriz_desde_filas
+
+    base = directorio()
+    if base is None:
+        return None
+    os.makedirs(base, exist_ok=True)
+
+    with transaction.atomic():  # versión y filas de la misma lectura
+        versiones = _versiones()
+        ruta = _ruta_vigente(base, versiones)
+        if ruta is not None and os.path.isdir(ruta) and not forzar:
+            return ruta
+        version = versiones.get("precios", 0)
+        activos = list(Activo.objects.order_by("id").values_list("id", "simbolo"))
+        activo_ids = [aid for aid, _ in activos]
+        anterior = None
+        if desde is not None and CLAVE_TOKEN in versiones:
+            anterior = os.path.join(base, f"v{version - 1}-{versiones[CLAVE_TOKEN]:x}")
+        if anterior is not None and os.path.isdir(anterior):
+            fechas, P, U = _extender(_leer(anterior), activo_ids, desde)
+        else:
+            filas = Precio.objects.values_list("activo_id", "fecha", en_micro("precio")).iterator(chunk_size=20000)
+            fechas, P = matriz_desde_filas(activo_ids, filas, en_micro=True)
+            U = calendario.indice_asof(P)
+
+    token = secrets.randbits(62)
+    ruta = os.path.join(base, f"v{version}-{token:x}")
+    temporal = tempfile.mkdtemp(prefix=".tmp-", dir=base)
+    try:
+        np.save(os.path.join(temporal, "precios.npy"), np.ascontiguousarray(P, dtype=np.float64))
+        np.save(os.path.join(temporal, "fechas.npy"), np.array(fechas, dtype="datetime64[D]"))
+        np.save(os.path.join(temporal, "activos.npy"), np.array(activo_ids, dtype=np.int64))
+        np.save(os.path.join(temporal, "ultimo.npy"), U.astype(np.int32))
+        with open(os.path.join(temporal, "meta.json"), "w") as f:
+            json.dump({"version": version, "token": token, "forma": list(P.shape),
+                       "simbolos": [s for _, s in activos]}, f)
+        os.rename(temporal, ruta)
+    except BaseException:
+        shutil.rmtree(temporal, ignore_errors=True)
+        raise
+
+    # el token se publica al final: antes de esto los lectores siguen con la anterior o con la base
+    VersionDatos.objects.update_or_create(clave=CLAVE_TOKEN, defaults={"version": token})
+    for nombre in os.listdir(base):
+        if nombre.startswith("v") and os.path.join(base, nombre) != ruta:
+            # los procesos que aún la tienen mapeada la siguen leyendo (POSIX)
+            shutil.rmtree(os.path.join(base, nombre), ignore_errors=True)
+    return ruta
@@ -0,0 +1,303 @@
+# inversiones/metricas.py
+"""
+Instrumentación liviana de peticiones y comandos.
+
+``medir()`` cuenta consultas y tiempo de base de datos con
+``connection.execute_wrapper`` (sin guardar el SQL, así que sirve en
+producción); ``seccion("serializacion")`` atribuye tiempo a una etapa con
+nombre. El resto del tiempo se informa como cómputo Python. Como en
+``CursorDebugWrapper``, el tiempo de base de datos es el de ``execute``: leer
+las filas del cursor cuenta como cómputo.
+
+Las mediciones se acumulan en histogramas en memoria del proceso
+(``REGISTRO``), que ``/metrics`` expone en formato de texto de Prometheus. Los
+comandos, que viven en su propio proceso, además pueden dejar sus métricas en
+``METRICAS_TEXTFILE_DIR`` para el textfile collector de node_exporter.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+BUCKETS_CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+BUCKETS_BYTES = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+
+
+_lock_sumar = threading.Lock()
+
+
+class Medicion:
+    """Tiempos (s) y consultas de una petición o comando."""
+    __slots__ = ("inicio", "total", "consultas", "db", "secciones")
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.total = 0.0
+        self.consultas = 0
+        self.db = 0.0
+        self.secciones = defaultdict(float)
+
+    def sumar(self, otra):
+        """Agrega consultas y tiempo de base de datos de una medición hecha en otro hilo."""
+        with _lock_sumar:
+            self.consultas += otra.consultas
+            self.db += otra.db
+
+    @property
+    def python(self):
+        """Tiempo que no fue base de datos ni una sección con nombre."""
+        return max(self.total - self.db - sum(self.secciones.values()), 0.0)
+
+
+_actual = ContextVar("medicion_actual", default=None)
+
+
+def medicion_actual():
+    """La medición en curso en este contexto (petición o comando), o None."""
+    return _actual.get()
+
+
+@contextmanager
+def medir():
+    """
+    Mide el bloque: tiempo total, consultas y tiempo en la base de datos. Las
+    conexiones son por hilo: lo que corre en otros hilos se agrega con
+    ``Medicion.sumar`` (ver ``inversiones.asincrono.en_hilo``).
+    """
+    m = Medicion()
+
+    def envoltorio(execute, sql, params, many, context):
+        t = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            m.db += time.perf_counter() - t
+            m.consultas += 1
+
+    token = _actual.set(m)
+    try:
+        with ExitStack() as stack:
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(envoltorio))
+            yield m
+    finally:
+        m.total = time.perf_counter() - m.inicio
+        _actual.reset(token)
+
+
+@contextmanager
+def seccion(nombre):
+    """Atribuye el tiempo del bloque a ``nombre`` en la medición en curso (si hay una)."""
+    m = _actual.get()
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        if m is not None:
+            m.secciones[nombre] += time.perf_counter() - t
+
+
+def server_timing(m):
+    """Valor del encabezado ``Server-Timing`` (duraciones en ms)."""
+    partes = [f'db;dur={m.db * 1000:.1f};desc="{m.consultas} consultas"']
+    partes += [f"{nombre};dur={dur * 1000:.1f}" for nombre, dur in m.secciones.items()]
+    partes += [f"app;dur={m.python * 1000:.1f}", f"total;dur={m.total * 1000:.1f}"]
+    return ", ".join(partes)
+
+
+# ---------------------------------------------------------------------------
+# Registro en memoria con exposición en texto de Prometheus
+# ---------------------------------------------------------------------------
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _etiquetas(nombres, valores, extra=""):
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _num(x):
+    return repr(float(x)) if x != float("inf") else "+Inf"
+
+
+class Histograma:
+    def __init__(self, nombre, ayuda, etiquetas, buckets):
+        self.nombre, self.ayuda, self.etiquetas = nombre, ayuda, tuple(etiquetas)
+        self.buckets = tuple(float(b) for b in buckets)
+        self.series = {}  # valores de etiquetas -> [conteos por bucket, suma, n]
+
+    def observar(self, valores, x):
+        serie = self.series.get(valores)
+        if serie is None:
+            serie = self.series[valores] = [[0] * len(self.buckets), 0.0, 0]
+        i = bisect_left(self.buckets, x)
+        if i < len(self.buckets):
+            serie[0][i] += 1
+        serie[1] += x
+        serie[2] += 1
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        for valores, (conteos, suma, n) in sorted(self.series.items()):
+            acumulado = 0
+            for b, c in zip(self.buckets, conteos):
+                acumulado += c
+                le = 'le="%s"' % _num(b)
+                lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, valores, le)} {acumulado}")
+            le = 'le="+Inf"'
+            lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, valores, le)} {n}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, valores)} {_num(suma)}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, valores)} {n}")
+        return lineas
+
+
+class Contador:
+    def __init__(self, nombre, ayuda, etiquetas):
+        self.nombre, self.ayuda, self.etiquetas = nombre, ayuda, tuple(etiquetas)
+        self.series = defaultdict(int)
+
+    def incrementar(self, valores, n=1):
+        self.series[valores] += n
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        lineas += [f"{self.nombre}_total{_etiquetas(self.etiquetas, v)} {n}" for v, n in sorted(self.series.items())]
+        return lineas
+
+
+class Registro:
+    """Métricas del proceso. Seguro entre hilos; cada observación es O(log buckets)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._lock:
+            v = ("vista",)
+            c = ("comando",)
+            self.peticiones = Contador("portafolio_peticiones", "Peticiones HTTP atendidas.", ("vista", "status"))
+            self.metricas = [
+                self.peticiones,
+                Histograma("portafolio_peticion_segundos", "Duración total de la petición.", v, BUCKETS_SEGUNDOS),
+                Histograma("portafolio_peticion_db_segundos", "Tiempo en la base de datos.", v, BUCKETS_SEGUNDOS),
+                Histograma("portafolio_peticion_python_segundos", "Cómputo Python (sin base ni secciones).",
+                           v, BUCKETS_SEGUNDOS),
+                Histograma("portafolio_peticion_serializacion_segundos", "Serialización de la respuesta.",
+                           v, BUCKETS_SEGUNDOS),
+                Histograma("portafolio_peticion_consultas", "Consultas SQL por petición.", v, BUCKETS_CONSULTAS),
+                Histograma("portafolio_respuesta_bytes", "Tamaño del cuerpo de la respuesta.", v, BUCKETS_BYTES),
+            ]
+            self.comandos = Contador("portafolio_comandos", "Ejecuciones de comandos de gestión.", ("comando", "ok"))
+            self.metricas_comandos = [
+                self.comandos,
+                Histograma("portafolio_comando_segundos", "Duración total del comando.", c, BUCKETS_SEGUNDOS),
+                Histograma("portafolio_comando_db_segundos", "Tiempo del comando en la base de datos.",
+                           c, BUCKETS_SEGUNDOS),
+                Histograma("portafolio_comando_consultas", "Consultas SQL del comando.", c, BUCKETS_CONSULTAS),
+            ]
+            self.reintentos = Contador("portafolio_db_reintentos", "Reintentos por base de datos bloqueada.",
+                                       ("operacion",))
+
+    def registrar_peticion(self, vista, status, m, n_bytes=None):
+        _, total, db, python, serializacion, consultas, tamano = self.metricas
+        with self._lock:
+            self.peticiones.incrementar((vista, status))
+            total.observar((vista,), m.total)
+            db.observar((vista,), m.db)
+            python.observar((vista,), m.python)
+            serializacion.observar((vista,), m.secciones.get("serializacion", 0.0))
+            consultas.observar((vista,), m.consultas)
+            if n_bytes is not None:
+                tamano.observar((vista,), n_bytes)
+
+    def registrar_comando(self, comando, m, ok):
+        _, total, db, consultas = self.metricas_comandos
+        with self._lock:
+            self.comandos.incrementar((comando, "1" if ok else "0"))
+            total.observar((comando,), m.total)
+            db.observar((comando,), m.db)
+            consultas.observar((comando,), m.consultas)
+
+    def registrar_reintento(self, operacion):
+        with self._lock:
+            self.reintentos.incrementar((operacion,))
+
+    def exponer(self):
+        with self._lock:
+            lineas = []
+            for metrica in self.metricas + self.metricas_comandos + [self.reintentos]:
+                lineas += metrica.exponer()
+        return "\n".join(lineas) + "\n"
+
+
+REGISTRO = Registro()
+
+
+# ---------------------------------------------------------------------------
+# Comandos de gestión
+# ---------------------------------------------------------------------------
+
+def escribir_textfile(comando, m, ok):
+    """
+    Deja la última ejecución de ``comando`` en ``METRICAS_TEXTFILE_DIR`` (un
+    archivo .prom por comando, escrito de forma atómica). No hace nada si el
+    setting no está definido.
+    """
+    directorio = getattr(settings, "METRICAS_TEXTFILE_DIR", None)
+    if not directorio:
+        return
+    e = f'{{comando="{comando}"}}'
+    contenido = "\n".join([
+        "# TYPE portafolio_comando_ultima_ejecucion_timestamp gauge",
+        f"portafolio_comando_ultima_ejecucion_timestamp{e} {time.time():.0f}",
+        "# TYPE portafolio_comando_ultima_ok gauge",
+        f"portafolio_comando_ultima_ok{e} {1 if ok else 0}",
+        "# TYPE portafolio_comando_ultima_segundos gauge",
+        f"portafolio_comando_ultima_segundos{e} {m.total:.6f}",
+        "# TYPE portafolio_comando_ultima_db_segundos gauge",
+        f"portafolio_comando_ultima_db_segundos{e} {m.db:.6f}",
+        "# TYPE portafolio_comando_ultima_consultas gauge",
+        f"portafolio_comando_ultima_consultas{e} {m.consultas}",
+    ]) + "\n"
+    os.makedirs(directorio, exist_ok=True)
+    destino = os.path.join(directorio, f"portafolio_{comando}.prom")
+    temporal = f"{destino}.{os.getpid()}.tmp"
+    with open(temporal, "w") as f:
+        f.write(contenido)
+    os.replace(temporal, destino)
+
+
+class ComandoInstrumentado(BaseCommand):
+    """
+    Base de los comandos de ``inversiones``: mide cada ejecución, la registra en
+    ``REGISTRO`` y en el textfile, y con ``-v 2`` imprime el resumen.
+    """
+
+    def execute(self, *args, **options):
+        comando = self.__module__.rsplit(".", 1)[-1]
+        ok = False
+        with medir() as m:
+            try:
+                salida = super().execute(*args, **options)
+                ok = True
+                return salida
+            finally:
+                # el finally interno corre antes de cerrar medir(): fijar el total aquí
+                m.total = time.perf_counter() - m.inicio
+                REGISTRO.registrar_comando(comando, m, ok)
+                escribir_textfile(comando, m, ok)
+                if options.get("verbosity", 1) >= 2:
+                    self.stderr.write(f"[{comando}] {server_timing(m)}")
@@ -0,0 +1,79 @@
+# inversiones/micro.py
+"""
+Punto fijo en micro-unidades: enteros int64 que valen ``valor · 10^6``.
+
+Es la representación con que los precios, cantidades y weights cruzan la
+frontera con la base de datos, sin construir un ``Decimal`` por fila:
+
+- Lectura: ``en_micro("precio")`` es la expresión SQL
+  ``CAST(ROUND(precio * 1000000) AS INTEGER)``; la base entrega enteros de
+  Python y ``np.fromiter`` los vuelca a int64. Es exacta: las columnas tienen a
+  lo más 6 decimales y, aunque SQLite las guarde como REAL, el double guardado
+  es el más cercano a ese decimal, así que redondear su producto por 10^6
+  recupera el decimal exacto mientras |valor| < 4·10^9 (2^32: el error del
+  double guardado más el del producto quedan bajo media micro-unidad). Más
+  arriba el camino con ``Decimal`` tampoco es exacto (Django lee el REAL con 15
+  dígitos significativos).
+- Cómputo: las sumas de cantidades (tenencias vigentes, netos de operaciones)
+  se hacen en int64 y son exactas. Los productos cantidad × precio no caben en
+  int64 a escala 10^12, así que el motor los hace en float64 sobre
+  ``a_float(micro)``, el double más cercano al decimal: el mismo valor que
+  entregaba el camino con ``Decimal``. Rango int64: |valor| < 9.2·10^12.
+  Con precios y cantidades positivos, frente al cálculo exacto con ``Decimal``
+  el error relativo de V_t es a lo más (A + 2)·u y el de cada w_{i,t}
+  (A + 6)·u, con A activos y u = 2^-53: un redondeo al pasar cada factor a
+  double, uno por producto, uno por suma y uno por la división
+  (``error_relativo_vt``/``error_relativo_w``).
+- Escritura: ``redondear(x, decimales)`` redondea un arreglo float64 al par
+  más cercano (como ``Decimal.quantize``) en enteros de la escala pedida, y
+  ``a_decimal`` arma el ``Decimal`` exacto de cada entero. Frente a
+  ``Decimal(repr(x)).quantize(...)`` el resultado difiere a lo más en una
+  unidad del último decimal, y solo si x queda a menos de 1 ulp de un empate.
+"""
+from decimal import Decimal
+
+import numpy as np
+from django.db.models import BigIntegerField, ExpressionWrapper, F, FloatField, Value
+from django.db.models.functions import Cast, Round
+
+DECIMALES = 6
+ESCALA = 10 ** DECIMALES
+U = 2.0 ** -53  # error relativo de un redondeo en float64
+
+
+def error_relativo_vt(activos):
+    """Cota del error relativo de V_t del motor float64 frente a ``Decimal`` (ver arriba)."""
+    return (activos + 2) * U
+
+
+def error_relativo_w(activos):
+    """Cota del error relativo de w_{i,t} del motor float64 frente a ``Decimal``."""
+    return (activos + 6) * U
+
+
+def en_micro(campo):
+    """Expresión ORM con ``campo`` (DecimalField o expresión) en micro-unidades enteras."""
+    expresion = F(campo) if isinstance(campo, str) else campo
+    # FloatField: el producto no se vuelve a envolver en CAST(... AS NUMERIC) como un decimal
+    escalada = ExpressionWrapper(expresion * Value(ESCALA), output_field=FloatField())
+    return Cast(Round(escalada), BigIntegerField())
+
+
+def arreglo(valores, n=-1):
+    """Enteros en micro-unidades (iterable) como arreglo int64."""
+    return np.fromiter(valores, dtype=np.int64, count=n)
+
+
+def a_float(micro):
+    """Arreglo int64 en micro-unidades como float64 (el double más cercano a cada decimal)."""
+    return np.asarray(micro, dtype=np.int64) / ESCALA
+
+
+def redondear(x, decimales=DECIMALES):
+    """float64 -> enteros int64 en unidades de 10^-decimales, redondeando al par más cercano."""
+    return np.rint(np.asarray(x, dtype=np.float64) * 10 ** decimales).astype(np.int64)
+
+
+def a_decimal(enteros, decimales=DECIMALES):
+    """Lista de ``Decimal`` exactos a partir de enteros en unidades de 10^-decimales."""
+    return [Decimal(n).scaleb(-decimales) for n in np.asarray(enteros).tolist()]
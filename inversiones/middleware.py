@@ -0,0 +1,48 @@
+# inversiones/middleware.py
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .metricas import REGISTRO, medir, server_timing
+
+VISTAS_EXCLUIDAS = {"metricas"}
+
+
+class MetricasMiddleware:
+    """
+    Mide cada petición (consultas, tiempo de base de datos, serialización y
+    cómputo Python), agrega el encabezado ``Server-Timing`` y registra los
+    histogramas que expone ``/metrics``. Va primero en ``MIDDLEWARE`` para
+    cubrir también al resto de los middlewares.
+
+    Funciona en WSGI y en ASGI sin forzar a las vistas async a un hilo. En
+    respuestas en streaming solo se mide hasta que empieza el envío.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.asincrono = iscoroutinefunction(get_response)
+        if self.asincrono:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.asincrono:
+            return self.__acall__(request)
+        with medir() as m:
+            response = self.get_response(request)
+        return self.registrar(request, response, m)
+
+    async def __acall__(self, request):
+        with medir() as m:
+            response = await self.get_response(request)
+        return self.registrar(request, response, m)
+
+    @staticmethod
+    def registrar(request, response, m):
+        match = getattr(request, "resolver_match", None)
+        vista = (match.url_name or match.view_name) if match else "sin_ruta"
+        response["Server-Timing"] = server_timing(m)
+        if vista not in VISTAS_EXCLUIDAS:
+            n_bytes = None if response.streaming else len(response.content)
+            REGISTRO.registrar_peticion(vista, response.status_code, m, n_bytes)
+        return response
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-17 21:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inversiones', '0002_operacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ValorActivo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('valor', models.FloatField()),
+                ('weight', models.FloatField(null=True)),
+                ('activo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inversiones.activo')),
+                ('portafolio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inversiones.portafolio')),
+            ],
+            options={
+                'unique_together': {('portafolio', 'fecha', 'activo')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-17 22:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inversiones', '0004_versiondatos'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='operacion',
+            index=models.Index(fields=['portafolio', 'activo', 'fecha'], name='operacion_pf_activo_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='precio',
+            index=models.Index(fields=['activo', 'fecha', 'precio'], name='precio_activo_fecha_precio_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='precio',
+            index=models.Index(fields=['fecha', 'activo', 'precio'], name='precio_fecha_activo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='weight',
+            index=models.Index(fields=['fecha', 'portafolio'], name='weight_fecha_pf_idx'),
+        ),
+    ]
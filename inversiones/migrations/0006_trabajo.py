@@ -0,0 +1,34 @@
+# Generated by Django 5.2.5 on 2026-10-17 22:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inversiones', '0005_indices_consultas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Trabajo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('recalcular', 'Recalcular valuaciones'), ('importar', 'Importar datos')], max_length=10)),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('en_curso', 'En curso'), ('completado', 'Completado'), ('fallido', 'Fallido')], default='pendiente', max_length=10)),
+                ('parametros', models.JSONField(default=dict)),
+                ('solicitudes', models.PositiveIntegerField(default=1)),
+                ('resultado', models.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('iniciado', models.DateTimeField(blank=True, null=True)),
+                ('terminado', models.DateTimeField(blank=True, null=True)),
+                ('portafolio', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='inversiones.portafolio')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['estado', 'id'], name='trabajo_estado_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('estado', 'pendiente')), fields=('tipo', 'portafolio'), name='trabajo_pendiente_unico')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-17 23:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inversiones', '0006_trabajo'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='operacion',
+            index=models.Index(fields=['fecha'], name='operacion_fecha_idx'),
+        ),
+    ]
@@ -12,6 +12,14 @@ class Operacion(models.Model):
     cantidad = models.DecimalField(max_digits=20, decimal_places=2)
     tipo = models.CharField(max_length=6, choices=TIPO_CHOICES)
 
+    class Meta:
+        # libro de posiciones por portafolio y netos por (portafolio, activo)
+        indexes = [
+            models.Index(fields=['portafolio', 'activo', 'fecha'], name='operacion_pf_activo_fecha_idx'),
+            # listado del admin por fecha (date_hierarchy y paginación por (fecha, id))
+            models.Index(fields=['fecha'], name='operacion_fecha_idx'),
+        ]
+
     def __str__(self):
         return f"{self.tipo.capitalize()} {self.cantidad} {self.activo} en {self.fecha}"
 
@@ -35,6 +43,12 @@ class Precio(models.Model):
 
     class Meta:
         unique_together = ('activo', 'fecha')
+        indexes = [
+            # cubre activo_id IN + rango de fechas sin leer la tabla (matriz de precios)
+            models.Index(fields=['activo', 'fecha', 'precio'], name='precio_activo_fecha_precio_idx'),
+            # fecha=t0 (calc_cantidades_iniciales) y fecha mínima/máxima (viz)
+            models.Index(fields=['fecha', 'activo', 'precio'], name='precio_fecha_activo_idx'),
+        ]
 
 class Weight(models.Model):
     portafolio = models.ForeignKey(Portafolio, on_delete=models.CASCADE)
@@ -44,6 +58,7 @@ class Weight(models.Model):
 
     class Meta:
         unique_together = ('portafolio', 'activo', 'fecha')
+        indexes = [models.Index(fields=['fecha', 'portafolio'], name='weight_fecha_pf_idx')]
 
 class Cantidad(models.Model):
     portafolio = models.ForeignKey(Portafolio, on_delete=models.CASCADE)
@@ -60,3 +75,68 @@ class ValorPortafolio(models.Model):
 
     class Meta:
         unique_together = ('portafolio', 'fecha')
+
+class ValorActivo(models.Model):
+    """
+    Valuación materializada por activo: x_{i,t} y w_{i,t}.
+    Derivada del motor vectorizado (float64); se recalcula con refrescar_valuaciones.
+    """
+    portafolio = models.ForeignKey(Portafolio, on_delete=models.CASCADE)
+    activo = models.ForeignKey(Activo, on_delete=models.CASCADE)
+    fecha = models.DateField()
+    valor = models.FloatField()
+    weight = models.FloatField(null=True)
+
+    class Meta:
+        unique_together = ('portafolio', 'fecha', 'activo')
+
+class VersionDatos(models.Model):
+    """
+    Contador de versión de los datos que alimentan la API ("precios" o "pf:<id>").
+    Se incrementa al importar precios u operar, e invalida la caché de respuestas.
+    "matriz" guarda el token de la instantánea de precios vigente (``matriz_precios``).
+    """
+    clave = models.CharField(max_length=50, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.clave} v{self.version}"
+
+class Trabajo(models.Model):
+    """
+    Trabajo en segundo plano (recalcular valuaciones o importar datos). Lo
+    encola la API o ``import_datos --encolar`` y lo ejecuta ``procesar_trabajos``.
+    """
+    RECALCULAR, IMPORTAR = 'recalcular', 'importar'
+    TIPO_CHOICES = [
+        (RECALCULAR, 'Recalcular valuaciones'),
+        (IMPORTAR, 'Importar datos'),
+    ]
+    PENDIENTE, EN_CURSO, COMPLETADO, FALLIDO = 'pendiente', 'en_curso', 'completado', 'fallido'
+    ESTADO_CHOICES = [
+        (PENDIENTE, 'Pendiente'),
+        (EN_CURSO, 'En curso'),
+        (COMPLETADO, 'Completado'),
+        (FALLIDO, 'Fallido'),
+    ]
+    tipo = models.CharField(max_length=10, choices=TIPO_CHOICES)
+    estado = models.CharField(max_length=10, choices=ESTADO_CHOICES, default=PENDIENTE)
+    portafolio = models.ForeignKey('Portafolio', on_delete=models.CASCADE, null=True, blank=True)
+    parametros = models.JSONField(default=dict)
+    solicitudes = models.PositiveIntegerField(default=1)  # pedidos fusionados en este trabajo
+    resultado = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    creado = models.DateTimeField(auto_now_add=True)
+    iniciado = models.DateTimeField(null=True, blank=True)
+    terminado = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['estado', 'id'], name='trabajo_estado_idx')]
+        constraints = [
+            # a lo más un recálculo pendiente por portafolio: los pedidos nuevos se fusionan en él
+            models.UniqueConstraint(fields=['tipo', 'portafolio'], condition=models.Q(estado='pendiente'),
+                                    name='trabajo_pendiente_unico'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} #{self.pk} ({self.estado})"
@@ -0,0 +1,81 @@
+# inversiones/operaciones.py
+"""
+Ingesta set-based de operaciones: validación por fila y aplicación del neto
+por activo sobre ``Cantidad`` con un número fijo de consultas.
+"""
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Case, DecimalField, F, Value, When
+from django.utils.dateparse import parse_date
+
+from .models import Cantidad, Operacion
+
+BATCH_SIZE = 1000
+CASE_SIZE = 300  # ramas WHEN por UPDATE (2 parámetros cada una)
+TIPOS = {t for t, _ in Operacion.TIPO_CHOICES}
+CANTIDAD_MAX = Decimal("1e18")  # max_digits=20, decimal_places=2
+
+
+def validar_operacion(op, activos):
+    """
+    Valida una fila del lote. ``activos`` mapea símbolo -> activo_id.
+    Devuelve ``((activo_id, fecha, cantidad, tipo), None)`` o ``(None, mensaje)``.
+    """
+    if not isinstance(op, dict):
+        return None, "La operación debe ser un objeto."
+    faltantes = [k for k in ("activo", "fecha", "cantidad", "tipo") if k not in op]
+    if faltantes:
+        return None, f"Faltan campos: {', '.join(faltantes)}."
+
+    if not isinstance(op["activo"], str):
+        return None, "Activo debe ser un símbolo."
+    activo_id = activos.get(op["activo"])
+    if activo_id is None:
+        return None, f"Activo {op['activo']!r} no existe."
+
+    try:
+        fecha = parse_date(str(op["fecha"]))
+    except ValueError:
+        fecha = None
+    if fecha is None:
+        return None, f"Fecha inválida: {op['fecha']!r} (use YYYY-MM-DD)."
+
+    try:
+        cantidad = Decimal(str(op["cantidad"]))
+    except InvalidOperation:
+        return None, f"Cantidad inválida: {op['cantidad']!r}."
+    if not cantidad.is_finite() or cantidad <= 0 or cantidad >= CANTIDAD_MAX:
+        return None, "La cantidad debe ser un número positivo."
+    if cantidad.as_tuple().exponent < -2:
+        return None, "La cantidad admite a lo más 2 decimales."
+
+    tipo = op["tipo"]
+    if tipo not in TIPOS:
+        return None, f"Tipo inválido: {tipo!r} (use {' o '.join(sorted(TIPOS))})."
+    return (activo_id, fecha, cantidad, tipo), None
+
+
+def aplicar_deltas(pf, deltas):
+    """
+    Suma el neto de cada activo a ``Cantidad`` del portafolio.
+
+    Los activos con fila existente se actualizan con un solo UPDATE ... CASE
+    (con ``F('cantidad')``, así que no pierde actualizaciones concurrentes);
+    los que no tienen fila se crean con ``bulk_create``.
+    """
+    deltas = {aid: d for aid, d in deltas.items() if d}
+    if not deltas:
+        return
+    existentes = set(Cantidad.objects.filter(portafolio=pf, activo_id__in=list(deltas))
+                     .values_list("activo_id", flat=True))
+    ids = sorted(existentes)
+    for i in range(0, len(ids), CASE_SIZE):
+        bloque = ids[i:i + CASE_SIZE]
+        Cantidad.objects.filter(portafolio=pf, activo_id__in=bloque).update(cantidad=Case(
+            *[When(activo_id=aid, then=F("cantidad") + Value(deltas[aid])) for aid in bloque],
+            output_field=DecimalField(max_digits=20, decimal_places=6),
+        ))
+    Cantidad.objects.bulk_create(
+        [Cantidad(portafolio=pf, activo_id=aid, cantidad=d) for aid, d in deltas.items() if aid not in existentes],
+        batch_size=BATCH_SIZE,
+    )
@@ -0,0 +1,305 @@
+# inversiones/portafolio.py
+"""
+Motor de cálculo vectorizado para la evolución de portafolios.
+
+Los precios se cargan en una matriz fechas × activos (NaN donde no hay precio)
+y se multiplican por el vector de cantidades en una sola pasada de NumPy, lo
+que entrega x_{i,t}, V_t y w_{i,t} sin recorrer filas en Python.
+
+Política de precisión
+---------------------
+- Los precios y cantidades se leen como enteros en micro-unidades
+  (``inversiones/micro.py``), sin construir un ``Decimal`` por fila. Las
+  cantidades vigentes (base más operaciones acumuladas) se suman en int64,
+  exactas; los precios y cantidades entran al producto como float64, el double
+  más cercano a cada decimal. SQLite ya guarda las columnas ``DecimalField``
+  como REAL, por lo que el camino con ``Decimal`` no agregaba exactitud: solo
+  reconstruía un ``Decimal`` a partir de ese mismo double.
+- Cada x_{i,t} = P_{i,t} · c_i tiene un error relativo de a lo más 1 ulp
+  (~1.1e-16). V_t se acumula con la suma por pares de NumPy, con error acotado
+  por O(log n_activos · ε · Σ|x_{i,t}|).
+- La respuesta de la API siempre entregó ``float(...)``; frente al cálculo con
+  ``Decimal`` las diferencias observadas quedan bajo 1e-12 relativo en V_t y
+  bajo 1e-12 absoluto en w_{i,t} (ver ``python manage.py benchmark evolucion``,
+  que mide la discrepancia máxima junto con el speedup).
+"""
+from datetime import date
+from operator import itemgetter
+
+import numpy as np
+
+from . import calendario, micro
+from .models import Cantidad, Operacion
+
+
+def matriz_desde_filas(activo_ids, filas, en_micro=False, fechas=None):
+    """
+    Construye la matriz de precios a partir de filas (activo_id, fecha, precio),
+    con el precio en micro-unidades enteras si ``en_micro``.
+
+    Devuelve ``(fechas, P)`` donde ``fechas`` es la lista ordenada de fechas con
+    al menos un precio y ``P`` es un arreglo float64 de forma
+    (len(fechas), len(activo_ids)) con NaN donde el activo no tiene precio.
+    Las filas de activos que no están en ``activo_ids`` se descartan. Con
+    ``fechas`` (ordenadas, p. ej. el calendario de negociación) las filas de la
+    matriz son esas y se descartan los precios de otras fechas.
+    """
+    activo_ids = np.asarray(activo_ids, dtype=np.int64)
+    filas = list(filas)
+    if not filas or activo_ids.size == 0:
+        if fechas is not None:
+            return list(fechas), np.full((len(fechas), activo_ids.size), np.nan)
+        return [], np.empty((0, activo_ids.size))
+
+    n = len(filas)
+    aids = np.fromiter(map(itemgetter(0), filas), dtype=np.int64, count=n)
+    dias = np.fromiter(map(date.toordinal, map(itemgetter(1), filas)), dtype=np.int64, count=n)
+    if en_micro:
+        precios = micro.a_float(micro.arreglo(map(itemgetter(2), filas), n))
+    else:
+        precios = np.fromiter(map(itemgetter(2), filas), dtype=np.float64, count=n)
+
+    # columna de cada fila (activo_ids puede venir en cualquier orden)
+    orden = np.argsort(activo_ids)
+    pos = np.searchsorted(activo_ids, aids, sorter=orden)
+    pos = np.minimum(pos, activo_ids.size - 1)
+    col = orden[pos]
+    validas = activo_ids[col] == aids
+
+    if fechas is not None:
+        habiles = np.fromiter(map(date.toordinal, fechas), dtype=np.int64, count=len(fechas))
+        fila = np.minimum(np.searchsorted(habiles, dias), max(habiles.size - 1, 0))
+        validas &= habiles[fila] == dias if habiles.size else False
+        P = np.full((habiles.size, activo_ids.size), np.nan)
+        P[fila[validas], col[validas]] = precios[validas]
+        return list(fechas), P
+
+    dias_unicos, fila = np.unique(dias[validas], return_inverse=True)
+    P = np.full((dias_unicos.size, activo_ids.size), np.nan)
+    P[fila, col[validas]] = precios[validas]
+    return [date.fromordinal(d) for d in dias_unicos.tolist()], P
+
+
+def cargar_matriz_precios(activo_ids, fi=None, ff=None):
+    """
+    Carga los precios de ``activo_ids`` en [fi, ff] como matriz fechas × activos.
+    Un extremo en None deja el rango abierto por ese lado. Las filas son el
+    calendario de negociación y cada activo sin precio en una fecha vale su
+    último precio conocido (``calendario.cargar_asof``, que usa la instantánea
+    en disco de ``matriz_precios`` si hay una vigente).
+    """
+    fechas, P, _ = calendario.cargar_asof(activo_ids, fi, ff)
+    return fechas, P
+
+
+def evolucion(P, cantidades):
+    """
+    Calcula x_{i,t}, V_t y w_{i,t} en una pasada.
+
+    ``P`` es la matriz fechas × activos y ``cantidades`` el vector c_i alineado
+    con sus columnas, o una matriz fechas × activos de cantidades vigentes
+    (``LibroPosiciones.cantidades``). Los activos sin precio en t (NaN) no suman a V_t ni
+    tienen peso ese día; si V_t = 0 todos los pesos de ese día quedan en NaN.
+    Con la matriz de ``cargar_matriz_precios`` solo faltan precios antes del
+    primero de cada activo: después se arrastra el último conocido.
+    """
+    c = np.asarray(cantidades, dtype=np.float64)
+    X = P * c
+    Vt = np.nansum(X, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        W = X / Vt[:, None]
+    W[Vt == 0] = np.nan
+    return X, Vt, W
+
+
+def series_evolucion(fechas, simbolos, Vt, W):
+    """
+    Serializa V_t y w_{i,t} al formato de respuesta de la API:
+    ``[{"fecha", "valor"}]`` y ``[{"fecha", "w": [{"activo", "valor"}]}]``.
+    """
+    vt_series, weights_series = [], []
+    presentes = ~np.isnan(W)
+    for fch, vt, w_fila, mask in zip(fechas, Vt.tolist(), W.tolist(), presentes):
+        iso = fch.isoformat()
+        vt_series.append({"fecha": iso, "valor": vt})
+        w_list = [{"activo": simbolos[j], "valor": w_fila[j]} for j in np.flatnonzero(mask)]
+        weights_series.append({"fecha": iso, "w": w_list})
+    return vt_series, weights_series
+
+
+class LibroPosiciones:
+    """
+    Libro de posiciones fechado de un portafolio.
+
+    ``Cantidad`` guarda la tenencia actual (después de todas las operaciones);
+    cada ``Operacion`` es un punto de cambio que rige desde su fecha en adelante.
+    La cantidad base (antes de la primera operación) es la actual menos el neto
+    de operaciones, y la cantidad vigente en t es la base más las operaciones
+    con fecha <= t. ``base`` y ``op_deltas`` están en micro-unidades (int64):
+    las cantidades vigentes se acumulan sin error de redondeo.
+    """
+
+    def __init__(self, activo_ids, base, op_dias, op_cols, op_deltas):
+        self.activo_ids = list(activo_ids)
+        self.base = np.asarray(base, dtype=np.int64)
+        self.op_dias = np.asarray(op_dias, dtype=np.int64)
+        self.op_cols = np.asarray(op_cols, dtype=np.int64)
+        self.op_deltas = np.asarray(op_deltas, dtype=np.int64)
+
+    def cantidades(self, fechas):
+        """
+        Matriz fechas × activos de cantidades vigentes (as-of) en ``fechas`` ordenadas.
+
+        Merge-join vectorizado: cada operación se ubica por búsqueda binaria en
+        la primera fecha >= a la suya, y una suma acumulada por columna propaga
+        el cambio hacia adelante. Costo O(n_ops · log n_fechas + n_fechas · n_activos).
+        La suma es entera; el resultado es float64.
+        """
+        dias = np.fromiter(map(date.toordinal, fechas), dtype=np.int64, count=len(fechas))
+        Q = np.zeros((dias.size, len(self.activo_ids)), dtype=np.int64)
+        fila = np.searchsorted(dias, self.op_dias, side="left")
+        m = fila < dias.size
+        np.add.at(Q, (fila[m], self.op_cols[m]), self.op_deltas[m])
+        np.cumsum(Q, axis=0, out=Q)
+        Q += self.base
+        return micro.a_float(Q)
+
+
+def cargar_libros(portafolio_ids=None):
+    """
+    Construye el ``LibroPosiciones`` de cada portafolio con dos consultas
+    (Cantidad y Operacion). Devuelve un dict pf_id -> LibroPosiciones.
+    """
+    cantidades_qs = Cantidad.objects.all()
+    operaciones_qs = Operacion.objects.all()
+    if portafolio_ids is not None:
+        cantidades_qs = cantidades_qs.filter(portafolio_id__in=list(portafolio_ids))
+        operaciones_qs = operaciones_qs.filter(portafolio_id__in=list(portafolio_ids))
+
+    actuales = {}  # pf_id -> {activo_id: cantidad actual (micro-unidades)}
+    for pf_id, aid, c in cantidades_qs.values_list("portafolio_id", "activo_id", micro.en_micro("cantidad")):
+        actuales.setdefault(pf_id, {})[aid] = c
+    ops = {}  # pf_id -> [(dia, activo_id, delta en micro-unidades)]
+    for pf_id, aid, fch, tipo, c in operaciones_qs.values_list(
+            "portafolio_id", "activo_id", "fecha", "tipo", micro.en_micro("cantidad")):
+        ops.setdefault(pf_id, []).append((fch.toordinal(), aid, c if tipo == "compra" else -c))
+
+    libros = {}
+    for pf_id in actuales.keys() | ops.keys():
+        act = actuales.get(pf_id, {})
+        pf_ops = ops.get(pf_id, [])
+        activo_ids = sorted(act.keys() | {aid for _, aid, _ in pf_ops})
+        col = {aid: j for j, aid in enumerate(activo_ids)}
+
+        op_dias = np.array([d for d, _, _ in pf_ops], dtype=np.int64)
+        op_cols = np.array([col[aid] for _, aid, _ in pf_ops], dtype=np.int64)
+        op_deltas = np.array([x for _, _, x in pf_ops], dtype=np.int64)
+
+        # base = actual - neto de operaciones (activos sin Cantidad parten en 0)
+        base = np.zeros(len(activo_ids), dtype=np.int64)
+        for aid, c in act.items():
+            base[col[aid]] = c
+        neto = np.zeros(len(activo_ids), dtype=np.int64)
+        np.add.at(neto, op_cols, op_deltas)  # bincount sumaría en float64
+        con_cantidad = np.array([aid in act for aid in activo_ids], dtype=bool)
+        base[con_cantidad] -= neto[con_cantidad]
+
+        libros[pf_id] = LibroPosiciones(activo_ids, base, op_dias, op_cols, op_deltas)
+    return libros
+
+
+# Tamaño máximo (en elementos float64) de cada bloque del tensor de cantidades: 128 MB
+MAX_ELEMENTOS_LOTE = 1 << 24
+
+
+def evolucion_lote(libros, fi=None, ff=None):
+    """
+    Evolución de varios portafolios con una sola carga de precios.
+
+    Los precios de la unión de activos se leen una vez como matriz fechas ×
+    activos ``P``. Las cantidades vigentes de cada portafolio se alinean a esas
+    columnas en un tensor fechas × portafolios × activos ``Q`` (0 donde el
+    portafolio no tiene el activo), y V_t de todos sale de un único producto
+    matricial por lotes: ``V[t, n] = Σ_a Q[t, n, a] · P[t, a]``. ``Q`` se arma por
+    bloques de portafolios para acotar la memoria (``MAX_ELEMENTOS_LOTE``).
+
+    Devuelve un dict pf_id -> ``(fechas, activo_ids, Vt, W)`` con lo mismo que
+    ``evolucion`` portafolio por portafolio: solo las fechas en que alguno de
+    sus activos ya tiene precio y W en las columnas de ``libro.activo_ids``.
+    """
+    pf_ids = list(libros)
+    activo_ids = sorted({aid for libro in libros.values() for aid in libro.activo_ids})
+    fechas, P = cargar_matriz_precios(activo_ids, fi, ff)
+    col = {aid: j for j, aid in enumerate(activo_ids)}
+    P0 = np.nan_to_num(P)[:, :, None]  # sin precio no suma a V_t
+    D, A = P.shape
+    bloque = max(1, MAX_ELEMENTOS_LOTE // max(D * A, 1))
+
+    resultado = {}
+    for i in range(0, len(pf_ids), bloque):
+        grupo = pf_ids[i:i + bloque]
+        columnas = [np.array([col[aid] for aid in libros[pf_id].activo_ids], dtype=np.int64) for pf_id in grupo]
+        Q = np.zeros((D, len(grupo), A))
+        for k, pf_id in enumerate(grupo):
+            Q[:, k, columnas[k]] = libros[pf_id].cantidades(fechas)
+        V = np.matmul(Q, P0)[:, :, 0]  # fechas × portafolios
+
+        for k, pf_id in enumerate(grupo):
+            Pn = P[:, columnas[k]]
+            filas = np.flatnonzero(~np.isnan(Pn).all(axis=1))
+            Vt = V[filas, k]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                W = Pn[filas] * Q[filas, k][:, columnas[k]] / Vt[:, None]
+            W[Vt == 0] = np.nan
+            resultado[pf_id] = ([fechas[f] for f in filas.tolist()], libros[pf_id].activo_ids, Vt, W)
+    return resultado
+
+
+FRECUENCIAS = ("W", "M", "Q")
+
+
+def indices_remuestreo(fechas, freq):
+    """
+    Índices de la última fecha de cada período ("W" semana lun-dom, "M" mes,
+    "Q" trimestre) sobre ``fechas`` ordenadas: el valor de cierre del período.
+    """
+    dias = np.fromiter(map(date.toordinal, fechas), dtype=np.int64, count=len(fechas))
+    if freq == "W":
+        periodo = (dias - 1) // 7  # date.fromordinal(1) es lunes
+    else:
+        meses = np.array(fechas, dtype="datetime64[D]").astype("datetime64[M]").astype(np.int64)
+        periodo = meses if freq == "M" else meses // 3
+    if periodo.size == 0:
+        return periodo
+    return np.flatnonzero(np.append(periodo[1:] != periodo[:-1], True))
+
+
+def indices_lttb(y, n, x=None):
+    """
+    Largest-Triangle-Three-Buckets: índices de ``n`` puntos de la serie ``y``
+    que preservan su forma visual (siempre incluye el primero y el último).
+    """
+    y = np.asarray(y, dtype=np.float64)
+    N = y.size
+    if n >= N or n < 3:
+        return np.arange(N)
+    x = np.arange(N, dtype=np.float64) if x is None else np.asarray(x, dtype=np.float64)
+
+    # n-2 baldes para los puntos interiores [1, N-1)
+    bordes = (np.arange(n - 1) * (N - 2) / (n - 2)).astype(np.int64) + 1
+    bordes[-1] = N - 1
+    elegidos = np.empty(n, dtype=np.int64)
+    elegidos[0], elegidos[-1] = 0, N - 1
+    a = 0
+    for b in range(n - 2):
+        lo, hi = bordes[b], bordes[b + 1]
+        # promedio del balde siguiente (o el último punto)
+        if b + 2 < n - 1:
+            sig = slice(bordes[b + 1], bordes[b + 2])
+            xc, yc = x[sig].mean(), y[sig].mean()
+        else:
+            xc, yc = x[-1], y[-1]
+        area = np.abs((x[a] - xc) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (yc - y[a]))
+        a = lo + int(np.argmax(area))
+        elegidos[b + 1] = a
+    return elegidos
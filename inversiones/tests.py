@@ -1,3 +1,1361 @@
-from django.test import TestCase
+import csv
+import itertools
+import json
+import os
+import re
+import shutil
+import struct
+import tempfile
+from datetime import date, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings, tag
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import (
+    admin, analitica, backtest, calendario, escenarios, exportacion, formatos, matriz_precios, micro, operaciones,
+    trabajos,
+)
+from .benchmarks import comparar_resultados, ejecutar_suite, poblar_base
+from .bloqueos import reintentar_si_bloqueada
+from .cache import cache_evolucion, invalidar
+from .importacion import bloques_precios, memoria_actual_mb
+from .metricas import REGISTRO
+from .models import (
+    Activo, Cantidad, Operacion, Portafolio, Precio, Trabajo, ValorActivo, ValorPortafolio, VersionDatos, Weight,
+)
+from .portafolio import cargar_libros, cargar_matriz_precios, evolucion, indices_lttb
+from .valuacion import refrescar_valuaciones
+from .views import LIMITE_MAX
+
+# Tablas que crecen con fechas × activos: recorrerlas completas es una regresión
+TABLAS_GRANDES = {m._meta.db_table for m in (Precio, Weight, Operacion, ValorActivo, ValorPortafolio)}
+ESCANEO = re.compile(r"^SCAN (\w+)( USING (COVERING )?INDEX \w+)?$")
+
+
+def planes(consultas):
+    """Genera ``(sql, detalles)`` de EXPLAIN QUERY PLAN para cada SELECT/UPDATE/DELETE capturado."""
+    with connection.cursor() as cursor:
+        for q in consultas:
+            sql = q["sql"]
+            if not sql.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+                continue
+            cursor.execute("EXPLAIN QUERY PLAN " + sql)
+            yield sql, [fila[-1] for fila in cursor.fetchall()]
+
+
+def escaneos_completos(sql, detalles):
+    """
+    Pasos del plan que recorren completa una tabla grande: un SCAN sin índice
+    para una consulta con WHERE (las lecturas completas a propósito, p. ej.
+    todas las operaciones al refrescar todos los portafolios, no tienen WHERE),
+    o cualquier SCAN que además ordena en un B-tree temporal (ORDER BY sin índice).
+    """
+    ordena = any(d.startswith("USE TEMP B-TREE FOR ORDER BY") for d in detalles)
+    malos = []
+    for d in detalles:
+        m = ESCANEO.match(d)
+        if m and m.group(1) in TABLAS_GRANDES and (ordena or (not m.group(2) and " WHERE " in sql)):
+            malos.append(d)
+    return malos
+
+
+@skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN es específico de SQLite")
+class PlanesDeConsultaTests(TestCase):
+    """
+    Ejecuta cada endpoint y comando, captura sus consultas y falla si alguna
+    recorre completa una de las tablas grandes en vez de usar un índice.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        portafolios, cls.simbolos, cls.fechas = poblar_base(n_activos=4, n_dias=30, n_portafolios=2)
+        cls.pf = portafolios[0]
+        Weight.objects.bulk_create([
+            Weight(portafolio=pf, activo_id=aid, fecha=cls.fechas[0], weight=Decimal("0.25"))
+            for pf in portafolios for aid in Precio.objects.values_list("activo_id", flat=True).distinct()
+        ])
+        refrescar_valuaciones()
+
+    def setUp(self):
+        cache_evolucion().clear()
+
+    def assertSinEscaneoCompleto(self, fn, *args, **kwargs):
+        with CaptureQueriesContext(connection) as ctx:
+            resultado = fn(*args, **kwargs)
+        escaneos = [
+            f"{detalle}: {sql}" for sql, detalles in planes(ctx.captured_queries)
+            for detalle in escaneos_completos(sql, detalles)
+        ]
+        self.assertFalse(escaneos, "Escaneo completo de tabla:\n" + "\n".join(escaneos))
+        return resultado
+
+    def url_evolucion(self, **params):
+        params = {"fecha_inicio": self.fechas[0].isoformat(), "fecha_fin": self.fechas[-1].isoformat(), **params}
+        query = "&".join(f"{k}={v}" for k, v in params.items())
+        return reverse("evolucion-portafolio", args=[self.pf.id]) + "?" + query
+
+    def test_evolucion_materializada(self):
+        for formato in ("json", "columnar", "binario"):
+            r = self.assertSinEscaneoCompleto(self.client.get, self.url_evolucion(formato=formato, puntos=10))
+            self.assertEqual(r.status_code, 200)
+
+    def test_evolucion_en_linea(self):
+        ValorActivo.objects.filter(portafolio=self.pf).delete()
+        r = self.assertSinEscaneoCompleto(self.client.get, self.url_evolucion())
+        self.assertEqual(r.status_code, 200)
+
+    def test_analitica(self):
+        url = reverse("analitica-portafolio", args=[self.pf.id])
+        r = self.assertSinEscaneoCompleto(
+            self.client.get, f"{url}?fecha_inicio={self.fechas[0]}&fecha_fin={self.fechas[-1]}&puntos=10"
+        )
+        self.assertEqual(r.status_code, 200)
+
+    def test_backtest(self):
+        url = reverse("backtest-portafolio", args=[self.pf.id])
+        r = self.assertSinEscaneoCompleto(
+            self.client.get, f"{url}?fecha_inicio={self.fechas[0]}&fecha_fin={self.fechas[-1]}&frecuencia=W,M"
+        )
+        self.assertEqual(r.status_code, 200)
+
+    def test_riesgo(self):
+        r = self.assertSinEscaneoCompleto(self.client.get, reverse("riesgo-lote") + "?escenarios=100&ventana=10")
+        self.assertEqual(r.status_code, 200)
+
+    @override_settings(ADMIN_CONTEO_EXACTO=50)
+    def test_admin(self):
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "clave"))
+        for modelo, filtro in (("precio", "?fecha__year=2015&fecha__month=1"),
+                               ("operacion", "?fecha__year=2015&fecha__month=1"),
+                               ("valorportafolio", f"?portafolio__id__exact={self.pf.id}")):
+            url = reverse(f"admin:inversiones_{modelo}_changelist")
+            for query in ("", filtro):
+                with self.subTest(modelo=modelo, query=query):
+                    r = self.assertSinEscaneoCompleto(self.client.get, url + query)
+                    self.assertEqual(r.status_code, 200)
+                    if r.context["cl"].url_siguiente:
+                        self.assertSinEscaneoCompleto(self.client.get, url + r.context["cl"].url_siguiente)
+
+    def test_evolucion_lote(self):
+        url = reverse("evolucion-lote") + f"?fecha_inicio={self.fechas[0]}&fecha_fin={self.fechas[-1]}&formato=columnar"
+        r = self.assertSinEscaneoCompleto(self.client.get, url)
+        self.assertEqual(r.status_code, 200)
+        lote = json.loads(r.content)
+        self.assertEqual(len(lote["portafolios"]), 2)
+        for datos in lote["portafolios"]:
+            individual = json.loads(self.client.get(
+                reverse("evolucion-portafolio", args=[datos["portafolio"]["id"]])
+                + f"?fecha_inicio={self.fechas[0]}&fecha_fin={self.fechas[-1]}&formato=columnar"
+            ).content)
+            self.assertEqual(datos["fechas"], individual["fechas"])
+            self.assertEqual(datos["simbolos"], individual["simbolos"])
+            for a, b in zip(datos["Vt"], individual["Vt"]):
+                self.assertAlmostEqual(a, b, delta=0.01)  # materializado a centavos
+
+        r = self.client.get(reverse("evolucion-lote") + f"?fecha_inicio={self.fechas[0]}"
+                            f"&fecha_fin={self.fechas[-1]}&ids={self.pf.id},999")
+        self.assertEqual(r.status_code, 404)
+
+    def test_exportacion(self):
+        r = self.assertSinEscaneoCompleto(
+            lambda: b"".join(self.client.get(reverse("exportar-evolucion") + f"?fecha_inicio={self.fechas[5]}")
+                             .streaming_content)
+        )
+        self.assertTrue(r)
+
+    def test_registrar_operaciones(self):
+        body = json.dumps([
+            {"activo": self.simbolos[0], "fecha": self.fechas[5].isoformat(), "cantidad": 10, "tipo": "compra"},
+            {"activo": self.simbolos[1], "fecha": self.fechas[9].isoformat(), "cantidad": 5, "tipo": "venta"},
+        ])
+        r = self.assertSinEscaneoCompleto(
+            self.client.post, reverse("registro-operaciones", args=[self.pf.id]), body,
+            content_type="application/json",
+        )
+        self.assertEqual(r.status_code, 201)
+
+    def test_viz_evolucion(self):
+        r = self.assertSinEscaneoCompleto(self.client.get, reverse("viz-evolucion"))
+        self.assertEqual(r.status_code, 200)
+
+    def test_import_datos(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        path = os.path.join(directorio, "precios.csv")
+        with open(path, "w") as f:
+            f.write("fecha," + ",".join(self.simbolos) + "\n")
+            for fecha in self.fechas[-3:]:
+                f.write(fecha.isoformat() + "," + ",".join("101.5" for _ in self.simbolos) + "\n")
+        for modo in ([], ["--delta"], ["--upsert"]):
+            self.assertSinEscaneoCompleto(call_command, "import_datos", path, *modo, stdout=StringIO())
+
+    def test_calc_cantidades_iniciales(self):
+        self.assertSinEscaneoCompleto(
+            call_command, "calc_cantidades_iniciales", "--t0", self.fechas[0].isoformat(),
+            "--overwrite", stdout=StringIO(),
+        )
+
+    def test_refrescar_valuaciones(self):
+        self.assertSinEscaneoCompleto(call_command, "refrescar_valuaciones", stdout=StringIO())
+        self.assertSinEscaneoCompleto(
+            call_command, "refrescar_valuaciones", "--pf", str(self.pf.id),
+            "--desde", self.fechas[10].isoformat(), stdout=StringIO(),
+        )
+
+
+class RegistrarOperacionesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        portafolios, cls.simbolos, cls.fechas = poblar_base(n_activos=3, n_dias=5)
+        cls.pf = portafolios[0]
+        cls.nuevo = Activo.objects.create(nombre="Nuevo", simbolo="NUEVO")
+        refrescar_valuaciones()
+
+    def setUp(self):
+        self.url = reverse("registro-operaciones", args=[self.pf.id])
+        self.antes = dict(Cantidad.objects.filter(portafolio=self.pf).values_list("activo__simbolo", "cantidad"))
+
+    def registrar(self, ops, query=""):
+        return self.client.post(self.url + query, json.dumps(ops), content_type="application/json")
+
+    def lote_mixto(self):
+        f = self.fechas[2].isoformat()
+        return [
+            {"activo": self.simbolos[0], "fecha": f, "cantidad": "10.5", "tipo": "compra"},
+            {"activo": "NOEXISTE", "fecha": f, "cantidad": 1, "tipo": "compra"},
+            {"activo": self.simbolos[1], "fecha": f, "cantidad": 4, "tipo": "venta"},
+            {"activo": ["X"], "fecha": f, "cantidad": 1, "tipo": "compra"},  # no hashable
+            {"activo": "NUEVO", "fecha": f, "cantidad": 2, "tipo": "compra"},
+            {"activo": self.simbolos[2], "fecha": "ayer", "cantidad": 1, "tipo": "compra"},
+        ]
+
+    def test_lote_con_errores_no_registra_nada(self):
+        r = self.registrar(self.lote_mixto())
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual([e["fila"] for e in r.json()["errores"]], [1, 3, 5])
+        self.assertEqual(r.json()["errores"][1]["detail"], "Activo debe ser un símbolo.")
+        self.assertFalse(Operacion.objects.exists())
+        self.assertEqual(dict(Cantidad.objects.filter(portafolio=self.pf)
+                              .values_list("activo__simbolo", "cantidad")), self.antes)
+
+    def test_parcial_registra_las_validas(self):
+        r = self.registrar(self.lote_mixto(), "?parcial=1")
+        self.assertEqual(r.status_code, 201)
+        self.assertEqual((r.json()["registradas"], [e["fila"] for e in r.json()["errores"]]), (3, [1, 3, 5]))
+        self.assertEqual(sorted(Operacion.objects.values_list("activo__simbolo", "cantidad", "tipo")), sorted([
+            (self.simbolos[0], Decimal("10.5"), "compra"), (self.simbolos[1], Decimal("4"), "venta"),
+            ("NUEVO", Decimal("2"), "compra"),
+        ]))
+        cantidades = dict(Cantidad.objects.filter(portafolio=self.pf).values_list("activo__simbolo", "cantidad"))
+        self.assertEqual(cantidades, {**self.antes, self.simbolos[0]: self.antes[self.simbolos[0]] + Decimal("10.5"),
+                                      self.simbolos[1]: self.antes[self.simbolos[1]] - 4, "NUEVO": Decimal("2")})
+        self.assertFalse(ValorActivo.objects.filter(activo=self.nuevo).exists())  # NUEVO no tiene precios
+
+    def test_solo_filas_invalidas(self):
+        r = self.registrar([{"activo": ["X"], "fecha": "2015-01-01", "cantidad": 1, "tipo": "compra"}], "?parcial=1")
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(r.json()["errores"], [{"fila": 0, "detail": "Activo debe ser un símbolo."}])
+
+    def test_aplicar_deltas_por_tramos(self):
+        ids = dict(Activo.objects.values_list("simbolo", "id"))
+        deltas = {ids[s]: Decimal(k + 1) for k, s in enumerate(self.simbolos)}
+        deltas[ids["NUEVO"]] = Decimal("-1.25")
+        with mock.patch.object(operaciones, "CASE_SIZE", 2), self.assertNumQueries(4):  # existentes, 2 UPDATE, INSERT
+            operaciones.aplicar_deltas(self.pf, deltas)
+        cantidades = dict(Cantidad.objects.filter(portafolio=self.pf).values_list("activo__simbolo", "cantidad"))
+        self.assertEqual(cantidades, {**{s: self.antes[s] + k + 1 for k, s in enumerate(self.simbolos)},
+                                      "NUEVO": Decimal("-1.25")})
+
+
+class CantidadesInicialesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        portafolios, simbolos, fechas = poblar_base(n_activos=5, n_dias=5, n_portafolios=6)
+        cls.t0 = fechas[0]
+        aids = list(Precio.objects.filter(fecha=cls.t0).values_list("activo_id", flat=True))
+        Weight.objects.bulk_create([
+            Weight(portafolio=pf, activo_id=aid, fecha=cls.t0, weight=Decimal(k + 1) / 15)
+            for pf in portafolios for k, aid in enumerate(aids)
+        ])
+        Operacion.objects.create(portafolio=portafolios[0], activo_id=aids[0], fecha=fechas[2],
+                                 cantidad=Decimal("10"), tipo="venta")
+        precios = dict(Precio.objects.filter(fecha=cls.t0).values_list("activo_id", "precio"))
+        cls.esperado = {
+            (w.portafolio_id, w.activo_id): w.weight * Decimal("1000000") / precios[w.activo_id]
+            for w in Weight.objects.all()
+        }
+        cls.esperado[(portafolios[0].id, aids[0])] -= 10
+
+    def test_igual_al_calculo_decimal_con_y_sin_procesos(self):
+        for procesos in ("1", "3"):
+            with self.subTest(procesos=procesos):
+                call_command("calc_cantidades_iniciales", "--t0", self.t0.isoformat(), "--v0", "1000000",
+                             "--overwrite", "--procesos", procesos, stdout=StringIO())
+                for c in Cantidad.objects.all():
+                    self.assertAlmostEqual(c.cantidad, self.esperado[(c.portafolio_id, c.activo_id)],
+                                           delta=Decimal("0.000001"))
+
+    def test_sin_overwrite_no_modifica(self):
+        antes = dict(Cantidad.objects.values_list("id", "cantidad"))
+        salida = StringIO()
+        call_command("calc_cantidades_iniciales", "--t0", self.t0.isoformat(), stdout=salida)
+        self.assertIn("creadas: 0, actualizadas: 0, omitidas: 30", salida.getvalue())
+        self.assertEqual(dict(Cantidad.objects.values_list("id", "cantidad")), antes)
+
+
+    def test_alias_obsoletos_pf1_pf2(self):
+        pf1, pf2 = Portafolio.objects.order_by("id")[:2]
+        salida, errores = StringIO(), StringIO()
+        call_command("calc_cantidades_iniciales", "--t0", self.t0.isoformat(), "--v0", "1000000", "--overwrite",
+                     "--pf1", pf1.nombre, "--pf2", pf2.nombre, stdout=salida, stderr=errores)
+        self.assertIn("Portafolios: 2.", salida.getvalue())
+        self.assertIn("obsoletos", errores.getvalue())
+
+
+class ImportacionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        _, cls.simbolos, cls.fechas = poblar_base(n_activos=3, n_dias=10)
+        refrescar_valuaciones()
+
+    def setUp(self):
+        ValorPortafolio.objects.update(valor_total=Decimal("-1"))  # marca: lo que no se reescriba queda en -1
+
+    def importar(self, filas, *opciones):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        path = os.path.join(directorio, "precios.csv")
+        with open(path, "w") as f:
+            f.write("fecha," + ",".join(self.simbolos[:2]) + "\n")
+            f.writelines(f"{fecha},{a},{b}\n" for fecha, a, b in filas)
+        call_command("import_datos", path, *opciones, stdout=StringIO())
+
+    def precio(self, simbolo, fecha):
+        return Precio.objects.get(activo__simbolo=simbolo, fecha=fecha).precio
+
+    def reescritas(self):
+        return set(ValorPortafolio.objects.exclude(valor_total=Decimal("-1")).values_list("fecha", flat=True))
+
+    def test_delta_solo_importa_fechas_posteriores(self):
+        f, a1, a2 = self.fechas, *self.simbolos[:2]
+        antes = self.precio(a1, f[2])
+        nueva = f[-1] + timedelta(days=1)
+        self.importar([(f[2], "999", "999"), (nueva, "10.5", "20.25")], "--delta")
+        self.assertEqual(self.precio(a1, f[2]), antes)
+        self.assertEqual((self.precio(a1, nueva), self.precio(a2, nueva)), (Decimal("10.5"), Decimal("20.25")))
+        self.assertEqual(self.reescritas(), {nueva})
+
+    def test_desde_descarta_filas_anteriores(self):
+        f, a1 = self.fechas, self.simbolos[0]
+        nueva = f[-1] + timedelta(days=1)
+        self.importar([(f[2], "999", "999"), (nueva, "10.5", "20.25")], "--desde", f[5].isoformat(), "--upsert")
+        self.assertNotEqual(self.precio(a1, f[2]), Decimal("999"))
+        self.assertEqual(self.precio(a1, nueva), Decimal("10.5"))
+        self.assertEqual(self.reescritas(), {nueva})
+
+    def test_upsert_reescribe_solo_los_que_cambiaron(self):
+        f, a1, a2 = self.fechas, *self.simbolos[:2]
+        iguales = (f[5], self.precio(a1, f[5]), self.precio(a2, f[5]))
+        cambiada = (f[4], "123.456789", self.precio(a2, f[4]))
+
+        self.importar([cambiada, iguales])  # sin --upsert los existentes se ignoran
+        self.assertNotEqual(self.precio(a1, f[4]), Decimal("123.456789"))
+        self.assertEqual(self.reescritas(), set())
+
+        self.importar([cambiada, iguales], "--upsert")
+        self.assertEqual(self.precio(a1, f[4]), Decimal("123.456789"))
+        self.assertEqual(Precio.objects.count(), 30)
+        self.assertEqual(self.reescritas(), {f[4]})
+        c = Cantidad.objects.get(activo__simbolo=a1).cantidad
+        self.assertAlmostEqual(ValorActivo.objects.get(activo__simbolo=a1, fecha=f[4]).valor,
+                               float(c * Decimal("123.456789")), delta=1e-6)
+
+    def excel(self, fechas):
+        from openpyxl import Workbook
+
+        wb = Workbook()
+        weights = wb.active
+        weights.title = "Weights"
+        weights.append(["activos", "Portafolio 1", "Portafolio 2"])
+        weights.append([self.simbolos[0], 0.5, 0.25])
+        precios = wb.create_sheet("Precios")
+        precios.append(["fecha", self.simbolos[0], "NUEVO", None])  # columna sin encabezado: se descarta
+        for k, fecha in enumerate(fechas):
+            precios.append([fecha, 100 + k + 0.125, None if k == 4 else 50 - k, "x"])
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        path = os.path.join(directorio, "datos.xlsx")
+        wb.save(path)
+        return path
+
+    def test_excel_en_varios_bloques(self):
+        nuevas = [self.fechas[-1] + timedelta(days=k + 1) for k in range(10)]
+        path = self.excel(nuevas)
+        bloques = list(bloques_precios(path, "Precios", filas_por_bloque=3))
+        self.assertEqual([len(b) for b in bloques], [3, 3, 3, 1])
+        self.assertEqual(list(bloques[0].columns), ["fecha", self.simbolos[0], "NUEVO"])
+
+        salida = StringIO()
+        call_command("import_datos", path, "--chunk", "3", "--batch-size", "4", stdout=salida)
+        self.assertIn("19 precios leídos", salida.getvalue())
+        importados = set(Precio.objects.filter(fecha__in=nuevas).values_list("activo__simbolo", "fecha", "precio"))
+        esperados = {(self.simbolos[0], f, Decimal(100 + k) + Decimal("0.125")) for k, f in enumerate(nuevas)}
+        esperados |= {("NUEVO", f, Decimal(50 - k)) for k, f in enumerate(nuevas) if k != 4}
+        self.assertEqual(importados, esperados)
+        self.assertEqual(self.reescritas(), set(nuevas))
+
+    def test_limite_de_memoria_aborta_sin_importar(self):
+        path = self.excel([self.fechas[-1] + timedelta(days=1)])
+        if memoria_actual_mb() is None:
+            self.skipTest("sin /proc/self/statm")
+        with self.assertRaisesMessage(CommandError, "límite de memoria"):
+            call_command("import_datos", path, "--memoria-max", "1", stdout=StringIO())
+        self.assertFalse(Precio.objects.filter(fecha__gt=self.fechas[-1]).exists())
+        self.assertFalse(Activo.objects.filter(simbolo="NUEVO").exists())
+
+
+@override_settings(PRECIOS_MATRIZ_DIR=None)  # precios siempre de la base: los tests los modifican
+class ValuacionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        portafolios, cls.simbolos, cls.fechas = poblar_base(n_activos=3, n_dias=10, n_portafolios=2)
+        cls.pf, cls.sin_materializar = portafolios
+        refrescar_valuaciones([cls.pf.id])
+
+    def setUp(self):
+        cache_evolucion().clear()
+
+    def test_incremental_no_deja_historias_parciales(self):
+        f = self.fechas
+        Precio.objects.filter(activo__simbolo=self.simbolos[0], fecha=f[5]).update(precio=Decimal("99"))
+        refrescar_valuaciones(fechas=[f[5]])
+        refrescar_valuaciones([self.sin_materializar.id], desde=f[7])
+        self.assertFalse(ValorPortafolio.objects.filter(portafolio=self.sin_materializar).exists())
+        self.assertEqual(ValorPortafolio.objects.filter(portafolio=self.pf).count(), len(f))
+        # sin valuaciones la API calcula en línea toda la historia
+        r = self.client.get(reverse("evolucion-portafolio", args=[self.sin_materializar.id]),
+                            {"fecha_inicio": f[0], "fecha_fin": f[-1], "formato": "columnar"})
+        self.assertEqual(r.json()["fechas"], [x.isoformat() for x in f])
+
+    def valuaciones(self):
+        return {fecha: (pk, v) for pk, fecha, v in
+                ValorPortafolio.objects.filter(portafolio=self.pf).values_list("pk", "fecha", "valor_total")}
+
+    def precio(self, simbolo, fecha):
+        return Precio.objects.get(activo__simbolo=simbolo, fecha=fecha).precio
+
+    def test_solo_reescribe_las_fechas_afectadas(self):
+        f = self.fechas
+        antes = self.valuaciones()
+        posiciones = set(ValorActivo.objects.exclude(fecha=f[4]).values_list("pk", "fecha", "valor", "weight"))
+        Precio.objects.filter(activo__simbolo=self.simbolos[0], fecha=f[4]).update(precio=Decimal("99"))
+        refrescar_valuaciones(fechas=[f[4]])  # todos los activos tienen precio en f[5]: nada arrastra f[4]
+        despues = self.valuaciones()
+        self.assertNotEqual(despues[f[4]], antes[f[4]])
+        self.assertEqual({k: v for k, v in despues.items() if k != f[4]},
+                         {k: v for k, v in antes.items() if k != f[4]})
+        self.assertEqual(set(ValorActivo.objects.exclude(fecha=f[4]).values_list("pk", "fecha", "valor", "weight")),
+                         posiciones)
+
+    def test_precio_corregido_se_arrastra_a_fechas_sin_precio(self):
+        f, simbolo = self.fechas, self.simbolos[0]
+        Precio.objects.filter(activo__simbolo=simbolo, fecha=f[6]).delete()  # f[6] arrastra el precio de f[5]
+        refrescar_valuaciones([self.pf.id])
+        antes = self.valuaciones()
+        Precio.objects.filter(activo__simbolo=simbolo, fecha=f[5]).update(
+            precio=self.precio(simbolo, f[5]) + Decimal("10"))
+        refrescar_valuaciones(fechas=[f[5]])
+        despues = self.valuaciones()
+        c = float(Cantidad.objects.get(portafolio=self.pf, activo__simbolo=simbolo).cantidad)
+        for fecha in f[5:7]:
+            self.assertNotEqual(despues[fecha][0], antes[fecha][0])
+            self.assertAlmostEqual(float(despues[fecha][1] - antes[fecha][1]), 10 * c, delta=0.02)
+        for fecha in (f[4], f[7]):
+            self.assertEqual(despues[fecha], antes[fecha])
+
+    def test_misma_respuesta_materializada_y_en_linea(self):
+        url = reverse("evolucion-portafolio", args=[self.pf.id])
+        params = {"fecha_inicio": self.fechas[0], "fecha_fin": self.fechas[-1], "formato": "columnar"}
+        materializada = self.client.get(url, params).content
+        ValorActivo.objects.filter(portafolio=self.pf).delete()
+        ValorPortafolio.objects.filter(portafolio=self.pf).delete()
+        cache_evolucion().clear()
+        self.assertEqual(self.client.get(url, params).content, materializada)
+
+
+class LibroPosicionesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        portafolios, cls.simbolos, cls.fechas = poblar_base(n_activos=2, n_dias=6)
+        cls.pf = portafolios[0]
+
+    def registrar(self, *ops):
+        ops = [{"activo": a, "fecha": f.isoformat(), "cantidad": c, "tipo": t} for a, f, c, t in ops]
+        r = self.client.post(reverse("registro-operaciones", args=[self.pf.id]), data=json.dumps(ops),
+                             content_type="application/json")
+        self.assertEqual(r.status_code, 201)
+
+    def valuar(self):
+        """Precios, cantidades vigentes y V_t en cada fecha, con columnas en el orden de ``simbolos``."""
+        libro = cargar_libros([self.pf.id])[self.pf.id]
+        fechas, P = cargar_matriz_precios(libro.activo_ids)
+        self.assertEqual(fechas, self.fechas)
+        Q = libro.cantidades(fechas)
+        _, Vt, _ = evolucion(P, Q)
+        orden = [libro.activo_ids.index(aid) for aid in Activo.objects.filter(
+            simbolo__in=self.simbolos).order_by("simbolo").values_list("id", flat=True)]
+        return P[:, orden], Q[:, orden], Vt
+
+    def test_rige_desde_su_fecha(self):
+        _, Q0, V0 = self.valuar()
+        self.registrar((self.simbolos[0], self.fechas[3], 5, "compra"))
+        P, Q, Vt = self.valuar()
+        np.testing.assert_array_equal(Q[:3], Q0[:3])
+        np.testing.assert_array_equal(Vt[:3], V0[:3])
+        np.testing.assert_allclose(Q[3:] - Q0[3:], [[5, 0]] * 3, rtol=0, atol=1e-9)
+        np.testing.assert_allclose(Vt[3:] - V0[3:], 5 * P[3:, 0], rtol=1e-9)
+
+    def test_misma_fecha_y_antes_del_primer_precio(self):
+        _, Q0, V0 = self.valuar()
+        a1, a2 = self.simbolos
+        self.registrar(
+            (a1, self.fechas[2], 4, "compra"), (a1, self.fechas[2], 1, "venta"),  # misma fecha: neto +3
+            (a2, self.fechas[0] - timedelta(days=30), 6, "compra"),  # antes del primer precio: rige en todas
+        )
+        P, Q, Vt = self.valuar()
+        np.testing.assert_allclose(Q - Q0, [[0, 6]] * 2 + [[3, 6]] * 4, rtol=0, atol=1e-9)
+        np.testing.assert_allclose(Vt - V0, 3 * P[:, 0] * (np.arange(6) >= 2) + 6 * P[:, 1], rtol=1e-9)
+
+
+class EvolucionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        portafolios, _, cls.fechas = poblar_base(n_activos=3, n_dias=200)
+        cls.pf = portafolios[0]
+        refrescar_valuaciones()
+
+    def setUp(self):
+        cache_evolucion().clear()
+
+    def evolucion(self, headers=None, **params):
+        params = {"fecha_inicio": self.fechas[0], "fecha_fin": self.fechas[-1], "formato": "columnar", **params}
+        return self.client.get(reverse("evolucion-portafolio", args=[self.pf.id]), params, headers=headers)
+
+    def test_cache_y_etag(self):
+        primera = self.evolucion()
+        self.assertEqual(primera.status_code, 200)
+        self.assertEqual(self.evolucion(headers={"If-None-Match": primera["ETag"]}).status_code, 304)
+        with mock.patch("inversiones.views.leer_evolucion") as leer:
+            segunda = self.evolucion()
+        leer.assert_not_called()  # el cuerpo sale de la caché
+        self.assertEqual((segunda.content, segunda["ETag"]), (primera.content, primera["ETag"]))
+
+    def test_operaciones_y_precios_cambian_el_etag(self):
+        f = self.fechas
+
+        def registrar():
+            ops = [{"activo": "A1", "fecha": f[100].isoformat(), "cantidad": 10, "tipo": "compra"}]
+            r = self.client.post(reverse("registro-operaciones", args=[self.pf.id]), data=json.dumps(ops),
+                                 content_type="application/json")
+            self.assertEqual(r.status_code, 201)
+
+        def importar():
+            directorio = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, directorio)
+            path = os.path.join(directorio, "precios.csv")
+            with open(path, "w") as archivo:
+                archivo.write(f"fecha,A1\n{f[150]},123.456789\n")
+            call_command("import_datos", path, "--upsert", stdout=StringIO())
+
+        anterior = self.evolucion()
+        for cambio in (registrar, importar):
+            with self.subTest(cambio=cambio.__name__):
+                cambio()
+                r = self.evolucion(headers={"If-None-Match": anterior["ETag"]})
+                self.assertEqual(r.status_code, 200)
+                self.assertNotEqual(r["ETag"], anterior["ETag"])
+                self.assertNotEqual(r.content, anterior.content)  # no sirve el cuerpo viejo de la caché
+                anterior = r
+
+    def test_remuestreo_al_cierre_de_cada_periodo(self):
+        completa = self.evolucion().json()
+        vt = dict(zip(completa["fechas"], completa["Vt"]))
+        claves = {"W": lambda f: f.isocalendar()[:2], "M": lambda f: (f.year, f.month),
+                  "Q": lambda f: (f.year, (f.month - 1) // 3)}
+        for freq, clave in claves.items():
+            with self.subTest(freq=freq):
+                datos = self.evolucion(freq=freq).json()
+                cierres = [max(g).isoformat() for _, g in itertools.groupby(self.fechas, clave)]
+                self.assertEqual(datos["fechas"], cierres)
+                self.assertEqual(datos["Vt"], [vt[f] for f in cierres])
+
+    def test_lttb_conserva_extremos_y_cantidad_de_puntos(self):
+        completa = self.evolucion().json()
+        for puntos in (3, 17, 50):
+            with self.subTest(puntos=puntos):
+                datos = self.evolucion(puntos=puntos).json()
+                self.assertEqual(len(datos["fechas"]), puntos)
+                self.assertEqual((datos["fechas"][0], datos["fechas"][-1]),
+                                 (completa["fechas"][0], completa["fechas"][-1]))
+                self.assertEqual(datos["fechas"], sorted(set(datos["fechas"]) & set(completa["fechas"])))
+        self.assertEqual(len(self.evolucion(puntos=1000).json()["fechas"]), len(self.fechas))
+        y = np.zeros(100)
+        y[37] = 5.0  # un pico aislado siempre sobrevive a la reducción
+        self.assertIn(37, indices_lttb(y, 10).tolist())
+
+    def test_parametros_invalidos(self):
+        for params in ({"freq": "D"}, {"puntos": "2"}, {"puntos": "muchos"}, {"limite": "0"},
+                       {"limite": str(LIMITE_MAX + 1)}, {"cursor": "%%%"}, {"formato": "xml"},
+                       {"fecha_inicio": "2015-13-01"}, {"fecha_inicio": self.fechas[-1], "fecha_fin": self.fechas[0]}):
+            with self.subTest(params=params):
+                r = self.evolucion(**params)
+                self.assertEqual(r.status_code, 400)
+                self.assertIn("detail", r.json())
+
+    def test_cursor_recorre_todas_las_fechas_una_vez(self):
+        for extra in ({}, {"freq": "W"}):
+            with self.subTest(**extra):
+                esperadas = self.evolucion(**extra).json()["fechas"]
+                vistas, cursor, paginas = [], None, 0
+                while True:
+                    datos = self.evolucion(limite=7, **extra, **({"cursor": cursor} if cursor else {})).json()
+                    vistas += datos["fechas"]
+                    paginas += 1
+                    cursor = datos["siguiente"]
+                    if cursor is None:
+                        break
+                self.assertEqual(vistas, esperadas)
+                self.assertEqual(paginas, -(-len(esperadas) // 7))
+
+    def test_binario_igual_al_json(self):
+        aid = Precio.objects.values_list("activo_id", flat=True).first()
+        Precio.objects.filter(activo_id=aid, fecha__lt=self.fechas[5]).delete()  # sin peso (NaN) al principio
+        refrescar_valuaciones()
+        params = {"puntos": 40, "limite": 30}
+        r = self.evolucion(formato="binario", **params)
+        self.assertEqual(r["Content-Type"], formatos.BINARIO)
+        contenido = r.content
+        self.assertEqual(contenido[:4], b"PFEV")
+        self.assertEqual(struct.unpack_from("<HHIII", contenido, 4)[0], formatos.VERSION_BINARIO)
+        cabecera, fechas, Vt, W = formatos.leer_binario(contenido)
+        datos = self.evolucion(formato="json", **params).json()
+
+        self.assertEqual({k: cabecera[k] for k in ("portafolio", "rango", "siguiente")},
+                         {k: datos[k] for k in ("portafolio", "rango", "siguiente")})
+        self.assertEqual([f.isoformat() for f in fechas], [p["fecha"] for p in datos["Vt"]])
+        self.assertEqual(Vt.tolist(), [p["valor"] for p in datos["Vt"]])
+        self.assertTrue(np.isnan(W[0, cabecera["simbolos"].index(Activo.objects.get(pk=aid).simbolo)]))
+        for fila, w in zip(W.tolist(), datos["weights"]):
+            binario = {s: v for s, v in zip(cabecera["simbolos"], fila) if not np.isnan(v)}
+            self.assertEqual(binario, {x["activo"]: x["valor"] for x in w["w"]})
+
+
+class MicroUnidadesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        portafolios, _, cls.fechas = poblar_base(n_activos=3, n_dias=3)
+        cls.pf = portafolios[0]
+        cls.aid = Precio.objects.values_list("activo_id", flat=True).first()
+        cls.decimales = [Decimal("0.1"), Decimal("0.000001"), Decimal("123456789.123457"),
+                         Decimal("3999999999.999999"), Decimal("-3.3")]
+
+    def test_lectura_exacta(self):
+        Precio.objects.filter(activo_id=self.aid).delete()
+        Precio.objects.bulk_create([
+            Precio(activo_id=self.aid, fecha=self.fechas[0] - timedelta(days=k + 1), precio=d)
+            for k, d in enumerate(self.decimales)
+        ])
+        leidos = Precio.objects.filter(activo_id=self.aid).order_by("-fecha").values_list(
+            micro.en_micro("precio"), flat=True)
+        self.assertEqual(list(leidos), [int(d * micro.ESCALA) for d in self.decimales])
+
+    def test_cantidades_suman_exacto(self):
+        # 0.1 + 0.2 - 0.3 no es 0 en float; en micro-unidades sí
+        Cantidad.objects.filter(portafolio=self.pf, activo_id=self.aid).update(cantidad=Decimal("0"))
+        for cantidad, tipo in (("0.1", "compra"), ("0.2", "compra"), ("0.3", "venta")):
+            Operacion.objects.create(portafolio=self.pf, activo_id=self.aid, fecha=self.fechas[1],
+                                     cantidad=Decimal(cantidad), tipo=tipo)
+        libro = cargar_libros([self.pf.id])[self.pf.id]
+        Q = libro.cantidades(self.fechas)
+        j = libro.activo_ids.index(self.aid)
+        self.assertEqual(Q[:, j].tolist(), [0.0, 0.0, 0.0])
+
+    def test_evolucion_dentro_de_la_cota_frente_a_decimal(self):
+        f, aids = self.fechas, sorted(Precio.objects.values_list("activo_id", flat=True).distinct())
+        Precio.objects.filter(activo_id=aids[0], fecha=f[0]).delete()  # sin precio todavía: no suma
+        Precio.objects.filter(activo_id=aids[1], fecha=f[1]).delete()  # hueco: vale el anterior
+        Precio.objects.filter(activo_id=aids[2], fecha=f[2]).update(precio=Decimal("3999.123457"))
+        Operacion.objects.create(portafolio=self.pf, activo_id=aids[2], fecha=f[1], cantidad=Decimal("0.37"),
+                                 tipo="compra")
+        libro = cargar_libros([self.pf.id])[self.pf.id]
+        fechas, P = cargar_matriz_precios(libro.activo_ids, f[0], f[-1])
+        _, Vt, W = evolucion(P, libro.cantidades(fechas))
+
+        # referencia exacta: último precio en o antes de t por la cantidad vigente en t
+        actual = dict(Cantidad.objects.filter(portafolio=self.pf).values_list("activo_id", "cantidad"))
+        precios = list(Precio.objects.order_by("fecha").values_list("activo_id", "fecha", "precio"))
+        for k, t in enumerate(fechas):
+            vigente = {a: actual[a] - sum((o.cantidad for o in Operacion.objects.filter(activo_id=a, fecha__gt=t)),
+                                          Decimal(0)) for a in libro.activo_ids}
+            ultimo = {a: p for a, fecha, p in precios if fecha <= t}
+            X = {a: ultimo[a] * vigente[a] for a in libro.activo_ids if a in ultimo}
+            V = sum(X.values(), Decimal(0))
+            A = len(libro.activo_ids)
+            self.assertLessEqual(abs(Decimal(Vt[k]) - V) / V, micro.error_relativo_vt(A))
+            for j, a in enumerate(libro.activo_ids):
+                if a not in X:
+                    self.assertTrue(np.isnan(W[k, j]))
+                    continue
+                w = X[a] / V
+                self.assertLessEqual(abs(Decimal(W[k, j]) - w) / w, micro.error_relativo_w(A))
+        self.assertTrue(np.isnan(W[0, libro.activo_ids.index(aids[0])]))
+
+    def test_redondeo_como_decimal(self):
+        x = np.random.default_rng(0).uniform(-1e6, 1e6, 1000)
+        esperado = [Decimal(repr(v)).quantize(Decimal("0.000001")) for v in x.tolist()]
+        for d, e in zip(micro.a_decimal(micro.redondear(x)), esperado):
+            self.assertLessEqual(abs(d - e), Decimal("0.000001"))  # solo difieren cerca de un empate
+        self.assertEqual(micro.a_decimal(micro.redondear([2.5e-7, -3.14159265, 0.0049], 2), 2),
+                         [Decimal("0.00"), Decimal("-3.14"), Decimal("0.00")])
+
+
+class MatrizPreciosTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        _, _, cls.fechas = poblar_base(n_activos=4, n_dias=20)
+        cls.ids = sorted(Precio.objects.values_list("activo_id", flat=True).distinct())
+        Precio.objects.filter(activo_id=cls.ids[0], fecha__lt=cls.fechas[5]).delete()  # historia más corta
+        Precio.objects.filter(activo_id=cls.ids[1], fecha__in=cls.fechas[8:10]).delete()  # hueco
+
+    def setUp(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        ajuste = override_settings(PRECIOS_MATRIZ_DIR=directorio)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+
+    def desde_base(self, *args):
+        with override_settings(PRECIOS_MATRIZ_DIR=None):
+            return cargar_matriz_precios(*args)
+
+    def test_cortes_iguales_a_la_base(self):
+        self.assertIsNone(matriz_precios.abrir())
+        matriz_precios.generar()
+        f = self.fechas
+        for activo_ids, fi, ff in (
+            (self.ids, None, None), (self.ids[:1], f[0], f[4]), (self.ids[::-1], f[3], f[12]),
+            (self.ids[1:] + [9999], f[10], None), ([], f[0], f[-1]),
+        ):
+            with self.subTest(activo_ids=activo_ids, fi=fi, ff=ff):
+                with self.assertNumQueries(1):
+                    fechas, P = cargar_matriz_precios(activo_ids, fi, ff)
+                fechas_base, P_base = self.desde_base(activo_ids, fi, ff)
+                self.assertEqual(fechas, fechas_base)
+                np.testing.assert_array_equal(P, P_base)
+                # también el índice as-of: el de la instantánea recortado al rango y el armado desde la base
+                _, _, U = calendario.cargar_asof(activo_ids, fi, ff)
+                with override_settings(PRECIOS_MATRIZ_DIR=None):
+                    _, _, U_base = calendario.cargar_asof(activo_ids, fi, ff)
+                np.testing.assert_array_equal(U, U_base)
+
+    def test_hueco_arrastra_el_ultimo_precio(self):
+        f = self.fechas
+        matriz_precios.generar()
+        for fechas, P in (cargar_matriz_precios(self.ids, f[8], f[10]), self.desde_base(self.ids, f[8], f[10])):
+            self.assertEqual(fechas, f[8:11])  # el calendario no pierde fechas
+            previo = Precio.objects.get(activo_id=self.ids[1], fecha=f[7]).precio
+            np.testing.assert_array_equal(P[:2, 1], [float(previo)] * 2)  # arrastrado desde antes del rango
+            self.assertFalse(np.isnan(P).any())
+
+    def test_deja_de_ser_vigente_al_cambiar_precios(self):
+        matriz_precios.generar()
+        self.assertIsNotNone(matriz_precios.abrir())
+        invalidar(precios=True)
+        self.assertIsNone(matriz_precios.abrir())
+
+    def test_import_datos_la_regenera(self):
+        path = os.path.join(tempfile.mkdtemp(), "precios.csv")
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write("fecha,A1,A2\n2030-01-02,10.5,20.25\n")
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("import_datos", path, stdout=StringIO())
+        fechas, P = cargar_matriz_precios(self.ids[:2], self.fechas[-1], None)
+        self.assertEqual(fechas[-1].isoformat(), "2030-01-02")
+        np.testing.assert_array_equal(P[-1], [10.5, 20.25])
+
+    def test_valuacion_cubre_todas_las_tenencias(self):
+        f, aid = self.fechas, self.ids[1]
+        refrescar_valuaciones()
+        self.assertEqual(ValorActivo.objects.filter(fecha=f[8]).count(), 4)
+        c = float(Cantidad.objects.get(activo_id=aid).cantidad)
+        Precio.objects.filter(activo_id=aid, fecha=f[7]).update(precio=Decimal("99"))
+        refrescar_valuaciones(fechas=[f[7]])  # también f[8] y f[9], que arrastran ese precio
+        valores = ValorActivo.objects.filter(activo_id=aid, fecha__in=f[7:11]).order_by("fecha")
+        self.assertEqual([round(v / c, 6) for v in valores.values_list("valor", flat=True)][:3], [99.0] * 3)
+        self.assertNotEqual(round(valores.last().valor / c, 6), 99.0)
+
+    def test_import_extiende_la_anterior(self):
+        matriz_precios.generar()
+        path = os.path.join(tempfile.mkdtemp(), "precios.csv")
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, "w") as f:  # una corrección en el hueco y una fecha nueva solo para A2
+            f.write(f"fecha,A2,A3\n{self.fechas[9]},7.5,\n2030-01-02,8.5,\n")
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("import_datos", path, stdout=StringIO())
+        incremental = [np.array(x) for x in matriz_precios.abrir()]
+        matriz_precios.generar(forzar=True)
+        for x, y in zip(incremental, matriz_precios.abrir()):
+            np.testing.assert_array_equal(x, y)
+        fechas, P = cargar_matriz_precios(self.ids[1:3], self.fechas[-1], None)
+        self.assertEqual(P[-1, 0], 8.5)
+        self.assertEqual(P[-1, 1], P[0, 1])  # A3 sin precio el 2030-01-02: vale el último
+
+
+class TrabajosTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        portafolios, cls.simbolos, cls.fechas = poblar_base(n_activos=3, n_dias=10)
+        cls.pf = portafolios[0]
+        refrescar_valuaciones()
+
+    def setUp(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        ajuste = override_settings(TRABAJOS_DIR=directorio, PRECIOS_MATRIZ_DIR=None)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+
+    def registrar(self, fecha, cantidad):
+        url = reverse("registro-operaciones", args=[self.pf.id]) + "?asincrono=1"
+        ops = [{"activo": self.simbolos[0], "fecha": fecha.isoformat(), "cantidad": cantidad, "tipo": "compra"}]
+        return self.client.post(url, data=json.dumps(ops), content_type="application/json")
+
+    def procesar(self):
+        salida = StringIO()
+        call_command("procesar_trabajos", "--una-vez", stdout=salida)
+        return salida.getvalue()
+
+    def test_recalculo_encolado_y_fusionado(self):
+        antes = ValorPortafolio.objects.get(portafolio=self.pf, fecha=self.fechas[-1]).valor_total
+        r1 = self.registrar(self.fechas[6], 5)
+        r2 = self.registrar(self.fechas[3], 7)
+        self.assertEqual((r1.status_code, r2.status_code), (202, 202))
+        trabajo = r2.json()["trabajo"]
+        self.assertEqual(trabajo["id"], r1.json()["trabajo"]["id"])
+        self.assertEqual((trabajo["solicitudes"], trabajo["parametros"]["desde"]), (2, self.fechas[3].isoformat()))
+        self.assertEqual(r2["Location"], r2.json()["estado_url"])
+        # sin worker las valuaciones siguen como antes
+        self.assertEqual(ValorPortafolio.objects.get(portafolio=self.pf, fecha=self.fechas[-1]).valor_total, antes)
+
+        self.assertIn("Procesados: 1.", self.procesar())
+        estado = self.client.get(r2["Location"]).json()
+        self.assertEqual(estado["estado"], Trabajo.COMPLETADO)
+        precio = Precio.objects.get(activo__simbolo=self.simbolos[0], fecha=self.fechas[-1]).precio
+        despues = ValorPortafolio.objects.get(portafolio=self.pf, fecha=self.fechas[-1]).valor_total
+        self.assertAlmostEqual(float(despues - antes), 12 * float(precio), delta=0.02)
+
+        # ya en curso o terminado no se fusiona: un pedido nuevo crea otro trabajo
+        self.assertNotEqual(self.registrar(self.fechas[8], 1).json()["trabajo"]["id"], trabajo["id"])
+
+    def test_cache_se_invalida_al_recalcular(self):
+        url = reverse("evolucion-portafolio", args=[self.pf.id])
+        params = {"fecha_inicio": self.fechas[0], "fecha_fin": self.fechas[-1], "formato": "columnar"}
+        cache_evolucion().clear()
+        etag = self.client.get(url, params)["ETag"]
+        self.registrar(self.fechas[2], 5)
+        # hasta que corra el recálculo las valuaciones y la versión son las anteriores
+        self.assertEqual(self.client.get(url, params, headers={"If-None-Match": etag}).status_code, 304)
+        self.procesar()
+        r = self.client.get(url, params, headers={"If-None-Match": etag})
+        self.assertEqual(r.status_code, 200)
+        self.assertNotEqual(r["ETag"], etag)
+
+    def test_importacion_encolada(self):
+        csv = SimpleUploadedFile("precios.csv", f"fecha,{self.simbolos[0]},NUEVO\n2030-01-02,10.5,20.25\n".encode())
+        r = self.client.post(reverse("importaciones"), {"archivo": csv, "delta": "1"})
+        self.assertEqual(r.status_code, 202)
+        self.assertEqual(r.json()["trabajo"]["estado"], Trabajo.PENDIENTE)
+        self.assertFalse(Precio.objects.filter(activo__simbolo="NUEVO").exists())
+
+        self.procesar()
+        estado = self.client.get(r["Location"]).json()
+        self.assertEqual(estado["estado"], Trabajo.COMPLETADO, estado["error"])
+        self.assertIn("2 precios leídos", estado["resultado"]["salida"])
+        self.assertTrue(Precio.objects.filter(activo__simbolo="NUEVO", fecha=date(2030, 1, 2)).exists())
+        self.assertFalse(os.path.exists(estado["parametros"]["archivo"]))  # la subida se borra
+
+    def test_trabajo_fallido_y_errores(self):
+        trabajo = trabajos.encolar_importacion("/no/existe.csv")
+        self.procesar()
+        estado = self.client.get(reverse("estado-trabajo", args=[trabajo.id])).json()
+        self.assertEqual(estado["estado"], Trabajo.FALLIDO)
+        self.assertTrue(estado["error"])
+        self.assertEqual(self.client.get(reverse("estado-trabajo", args=[999])).status_code, 404)
+        self.assertEqual(self.client.post(reverse("importaciones"), {}).status_code, 400)
+
+
+@override_settings(DB_REINTENTOS=2, DB_REINTENTO_ESPERA=0)
+class PerfilBaseDeDatosTests(SimpleTestCase):
+
+    def test_reintenta_solo_si_la_base_esta_bloqueada(self):
+        llamadas = []
+
+        @reintentar_si_bloqueada
+        def escribir(error):
+            llamadas.append(error)
+            if len(llamadas) <= 2:
+                raise OperationalError(error)
+            return "ok"
+
+        self.assertEqual(escribir("database is locked"), "ok")
+        self.assertEqual(len(llamadas), 3)
+        llamadas.clear()
+        with self.assertRaises(OperationalError):
+            escribir("no such table: x")
+        self.assertEqual(len(llamadas), 1)
+
+    @skipUnless(connection.vendor == "sqlite", "perfil de SQLite")
+    def test_perfil_produccion_aplica_pragmas(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        conexion = DatabaseWrapper({**connection.settings_dict, "NAME": os.path.join(directorio, "db.sqlite3"),
+                                    **settings.DB_PERFILES["produccion"]}, alias="perfil")
+        self.addCleanup(conexion.close)
+        with conexion.cursor() as cursor:
+            self.assertEqual(cursor.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            self.assertEqual(cursor.execute("PRAGMA synchronous").fetchone()[0], 1)  # NORMAL
+        self.assertEqual(conexion.transaction_mode, "IMMEDIATE")
+
+
+class AnaliticaTests(TestCase):
+
+    def test_metricas_contra_calculo_directo(self):
+        rng = np.random.default_rng(7)
+        P = 100 * np.cumprod(1 + rng.normal(0, 0.01, size=(80, 3)), axis=0)
+        Q = np.tile([10.0, 20.0, 5.0], (80, 1))
+        fechas = [date(2024, 1, 1) + timedelta(days=k) for k in range(80)]
+        resumen, series, contribuciones = analitica.analizar(fechas, ["A", "B", "C"], P, Q, ventana=10)
+
+        V = (P * Q).sum(axis=1)
+        r = V[1:] / V[:-1] - 1
+        np.testing.assert_allclose(series["rendimiento"][1:], r, rtol=1e-12)
+        self.assertAlmostEqual(resumen["rendimiento_total"], V[-1] / V[0] - 1, places=12)
+        self.assertAlmostEqual(sum(c["contribucion"] for c in contribuciones), resumen["rendimiento_total"], places=12)
+        ventanas = np.array([r[k - 10:k].std(ddof=1) for k in range(10, r.size + 1)]) * np.sqrt(analitica.DIAS_ANIO)
+        np.testing.assert_allclose(series["volatilidad_movil"][10:], ventanas, rtol=1e-9)
+        self.assertTrue(np.isnan(series["volatilidad_movil"][:10]).all())
+        peor = min(V[j] / V[:j + 1].max() - 1 for j in range(V.size))
+        self.assertAlmostEqual(resumen["max_drawdown"]["valor"], peor, places=12)
+
+    def test_operaciones_no_son_rendimiento(self):
+        P = np.full((6, 2), 50.0)
+        Q = np.array([[1.0, 1.0]] * 3 + [[3.0, 1.0]] * 3)  # compra en t=3 con precios constantes
+        r, _ = analitica.rendimientos(P, Q)
+        np.testing.assert_array_equal(r, 0.0)
+
+    def test_endpoint(self):
+        portafolios, _, fechas = poblar_base(n_activos=3, n_dias=40)
+        url = reverse("analitica-portafolio", args=[portafolios[0].id])
+        query = f"?fecha_inicio={fechas[0]}&fecha_fin={fechas[-1]}&ventana=5"
+        data = self.client.get(url + query).json()
+        self.assertEqual(set(data["resumen"]), {"dias", "rendimiento_total", "rendimiento_anualizado",
+                                                "volatilidad_anualizada", "max_drawdown"})
+        self.assertEqual(len(data["series"]["fechas"]), 40)
+        self.assertIsNone(data["series"]["rendimiento"][0])
+        self.assertNotIn("series", self.client.get(url + query + "&series=0").json())
+        self.assertEqual(self.client.get(url + query + "&ventana=1").status_code, 400)
+
+
+class BacktestTests(TestCase):
+
+    @staticmethod
+    def referencia(P, w, v0, indices, banda, costo):
+        """Simulación día por día, sin vectorizar."""
+        Q, efectivo, V = np.zeros_like(w), v0, []
+        for t in range(P.shape[0]):
+            x = Q * P[t]
+            valor = x.sum() + efectivo
+            if t == 0 or (t in indices and (banda is None or np.abs(x / valor - w).max() > banda)):
+                valor -= np.abs(w * valor - x).sum() * costo
+                Q, efectivo = w * valor / P[t], valor * (1 - w.sum())
+            V.append((Q * P[t]).sum() + efectivo)
+        return np.array(V)
+
+    def test_simulacion_contra_calculo_directo(self):
+        rng = np.random.default_rng(3)
+        P = 100 * np.cumprod(1 + rng.normal(0, 0.02, size=(120, 3)), axis=0)
+        fechas = [date(2024, 1, 1) + timedelta(days=k) for k in range(120)]
+        w = np.array([0.5, 0.3, 0.1])  # 10% en efectivo
+        for v in backtest.variantes(backtest.FRECUENCIAS, [0, 0.03], [0, 0.002]):
+            with self.subTest(**v):
+                indices = backtest.candidatos(fechas, v["frecuencia"], v["banda"] is not None)
+                V, eventos, _ = backtest.simular(P, w, 1000.0, indices, v["banda"], v["costo"])
+                np.testing.assert_allclose(V, self.referencia(P, w, 1000.0, set(indices.tolist()), v["banda"],
+                                                              v["costo"]), rtol=1e-12)
+                if v["frecuencia"] == "M" and v["banda"] is None:
+                    self.assertEqual(eventos.tolist(), [0, 30, 59, 90])  # cierres de ene, feb y mar
+
+    def test_endpoint_y_comando(self):
+        portafolios, _, fechas = poblar_base(n_activos=3, n_dias=60, n_portafolios=2)
+        pf = portafolios[0]
+        Weight.objects.bulk_create([Weight(portafolio=pf, activo_id=aid, fecha=fechas[0], weight=Decimal("0.3"))
+                                    for aid in Precio.objects.values_list("activo_id", flat=True).distinct()])
+        url = reverse("backtest-portafolio", args=[pf.id]) + f"?fecha_inicio={fechas[0]}&fecha_fin={fechas[-1]}"
+
+        data = self.client.get(url + "&frecuencia=ninguna,M&banda=0,0.05&costo=0.001&series=1").json()
+        self.assertEqual(len(data["variantes"]), 4)
+        self.assertEqual([len(v) for v in data["series"]["valores"]], [60] * 4)
+        comprar_y_mantener = data["variantes"][0]
+        self.assertEqual(comprar_y_mantener["resumen"]["rebalanceos"], 0)
+        self.assertAlmostEqual(comprar_y_mantener["resumen"]["costos"], 0.9 * 1000000 * 0.001)
+        self.assertNotIn("series", self.client.get(url).json())
+        for query in ("&frecuencia=D", "&costo=x", "&banda=1.5", "&v0=0"):
+            self.assertEqual(self.client.get(url + query).status_code, 400)
+        sin_weights = reverse("backtest-portafolio", args=[portafolios[1].id])
+        self.assertEqual(self.client.get(sin_weights + f"?fecha_inicio={fechas[0]}&fecha_fin={fechas[-1]}")
+                         .status_code, 400)
+
+        salida = StringIO()
+        call_command("backtest", str(pf.id), "--frecuencias", "ninguna", "M", "--bandas", "0", "0.05",
+                     "--costos", "0.001", "--v0", "1000000", "--procesos", "2", stdout=salida)
+        self.assertIn("4 variantes", salida.getvalue())
+        with self.assertRaises(CommandError):
+            call_command("backtest", str(portafolios[1].id), stdout=StringIO())
+
+
+class EscenariosTests(TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(5)
+        self.R = rng.normal(0, 0.01, size=(50, 4))
+        self.X = rng.uniform(0, 100, size=(3, 4))
+
+    def test_historico_contra_calculo_directo(self):
+        pnl = escenarios.simular(self.R, self.X, "historico", horizonte=5, bloque=7)
+        esperado = np.array([(np.exp(self.R[k:k + 5].sum(axis=0)) - 1) @ self.X.T for k in range(46)])
+        np.testing.assert_allclose(pnl, esperado, rtol=1e-12)
+
+    def test_misma_semilla_mismo_resultado_con_procesos(self):
+        for metodo in ("bootstrap", "normal"):
+            with self.subTest(metodo=metodo):
+                serie = escenarios.simular(self.R, self.X, metodo, 1000, 3, semilla=7, bloque=300)
+                pool = escenarios.simular(self.R, self.X, metodo, 1000, 3, semilla=7, procesos=2, bloque=300)
+                np.testing.assert_array_equal(serie, pool)
+                self.assertEqual(serie.shape, (1000, 3))
+                otra = escenarios.simular(self.R, self.X, metodo, 1000, 3, semilla=8, bloque=300)
+                self.assertFalse(np.array_equal(serie, otra))
+
+    def test_var_y_cvar(self):
+        pnl = -np.arange(1.0, 101.0)[:, None]  # pérdidas 1..100
+        (r,) = escenarios.medidas(pnl, np.array([[1000.0]]), niveles=(0.9,))
+        self.assertAlmostEqual(r["riesgo"][0]["var"], 90.1)
+        self.assertAlmostEqual(r["riesgo"][0]["cvar"], np.mean(np.arange(91.0, 101.0)))
+        self.assertAlmostEqual(r["riesgo"][0]["var_pct"], 0.0901)
+
+    def test_endpoint_y_comando(self):
+        portafolios, _, _ = poblar_base(n_activos=3, n_dias=40, n_portafolios=2)
+        url = reverse("riesgo-lote") + f"?ids={portafolios[0].id}&escenarios=500&horizonte=5&niveles=0.9,0.99"
+        data = self.client.get(url).json()
+        self.assertEqual(data["escenarios"], 500)
+        self.assertEqual(data["ventana"], 39)
+        (pf,) = data["portafolios"]
+        self.assertEqual([m["nivel"] for m in pf["riesgo"]], [0.9, 0.99])
+        self.assertGreater(pf["riesgo"][1]["cvar"], pf["riesgo"][0]["var"])
+        cache_evolucion().clear()
+        self.assertEqual(self.client.get(url).json(), data)  # semilla fija
+        for query in ("&metodo=x", "&escenarios=0", "&niveles=1.5", f"&escenarios={settings.ESCENARIOS_MAX + 1}"):
+            self.assertEqual(self.client.get(url + query).status_code, 400)
+        self.assertEqual(self.client.get(reverse("riesgo-lote") + "?ids=999").status_code, 404)
+
+        salida = StringIO()
+        call_command("escenarios", "--metodo", "historico", "--horizonte", "5", stdout=salida)
+        self.assertIn("35 escenarios 'historico'", salida.getvalue())
+
+
+class MetricasTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        portafolios, _, cls.fechas = poblar_base(n_activos=3, n_dias=10)
+        cls.pf = portafolios[0]
+
+    def setUp(self):
+        REGISTRO.reiniciar()
+
+    def test_server_timing_y_metrics(self):
+        url = reverse("evolucion-portafolio", args=[self.pf.id])
+        r = self.client.get(f"{url}?fecha_inicio={self.fechas[0]}&fecha_fin={self.fechas[-1]}")
+        self.assertEqual(r.status_code, 200)
+        self.assertRegex(r["Server-Timing"], r'^db;dur=[\d.]+;desc="\d+ consultas", serializacion;dur=[\d.]+, '
+                                             r'app;dur=[\d.]+, total;dur=[\d.]+$')
+
+        texto = self.client.get(reverse("metricas")).content.decode()
+        self.assertIn('portafolio_peticiones_total{vista="evolucion-portafolio",status="200"} 1', texto)
+        self.assertIn('portafolio_peticion_consultas_bucket{vista="evolucion-portafolio",le="+Inf"} 1', texto)
+        self.assertNotIn('vista="metricas"', texto)
+
+    def test_metrics_solo_local(self):
+        self.assertEqual(self.client.get(reverse("metricas"), REMOTE_ADDR="10.1.2.3").status_code, 403)
+
+    def test_comandos_instrumentados(self):
+        call_command("refrescar_valuaciones", stdout=StringIO())
+        self.assertIn('portafolio_comandos_total{comando="refrescar_valuaciones",ok="1"} 1', REGISTRO.exponer())
+
+
+class EvolucionAsyncTests(TransactionTestCase):
+    """
+    La vista async consulta desde otros hilos, que no ven la transacción de un
+    ``TestCase``: por eso los datos se confirman y se limpian con flush.
+    """
+
+    def setUp(self):
+        portafolios, _, fechas = poblar_base(n_activos=3, n_dias=15)
+        self.pf = portafolios[0]
+        self.query = f"?fecha_inicio={fechas[0]}&fecha_fin={fechas[-1]}&puntos=8"
+        cache_evolucion().clear()
+
+    async def test_mismos_bytes_que_la_vista_sincrona(self):
+        for formato in ("json", "columnar", "binario"):
+            with self.subTest(formato=formato):
+                q = f"{self.query}&formato={formato}"
+                sinc = await self.async_client.get(reverse("evolucion-portafolio", args=[self.pf.id]) + q)
+                await cache_evolucion().aclear()
+                r = await self.async_client.get(reverse("evolucion-portafolio-async", args=[self.pf.id]) + q)
+                self.assertEqual(r.status_code, 200)
+                self.assertEqual(b"".join([parte async for parte in r.streaming_content]), sinc.content)
+                self.assertEqual(r["ETag"], sinc["ETag"])
+
+                r = await self.async_client.get(reverse("evolucion-portafolio-async", args=[self.pf.id]) + q,
+                                                headers={"If-None-Match": sinc["ETag"]})
+                self.assertEqual(r.status_code, 304)
+
+    async def test_materializada_en_una_lectura(self):
+        await sync_to_async(refrescar_valuaciones)()
+        q = f"{self.query}&formato=columnar"
+        sinc = await self.async_client.get(reverse("evolucion-portafolio", args=[self.pf.id]) + q)
+        await cache_evolucion().aclear()
+        with mock.patch("inversiones.valuacion.transaction.atomic", wraps=transaction.atomic) as atomic:
+            r = await self.async_client.get(reverse("evolucion-portafolio-async", args=[self.pf.id]) + q)
+            self.assertEqual(b"".join([parte async for parte in r.streaming_content]), sinc.content)
+        atomic.assert_called_once()
+
+    async def test_portafolio_inexistente(self):
+        r = await self.async_client.get(reverse("evolucion-portafolio-async", args=[9999]) + self.query)
+        self.assertEqual(r.status_code, 404)
+
+
+class AdminTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        portafolios, _, cls.fechas = poblar_base(n_activos=3, n_dias=70)
+        cls.pf = portafolios[0]
+        cls.usuario = User.objects.create_superuser("admin", "admin@example.com", "clave")
+
+    def setUp(self):
+        self.client.force_login(self.usuario)
+
+    @override_settings(ADMIN_CONTEO_EXACTO=50)
+    def test_paginacion_por_clave_y_conteo_estimado(self):
+        url, vistos, consultas = reverse("admin:inversiones_precio_changelist"), [], []
+        siguiente = ""
+        while siguiente is not None:
+            with CaptureQueriesContext(connection) as ctx:
+                r = self.client.get(url + siguiente)
+            consultas.append(len(ctx.captured_queries))
+            cl = r.context["cl"]
+            vistos += [(p.fecha, p.activo_id) for p in cl.result_list]
+            siguiente = cl.url_siguiente
+        self.assertContains(r, "≈ 210")
+        self.assertEqual(vistos, sorted(Precio.objects.values_list("fecha", "activo_id"), reverse=True))
+        self.assertEqual(len(set(consultas)), 1)  # sin una consulta por fila ni por página más profunda
+
+        anterior = self.client.get(url + cl.url_anterior).context["cl"]
+        self.assertEqual([(p.fecha, p.activo_id) for p in anterior.result_list], vistos[100:200])
+
+    def test_listados_y_autocompletado(self):
+        for modelo in ("activo", "portafolio", "precio", "operacion", "cantidad", "weight", "valorportafolio",
+                       "trabajo"):
+            with self.subTest(modelo=modelo):
+                self.assertEqual(self.client.get(reverse(f"admin:inversiones_{modelo}_changelist")).status_code, 200)
+        r = self.client.get(reverse("admin:autocomplete"), {"term": "A1", "app_label": "inversiones",
+                                                            "model_name": "precio", "field_name": "activo"})
+        self.assertEqual([x["text"] for x in r.json()["results"]], ["A1"])
+
+    def test_fechas_por_saltos(self):
+        qs = admin.FechasPorSaltosQuerySet(Precio)
+        for kind in ("year", "month", "day"):
+            self.assertEqual(list(qs.dates("fecha", kind)), list(Precio.objects.dates("fecha", kind)))
+        r = self.client.get(reverse("admin:inversiones_precio_changelist") + "?fecha__year=2015&fecha__month=2")
+        self.assertEqual({p.fecha.month for p in r.context["cl"].result_list}, {2})
+
+    def test_borrado_masivo_recalcula_una_vez(self):
+        refrescar_valuaciones()
+        self.assertTrue(ValorPortafolio.objects.filter(fecha__in=self.fechas[3:5]).exists())
+        versiones = lambda: dict(VersionDatos.objects.values_list("clave", "version"))
+        antes = versiones()
+        precios = Precio.objects.filter(fecha__in=self.fechas[3:5]).values_list("pk", flat=True)
+        operaciones = Operacion.objects.bulk_create([
+            Operacion(portafolio=self.pf, activo_id=aid, fecha=f, cantidad=Decimal("1"), tipo="compra")
+            for aid in Precio.objects.values_list("activo_id", flat=True).distinct() for f in self.fechas[5:8]
+        ])
+        for modelo, pks in (("precio", list(precios)), ("operacion", [o.pk for o in operaciones])):
+            self.client.post(reverse(f"admin:inversiones_{modelo}_changelist"),
+                             {"action": "delete_selected", "post": "yes", "_selected_action": pks})
+        despues = versiones()
+        self.assertEqual(despues["precios"], antes.get("precios", 0) + 1)
+        # la versión del portafolio la sube el trabajo encolado cuando recalcula
+        self.assertEqual(despues.get(f"pf:{self.pf.id}"), antes.get(f"pf:{self.pf.id}"))
+        trabajo = Trabajo.objects.get(portafolio=self.pf)
+        self.assertEqual(trabajo.parametros, {"desde": self.fechas[5].isoformat()})
+        self.assertFalse(ValorPortafolio.objects.filter(fecha__in=self.fechas[3:5]).exists())
+
+
+class ExportacionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        portafolios, cls.simbolos, cls.fechas = poblar_base(n_activos=3, n_dias=40, n_portafolios=2)
+        cls.pf = portafolios[0]
+        activo_id = Precio.objects.order_by("activo_id").values_list("activo_id", flat=True).first()
+        Precio.objects.filter(activo_id=activo_id, fecha__in=cls.fechas[10:13]).delete()  # hueco arrastrado
+        refrescar_valuaciones()
+
+    def exportar(self, **params):
+        r = self.client.get(reverse("exportar-evolucion"), params)
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r.streaming)
+        return r, b"".join(r.streaming_content)
+
+    def test_csv_coincide_con_la_valuacion(self):
+        _, contenido = self.exportar()
+        filas = list(csv.DictReader(StringIO(contenido.decode())))
+        esperadas = ValorActivo.objects.order_by("fecha", "portafolio_id", "activo_id")
+        self.assertEqual(len(filas), esperadas.count())
+        totales = dict(((pf_id, f.isoformat()), float(v))
+                       for pf_id, f, v in ValorPortafolio.objects.values_list("portafolio_id", "fecha", "valor_total"))
+        for fila, va in zip(filas, esperadas.values_list("portafolio_id", "fecha", "activo__simbolo", "valor",
+                                                         "weight")):
+            self.assertEqual((int(fila["portafolio"]), fila["fecha"], fila["activo"]), (va[0], va[1].isoformat(), va[2]))
+            self.assertAlmostEqual(float(fila["valor"]), va[3], delta=1e-6)
+            self.assertAlmostEqual(float(fila["weight"]), va[4], delta=1e-9)
+            self.assertAlmostEqual(float(fila["valor_total"]), totales[va[0], fila["fecha"]], delta=0.01)
+
+    def test_ndjson_filtra_portafolios_y_fechas(self):
+        r, contenido = self.exportar(formato="ndjson", ids=str(self.pf.id), fecha_inicio=self.fechas[11],
+                                     fecha_fin=self.fechas[20])
+        self.assertEqual(r["Content-Type"], "application/x-ndjson")
+        filas = [json.loads(linea) for linea in contenido.decode().splitlines()]
+        self.assertEqual(len(filas), 10 * 3)  # también el activo sin precio propio en el hueco
+        self.assertEqual({f["portafolio"] for f in filas}, {self.pf.id})
+        self.assertEqual(filas[0]["fecha"], self.fechas[11].isoformat())
+
+        no_modificado = self.client.get(reverse("exportar-evolucion"), {"formato": "ndjson"},
+                                        HTTP_IF_NONE_MATCH=self.exportar(formato="ndjson")[0]["ETag"])
+        self.assertEqual(no_modificado.status_code, 304)
+
+    def test_errores(self):
+        url = reverse("exportar-evolucion")
+        self.assertEqual(self.client.get(url, {"formato": "xml"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"fecha_inicio": "ayer"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"ids": f"{self.pf.id},999"}).status_code, 404)
+        self.assertEqual(self.client.get(url, {"ids": "1,dos"}).status_code, 400)
+        rango = {"fecha_inicio": self.fechas[0], "fecha_fin": self.fechas[-1]}
+        for nombre in ("evolucion-lote", "riesgo-lote"):  # mismo parseo de ids en las vistas de lote
+            r = self.client.get(reverse(nombre), {**rango, "ids": f"{self.pf.id},999"})
+            self.assertEqual(r.json(), {"detail": "Portafolios inexistentes: [999]."})
+
+    def test_bloques_no_cambian_el_archivo(self):
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        contenidos = []
+        for dias in ("1", "7", "250"):
+            path = os.path.join(directorio, f"evolucion-{dias}.csv")
+            call_command("exportar_evolucion", path, "--dias", dias, stdout=StringIO())
+            with open(path, "rb") as f:
+                contenidos.append(f.read())
+        self.assertEqual(contenidos[0], contenidos[1])
+        self.assertEqual(contenidos[0], contenidos[2])
+        self.assertEqual(contenidos[0], self.exportar()[1])
+        with self.assertRaises(CommandError):
+            call_command("exportar_evolucion", os.path.join(directorio, "x.csv"), "--desde", "ayer")
+
+    def test_parquet_igual_al_csv(self):
+        import pyarrow.parquet as pq
+
+        r, contenido = self.exportar(formato="parquet")
+        self.assertEqual(r["Content-Type"], "application/vnd.apache.parquet")
+        tabla = pq.read_table(BytesIO(contenido)).to_pandas()
+        self.assertEqual(list(tabla.columns), list(exportacion.COLUMNAS))
+        filas = list(csv.DictReader(StringIO(self.exportar()[1].decode())))
+        self.assertEqual(len(tabla), len(filas))
+        for fila, (pf_id, fecha, activo, valor, weight, total) in zip(filas, tabla.itertuples(index=False)):
+            self.assertEqual((fila["portafolio"], fila["fecha"], fila["activo"]), (str(pf_id), fecha.isoformat(), activo))
+            self.assertEqual([float(fila[c]) for c in ("valor", "weight", "valor_total")], [valor, weight, total])
+
+        directorio = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directorio)
+        path = os.path.join(directorio, "evolucion.parquet")
+        call_command("exportar_evolucion", path, "--dias", "7", stdout=StringIO())
+        archivo = pq.ParquetFile(path)
+        self.assertEqual(archivo.num_row_groups, 6)  # un row group por bloque de 7 de las 40 fechas
+        self.assertTrue(archivo.read().to_pandas().equals(tabla))
+
+
+@tag("benchmark")
+class SuiteBenchmarkTests(TestCase):
+    """
+    Corre la suite de benchmarks con escenarios mínimos. Además de verificar que
+    funciona, exige que las lecturas de la API no hagan más consultas con más
+    datos (``python manage.py test --tag benchmark`` la corre sola).
+    """
+
+    def suite(self, n_activos, n_dias, n_operaciones):
+        with transaction.atomic():
+            resultados = ejecutar_suite(n_activos, n_dias, n_portafolios=2,
+                                        n_operaciones=n_operaciones, repeticiones=2)
+            transaction.set_rollback(True)
+        return resultados
+
+    def test_consultas_no_crecen_con_los_datos(self):
+        chico = self.suite(n_activos=3, n_dias=20, n_operaciones=10)
+        grande = self.suite(n_activos=6, n_dias=40, n_operaciones=40)
+        json.dumps(grande)  # la salida debe poder guardarse como JSON
+        for caso in ("evolucion", "evolucion_cache", "evolucion_lote"):
+            with self.subTest(caso=caso):
+                self.assertEqual(chico[caso]["consultas"], grande[caso]["consultas"])
+                self.assertLessEqual(grande[caso]["p50_ms"], grande[caso]["p95_ms"])
+        # las escrituras crecen solo por lotes de bulk_create, nunca por fila
+        self.assertLess(grande["registrar_operaciones"]["consultas"], 40)
+
+    def test_comparar_resultados(self):
+        base = {"resultados": {"evolucion": {"p50_ms": 10.0, "p95_ms": 12.0, "consultas": 4,
+                                             "memoria_pico_mb": 5.0}}}
+        actual = {"resultados": {"evolucion": {"p50_ms": 13.0, "p95_ms": 12.5, "consultas": 5,
+                                               "memoria_pico_mb": 5.0}}}
+        regresiones = {(c, m) for c, m, *_, r in comparar_resultados(base, actual, umbral=0.2) if r}
+        self.assertEqual(regresiones, {("evolucion", "p50_ms"), ("evolucion", "consultas")})
@@ -0,0 +1,232 @@
+# inversiones/trabajos.py
+"""
+Cola de trabajos en segundo plano guardada en la base de datos (``Trabajo``).
+
+La API y ``import_datos --encolar`` encolan y responden enseguida (202 con el
+id del trabajo); ``python manage.py procesar_trabajos`` los toma en orden y los
+ejecuta. La toma es un UPDATE condicional sobre el estado, así que pueden
+correr varios workers a la vez sin ejecutar dos veces el mismo trabajo.
+
+Los recálculos pendientes de un mismo portafolio se fusionan: a lo más hay uno
+pendiente por portafolio (restricción ``trabajo_pendiente_unico``) y un pedido
+nuevo solo adelanta su fecha ``desde`` y suma una solicitud.
+
+El estado de un trabajo en curso, con su avance, se publica en un archivo JSON
+en ``TRABAJOS_DIR`` y no en la base: una importación grande tiene tomado el
+lock de SQLite durante su transacción (al volcar páginas a disco bloquea
+incluso las lecturas) y ni el worker podría escribir el avance ni la API leerlo.
+"""
+import json
+import os
+import time
+import traceback
+import uuid
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .bloqueos import reintentar_si_bloqueada
+from .cache import invalidar
+from .models import Trabajo
+from .valuacion import refrescar_valuaciones
+
+INTERVALO_PROGRESO = 0.5  # segundos mínimos entre escrituras del archivo de avance
+
+
+def directorio(*partes):
+    """Subdirectorio de ``TRABAJOS_DIR`` (lo crea si no existe)."""
+    ruta = os.path.join(str(settings.TRABAJOS_DIR), *partes)
+    os.makedirs(ruta, exist_ok=True)
+    return ruta
+
+
+def _ruta_progreso(trabajo_id):
+    return os.path.join(directorio("progreso"), f"{trabajo_id}.json")
+
+
+# ---------------------------------------------------------------------------
+# Encolar
+# ---------------------------------------------------------------------------
+
+def encolar_recalculo(pf_id, desde=None):
+    """
+    Encola el recálculo de las valuaciones de ``pf_id`` desde ``desde`` (None:
+    toda la historia), o lo fusiona con el que ya está pendiente. Devuelve el
+    ``Trabajo``. Llamar dentro de la transacción que modifica los datos: el
+    worker no lo ve hasta que se confirma.
+    """
+    nuevo = desde.isoformat() if desde is not None else None
+    while True:
+        pendiente = Trabajo.objects.filter(tipo=Trabajo.RECALCULAR, portafolio_id=pf_id,
+                                           estado=Trabajo.PENDIENTE).first()
+        if pendiente is not None:
+            previo = pendiente.parametros.get("desde")
+            # None es "toda la historia" y gana; las fechas ISO se comparan como texto
+            desde_fusion = None if previo is None or nuevo is None else min(previo, nuevo)
+            fusionado = Trabajo.objects.filter(pk=pendiente.pk, estado=Trabajo.PENDIENTE).update(
+                parametros={"desde": desde_fusion}, solicitudes=F("solicitudes") + 1,
+            )
+            if fusionado:
+                pendiente.refresh_from_db()
+                return pendiente
+            continue  # un worker lo tomó entre la lectura y el UPDATE
+        try:
+            with transaction.atomic():
+                return Trabajo.objects.create(tipo=Trabajo.RECALCULAR, portafolio_id=pf_id,
+                                              parametros={"desde": nuevo})
+        except IntegrityError:
+            continue  # otro pedido creó el pendiente a la vez: fusionarse con él
+
+
+@reintentar_si_bloqueada
+def encolar_importacion(archivo, opciones=None, temporal=False):
+    """
+    Encola ``import_datos archivo`` con ``opciones`` (nombres de destino del
+    comando, p. ej. ``{"delta": True}``). Con ``temporal`` el worker borra el
+    archivo y el de weights al terminar (subidas por la API).
+    """
+    return Trabajo.objects.create(tipo=Trabajo.IMPORTAR, parametros={
+        "archivo": os.path.abspath(archivo), "opciones": opciones or {}, "temporal": temporal,
+    })
+
+
+def guardar_subida(archivo_subido):
+    """Copia un archivo subido a ``TRABAJOS_DIR/archivos`` y devuelve su ruta."""
+    _, extension = os.path.splitext(archivo_subido.name)
+    ruta = os.path.join(directorio("archivos"), f"{uuid.uuid4().hex}{extension.lower()}")
+    with open(ruta, "wb") as f:
+        for trozo in archivo_subido.chunks():
+            f.write(trozo)
+    return ruta
+
+
+# ---------------------------------------------------------------------------
+# Avance
+# ---------------------------------------------------------------------------
+
+class Progreso:
+    """
+    Publica el estado de un trabajo en curso, con su avance, en el archivo del
+    trabajo (a lo más cada ``INTERVALO_PROGRESO``).
+    """
+
+    def __init__(self, trabajo):
+        self.ruta = _ruta_progreso(trabajo.id)
+        self.base = describir(trabajo)
+        self.ultimo = 0.0
+
+    def __call__(self, avance, total=None, mensaje="", forzar=False):
+        ahora = time.monotonic()
+        if not forzar and ahora - self.ultimo < INTERVALO_PROGRESO:
+            return
+        self.ultimo = ahora
+        temporal = f"{self.ruta}.{os.getpid()}.tmp"
+        with open(temporal, "w") as f:
+            json.dump({**self.base, "progreso": {"avance": avance, "total": total, "mensaje": mensaje,
+                                                 "actualizado": timezone.now().isoformat()}}, f)
+        os.replace(temporal, self.ruta)
+
+    def descartar(self):
+        try:
+            os.remove(self.ruta)
+        except FileNotFoundError:
+            pass
+
+
+def leer_en_curso(trabajo_id):
+    """
+    Estado publicado por ``Progreso`` si el trabajo está en curso, o None. No
+    consulta la base, que una importación puede tener bloqueada.
+    """
+    try:
+        with open(_ruta_progreso(trabajo_id)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _iso(momento):
+    return momento.isoformat() if momento else None
+
+
+def describir(trabajo):
+    """Estado del trabajo para la API (el avance solo mientras está en curso)."""
+    return {
+        "id": trabajo.id,
+        "tipo": trabajo.tipo,
+        "estado": trabajo.estado,
+        "portafolio": trabajo.portafolio_id,
+        "parametros": trabajo.parametros,
+        "solicitudes": trabajo.solicitudes,
+        "creado": _iso(trabajo.creado),
+        "iniciado": _iso(trabajo.iniciado),
+        "terminado": _iso(trabajo.terminado),
+        "progreso": (leer_en_curso(trabajo.id) or {}).get("progreso") if trabajo.estado == Trabajo.EN_CURSO else None,
+        "resultado": trabajo.resultado,
+        "error": trabajo.error or None,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Worker
+# ---------------------------------------------------------------------------
+
+@reintentar_si_bloqueada
+def tomar_siguiente():
+    """Marca en curso el pendiente más antiguo y lo devuelve, o None si la cola está vacía."""
+    while True:
+        candidato = (Trabajo.objects.filter(estado=Trabajo.PENDIENTE).order_by("id")
+                     .values_list("id", flat=True).first())
+        if candidato is None:
+            return None
+        if Trabajo.objects.filter(pk=candidato, estado=Trabajo.PENDIENTE).update(
+                estado=Trabajo.EN_CURSO, iniciado=timezone.now()):
+            return Trabajo.objects.get(pk=candidato)
+
+
+@reintentar_si_bloqueada
+def _recalcular(trabajo, progreso):
+    desde = parse_date(trabajo.parametros["desde"]) if trabajo.parametros.get("desde") else None
+    progreso(0, 1, "Recalculando valuaciones", forzar=True)
+    with transaction.atomic():
+        filas = refrescar_valuaciones([trabajo.portafolio_id], desde=desde)
+        invalidar(pf_ids=[trabajo.portafolio_id])
+    return {"filas_valor_portafolio": filas}
+
+
+def _importar(trabajo, progreso):
+    parametros = trabajo.parametros
+    salida = StringIO()
+    try:
+        progreso(0, None, "Leyendo precios", forzar=True)
+        call_command("import_datos", parametros["archivo"], stdout=salida, progreso=progreso,
+                     **parametros.get("opciones", {}))
+    finally:
+        if parametros.get("temporal"):
+            for ruta in (parametros["archivo"], parametros.get("opciones", {}).get("weights_path")):
+                if ruta and os.path.exists(ruta):
+                    os.remove(ruta)
+    return {"salida": salida.getvalue().strip()}
+
+
+EJECUTORES = {Trabajo.RECALCULAR: _recalcular, Trabajo.IMPORTAR: _importar}
+
+
+def ejecutar(trabajo):
+    """Ejecuta un trabajo ya tomado y guarda el resultado o el error. Devuelve True si terminó bien."""
+    progreso = Progreso(trabajo)
+    try:
+        resultado = EJECUTORES[trabajo.tipo](trabajo, progreso)
+    except Exception as e:
+        trabajo.estado, trabajo.error = Trabajo.FALLIDO, f"{e}\n\n{traceback.format_exc()}"
+    else:
+        trabajo.estado, trabajo.resultado = Trabajo.COMPLETADO, resultado
+    trabajo.terminado = timezone.now()
+    reintentar_si_bloqueada(trabajo.save)(update_fields=["estado", "resultado", "error", "terminado"])
+    progreso.descartar()  # después de guardar: quien consulta siempre ve el archivo o el estado final
+    return trabajo.estado == Trabajo.COMPLETADO
@@ -1,9 +1,23 @@
 # inversiones/urls.py
 from django.urls import path
-from .views import EvolucionPortafolioAPIView, viz_evolucion, RegistrarOperacionAPIView
+from .views import (
+    AnaliticaPortafolioAPIView, BacktestPortafolioAPIView, EvolucionLoteAPIView, EvolucionPortafolioAPIView, viz_evolucion,
+    ExportacionAPIView, ImportacionAPIView, RegistrarOperacionAPIView, RiesgoLoteAPIView, TrabajoAPIView,
+)
+from .asincrono import EvolucionPortafolioAsyncView, viz_evolucion_async
 
 urlpatterns = [
     path('portafolios/<int:pf_id>/evolucion/', EvolucionPortafolioAPIView.as_view(), name='evolucion-portafolio'),
+    path('portafolios/evolucion/', EvolucionLoteAPIView.as_view(), name='evolucion-lote'),
+    path('portafolios/exportar/', ExportacionAPIView.as_view(), name='exportar-evolucion'),
+    path('portafolios/riesgo/', RiesgoLoteAPIView.as_view(), name='riesgo-lote'),
+    path('portafolios/<int:pf_id>/analitica/', AnaliticaPortafolioAPIView.as_view(), name='analitica-portafolio'),
+    path('portafolios/<int:pf_id>/backtest/', BacktestPortafolioAPIView.as_view(), name='backtest-portafolio'),
     path('viz/', viz_evolucion, name='viz-evolucion'),
     path('portafolios/<int:pf_id>/operaciones/', RegistrarOperacionAPIView.as_view(), name='registro-operaciones'),
+    path('importaciones/', ImportacionAPIView.as_view(), name='importaciones'),
+    path('trabajos/<int:trabajo_id>/', TrabajoAPIView.as_view(), name='estado-trabajo'),
+    path('async/portafolios/<int:pf_id>/evolucion/', EvolucionPortafolioAsyncView.as_view(),
+         name='evolucion-portafolio-async'),
+    path('async/viz/', viz_evolucion_async, name='viz-evolucion-async'),
 ]
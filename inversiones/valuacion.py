@@ -0,0 +1,160 @@
+# inversiones/valuacion.py
+"""
+Tabla materializada de valuaciones diarias.
+
+``ValorPortafolio`` guarda V_t y ``ValorActivo`` guarda x_{i,t} y w_{i,t} por
+(portafolio, fecha). ``EvolucionPortafolioAPIView`` lee directamente de ellas;
+este módulo las mantiene al día recalculando solo las fechas afectadas.
+"""
+import numpy as np
+from django.db import transaction
+
+from . import micro
+from .models import ValorActivo, ValorPortafolio
+from .calendario import cargar_asof
+from .portafolio import cargar_libros, evolucion
+
+BATCH_SIZE = 2000
+
+
+def _en_bloques(items, n=500):
+    items = list(items)
+    for i in range(0, len(items), n):
+        yield items[i:i + n]
+
+
+def refrescar_valuaciones(portafolio_ids=None, fechas=None, desde=None):
+    """
+    Recalcula las valuaciones materializadas.
+
+    - ``portafolio_ids``: portafolios a recalcular (None = todos los que tienen
+      Cantidad u Operacion).
+    - ``fechas``: conjunto explícito de fechas afectadas (p. ej. precios nuevos).
+      También se recalculan las fechas posteriores en que algún activo vale,
+      arrastrado, un precio de una fecha afectada.
+    - ``desde``: recalcula desde esa fecha en adelante.
+    Sin ``fechas`` ni ``desde`` se reconstruye la historia completa. El
+    recálculo incremental solo toca los portafolios que ya tienen valuaciones:
+    en uno sin materializar dejaría unas pocas fechas que la API tomaría por la
+    historia completa, así que sigue calculándose en línea hasta reconstruirlo.
+
+    Los precios de todos los activos involucrados se cargan una sola vez y cada
+    portafolio se valoriza con el motor vectorizado, usando en cada fecha las
+    cantidades vigentes según su ``LibroPosiciones``. Devuelve el número de
+    filas de ``ValorPortafolio`` escritas.
+    """
+    libros = cargar_libros(portafolio_ids)
+    if libros and (fechas is not None or desde is not None):
+        materializados = set(ValorPortafolio.objects.filter(portafolio_id__in=list(libros))
+                             .values_list("portafolio_id", flat=True).distinct())
+        libros = {pf_id: libro for pf_id, libro in libros.items() if pf_id in materializados}
+    if not libros:
+        return 0
+
+    fechas = sorted(set(fechas)) if fechas is not None else None
+    if fechas == []:
+        return 0
+    fi = fechas[0] if fechas else desde
+
+    activo_ids = sorted({aid for libro in libros.values() for aid in libro.activo_ids})
+    col = {aid: j for j, aid in enumerate(activo_ids)}
+    fechas_P, P, U = cargar_asof(activo_ids, fi, None)
+    if fechas is not None:
+        objetivo = set(fechas)
+        afectadas = np.fromiter((f in objetivo for f in fechas_P), dtype=bool, count=len(fechas_P))
+        # el índice as-of dice qué fechas posteriores arrastran un precio de una fecha afectada
+        afectadas |= ((U >= 0) & afectadas[np.maximum(U, 0)]).any(axis=1)
+        filas = np.flatnonzero(afectadas)
+        fechas_P, P = [fechas_P[k] for k in filas.tolist()], P[filas]
+        fechas = sorted(objetivo.union(fechas_P))
+
+    valores, posiciones = [], []
+    for pf_id, libro in libros.items():
+        aids = libro.activo_ids
+        cols = [col[aid] for aid in aids]
+        # cantidades vigentes en cada fecha (as-of sobre el libro de operaciones)
+        X, Vt, W = evolucion(P[:, cols], libro.cantidades(fechas_P))
+        presentes = ~np.isnan(X)
+        ks = np.flatnonzero(presentes.any(axis=1))
+        # centavos enteros: sin Decimal intermedio por fila
+        totales = micro.a_decimal(micro.redondear(Vt[ks], 2), 2)
+        for k, total in zip(ks.tolist(), totales):
+            valores.append(ValorPortafolio(portafolio_id=pf_id, fecha=fechas_P[k], valor_total=total))
+        ks, js = np.nonzero(presentes)
+        for k, j, x, w in zip(ks.tolist(), js.tolist(), X[ks, js].tolist(), W[ks, js].tolist()):
+            posiciones.append(ValorActivo(
+                portafolio_id=pf_id, activo_id=aids[j], fecha=fechas_P[k],
+                valor=x, weight=None if w != w else w,
+            ))
+
+    with transaction.atomic():
+        for model in (ValorActivo, ValorPortafolio):
+            qs = model.objects.filter(portafolio_id__in=list(libros))
+            if fechas is not None:
+                for bloque in _en_bloques(fechas):
+                    qs.filter(fecha__in=bloque).delete()
+            elif desde is not None:
+                qs.filter(fecha__gte=desde).delete()
+            else:
+                qs.delete()
+        ValorPortafolio.objects.bulk_create(valores, batch_size=BATCH_SIZE)
+        ValorActivo.objects.bulk_create(posiciones, batch_size=BATCH_SIZE)
+    return len(valores)
+
+
+def a_centavos(Vt):
+    """
+    V_t redondeado a centavos como lo guarda ``ValorPortafolio.valor_total``
+    (float64). El cálculo en línea de la evolución lo aplica para devolver los
+    mismos números que las valuaciones materializadas; los weights quedan sin
+    redondear en ambos caminos.
+    """
+    return micro.redondear(Vt, 2) / 100
+
+
+def filas_valor_portafolio(pf_id, fi, ff):
+    return list(ValorPortafolio.objects
+                .filter(portafolio_id=pf_id, fecha__range=(fi, ff))
+                .order_by("fecha").values_list("fecha", "valor_total"))
+
+
+def filas_valor_activo(pf_id, fi, ff):
+    return list(ValorActivo.objects
+                .filter(portafolio_id=pf_id, fecha__range=(fi, ff))
+                .order_by("fecha", "activo_id").values_list("fecha", "activo_id", "activo__simbolo", "weight"))
+
+
+def armar_evolucion(vt_rows, w_rows):
+    """Arma ``(fechas, simbolos, Vt, W)`` a partir de las filas materializadas, o None si no hay."""
+    if not w_rows:
+        return None
+
+    fechas = [f for f, _ in vt_rows]
+    Vt = np.fromiter((float(v) for _, v in vt_rows), dtype=np.float64, count=len(vt_rows))
+    simbolo_de = {aid: simbolo for _, aid, simbolo, _ in w_rows}
+    activo_ids = sorted(simbolo_de)
+    fila = {f: k for k, f in enumerate(fechas)}
+    col = {aid: j for j, aid in enumerate(activo_ids)}
+
+    W = np.full((len(fechas), len(activo_ids)), np.nan)
+    for fch, aid, _, w in w_rows:
+        if w is not None:  # None: V_t = 0 ese día
+            W[fila[fch], col[aid]] = w
+    return fechas, [simbolo_de[aid] for aid in activo_ids], Vt, W
+
+
+def leer_evolucion(pf_id, fi, ff):
+    """
+    Lee V_t y w_{i,t} materializados en [fi, ff] en forma columnar:
+    ``(fechas, simbolos, Vt, W)`` con ``W`` de fechas × activos (NaN donde el
+    activo no tiene peso ese día). Devuelve None si el portafolio no tiene
+    valuaciones en el rango. Las dos tablas se leen en una transacción, así un
+    ``refrescar_valuaciones`` que se confirma entre ambas lecturas no deja
+    fechas de W sin su V_t.
+    """
+    with transaction.atomic():
+        w_rows = filas_valor_activo(pf_id, fi, ff)
+        if not w_rows:
+            return None
+        vt_rows = filas_valor_portafolio(pf_id, fi, ff)
+    return armar_evolucion(vt_rows, w_rows)
@@ -1,18 +1,43 @@
 # inversiones/views.py
+import base64
+import os
 import json  # Importa el módulo json para cargar los datos JSON
+from collections import defaultdict
+from decimal import Decimal
+import numpy as np
+from django.conf import settings
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views import View
+from django.urls import reverse
 from django.utils.dateparse import parse_date
 from django.db import transaction
-from django.db.models import F  # Asegúrate de importar 'F'
-from .models import Operacion, Cantidad, Portafolio, Activo, Precio
+from .models import Operacion, Portafolio, Activo, Precio, Trabajo
+from .importacion import FORMATOS
+from .operaciones import BATCH_SIZE, aplicar_deltas, validar_operacion
+from .portafolio import (
+    FRECUENCIAS, cargar_libros, cargar_matriz_precios, evolucion, evolucion_lote, indices_lttb,
+    indices_remuestreo,
+)
+from .valuacion import a_centavos, leer_evolucion, refrescar_valuaciones
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
-from decimal import Decimal
+from . import analitica, backtest, cache, escenarios, exportacion, formatos, trabajos
+from .bloqueos import reintentar_si_bloqueada
+from .metricas import REGISTRO, seccion
 
 class RegistrarOperacionAPIView(View):
+    """
+    POST /api/portafolios/<pf_id>/operaciones/[?parcial=1][&asincrono=1]
+    Registra un lote de operaciones en forma set-based: resuelve todos los
+    símbolos en una consulta, agrega el neto por activo en memoria y lo aplica
+    con un único UPDATE. Valida todas las filas y reporta los errores por fila;
+    con ``parcial=1`` registra las filas válidas en vez de rechazar el lote.
+    Con ``asincrono=1`` el recálculo de las valuaciones se encola (202 con el
+    trabajo; los pedidos que llegan antes de que corra se fusionan en él).
+    """
     @method_decorator(csrf_exempt)  # Desactiva CSRF para esta vista
+    @method_decorator(reintentar_si_bloqueada)  # repite el lote completo si la base está bloqueada
     def post(self, request, pf_id: int):
         try:
             # Usa json.loads para parsear el cuerpo de la solicitud
@@ -20,149 +45,638 @@ class RegistrarOperacionAPIView(View):
         except json.JSONDecodeError:
             return JsonResponse({"detail": "Formato JSON incorrecto."}, status=400)
 
-        if not isinstance(data, list):
+        if not isinstance(data, list) or not data:
             return JsonResponse({"detail": "Formato de datos incorrecto."}, status=400)
 
-        operaciones = []
+        try:
+            pf = Portafolio.objects.get(pk=pf_id)
+        except Portafolio.DoesNotExist:
+            return JsonResponse({"detail": f"Portafolio {pf_id} no existe."}, status=404)
+        parcial = request.GET.get("parcial", "").lower() in ("1", "true")
+        asincrono = request.GET.get("asincrono", "").lower() in ("1", "true")
+
+        # Todos los símbolos del lote en una sola consulta
+        simbolos = {op.get("activo") for op in data if isinstance(op, dict) and isinstance(op.get("activo"), str)}
+        activos = dict(Activo.objects.filter(simbolo__in=list(simbolos)).values_list("simbolo", "id"))
+
+        operaciones, errores = [], []
+        deltas = defaultdict(Decimal)  # activo_id -> neto de compras y ventas
+        for fila, op in enumerate(data):
+            op_validada, error = validar_operacion(op, activos)
+            if error:
+                errores.append({"fila": fila, "detail": error})
+                continue
+            activo_id, fecha, cantidad, tipo = op_validada
+            deltas[activo_id] += cantidad if tipo == "compra" else -cantidad
+            operaciones.append(Operacion(portafolio=pf, activo_id=activo_id, fecha=fecha,
+                                         cantidad=cantidad, tipo=tipo))
+
+        if errores and not parcial:
+            return JsonResponse({"detail": "Operaciones inválidas; no se registró ninguna.",
+                                 "errores": errores}, status=400)
+        if not operaciones:
+            return JsonResponse({"detail": "No hay operaciones válidas.", "errores": errores}, status=400)
+
         with transaction.atomic():
-            for op in data:
-                try:
-                    pf = Portafolio.objects.get(id=pf_id)
-                    activo = Activo.objects.get(simbolo=op["activo"])
-                    fecha = op["fecha"]
-                    cantidad = op["cantidad"]
-                    tipo = op["tipo"]
-
-                    if tipo == "compra":
-                        # Aumentar cantidad de activo en portafolio
-                        Cantidad.objects.filter(portafolio=pf, activo=activo).update(cantidad=F('cantidad') + cantidad)
-                    elif tipo == "venta":
-                        # Reducir cantidad de activo en portafolio
-                        Cantidad.objects.filter(portafolio=pf, activo=activo).update(cantidad=F('cantidad') - cantidad)
-
-                    # Registrar operación "crea objeto"
-                    operaciones.append(Operacion(portafolio=pf, activo=activo, fecha=fecha, cantidad=cantidad, tipo=tipo))
-
-                except Exception as e:
-                    return JsonResponse({"detail": str(e)}, status=400)
-            #inserta la operación en la base de datos
-            Operacion.objects.bulk_create(operaciones)
-
-            # Recalcular C_{i,t}, w_{i,t}, y V_t después de cada operación
-            self.recalcular_portafolio(pf)
-
-        return JsonResponse({"detail": "Operaciones registradas y portafolio recalculado."}, status=201)
-
-    def recalcular_portafolio(self, pf: Portafolio):
+            aplicar_deltas(pf, deltas)
+            #inserta las operaciones en la base de datos
+            Operacion.objects.bulk_create(operaciones, batch_size=BATCH_SIZE)
+
+            # Recalcular w_{i,t} y V_t materializados desde la primera operación
+            desde = min(o.fecha for o in operaciones)
+            if asincrono:
+                # la caché la invalida el trabajo al recalcular: hacerlo ahora guardaría las
+                # valuaciones viejas bajo la versión nueva
+                trabajo = trabajos.encolar_recalculo(pf.id, desde)
+            else:
+                self.recalcular_portafolio(pf, desde)
+                cache.invalidar(pf_ids=[pf.id])
+
+        if asincrono:
+            return respuesta_encolada(trabajo, {"detail": "Operaciones registradas; recálculo encolado.",
+                                                "registradas": len(operaciones), "errores": errores})
+        return JsonResponse({"detail": "Operaciones registradas y portafolio recalculado.",
+                             "registradas": len(operaciones), "errores": errores}, status=201)
+
+    def recalcular_portafolio(self, pf: Portafolio, desde):
         """
-        Recalcula las cantidades, los pesos y el valor total del portafolio.
+        Recalcula los pesos y el valor total materializados del portafolio.
+        Cada operación rige desde su fecha, así que solo se recalculan las
+        fechas >= ``desde`` (la operación más antigua del lote). El libro de
+        posiciones y los precios se cargan con un número fijo de consultas.
         """
-        # Obtenemos todas las cantidades actualizadas
-        cantidades = Cantidad.objects.filter(portafolio=pf).select_related("activo")
-        activos = {c.activo_id: c for c in cantidades}
+        refrescar_valuaciones([pf.id], desde=desde)
 
-        # Calculamos el valor total V_t para cada fecha
-        for cantidad in cantidades:
-            activo = cantidad.activo
-            precios = Precio.objects.filter(activo=activo)
+LIMITE_MAX = 10000
+
+
+def codificar_cursor(fecha):
+    return base64.urlsafe_b64encode(fecha.isoformat().encode()).decode().rstrip("=")
+
+
+def decodificar_cursor(cursor):
+    try:
+        return parse_date(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode())
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def parametros_muestreo(params):
+    """Valida freq/puntos/limite/cursor. Devuelve ``(opciones, mensaje_error)``."""
+    opciones = {"freq": params.get("freq") or None, "puntos": None, "limite": None, "cursor": None}
+    if opciones["freq"] and opciones["freq"] not in FRECUENCIAS:
+        return None, f"freq debe ser uno de: {', '.join(FRECUENCIAS)}."
+    for nombre, minimo, maximo in (("puntos", 3, None), ("limite", 1, LIMITE_MAX)):
+        valor = params.get(nombre)
+        if not valor:
+            continue
+        try:
+            opciones[nombre] = int(valor)
+        except ValueError:
+            return None, f"{nombre} debe ser un entero."
+        if opciones[nombre] < minimo or (maximo and opciones[nombre] > maximo):
+            return None, f"{nombre} debe estar entre {minimo} y {maximo or 'infinito'}."
+    if params.get("cursor"):
+        opciones["cursor"] = decodificar_cursor(params["cursor"])
+        if opciones["cursor"] is None:
+            return None, "cursor inválido."
+    return opciones, None
+
+
+def muestrear_y_paginar(fechas, Vt, opciones):
+    """
+    Aplica remuestreo por período, reducción LTTB y paginación por cursor.
+    Devuelve ``(indices, siguiente)``: las filas a enviar y el cursor de la
+    próxima página (None si no hay más).
+    """
+    idx = np.arange(len(fechas))
+    if opciones["freq"]:
+        idx = indices_remuestreo(fechas, opciones["freq"])
+    if opciones["puntos"]:
+        x = [fechas[i].toordinal() for i in idx]
+        idx = idx[indices_lttb(Vt[idx], opciones["puntos"], x)]
+
+    siguiente = None
+    if opciones["cursor"]:
+        idx = idx[np.array([fechas[i] > opciones["cursor"] for i in idx], dtype=bool)]
+    if opciones["limite"] and len(idx) > opciones["limite"]:
+        idx = idx[:opciones["limite"]]
+        siguiente = codificar_cursor(fechas[idx[-1]])
+    return idx, siguiente
+
+
+def parametros_evolucion(request, validos=tuple(formatos.TIPOS)):
+    """
+    Valida los parámetros de la API de evolución (fechas, muestreo, paginación y
+    formato, entre ``validos``). Devuelve ``(fi, ff, opciones, None)`` o
+    ``(None, None, None, respuesta_400)``.
+    """
+    fecha_inicio = request.GET.get("fecha_inicio")
+    fecha_fin = request.GET.get("fecha_fin")
 
-            # Recalcular los pesos w_{i,t} y el valor total V_t
-            for precio in precios:
-                xi = precio.precio * cantidad.cantidad
-                Vt = sum([p.precio * c.cantidad for c, p in zip(cantidades, precios)])
+    # Validación básica de fechas
+    try:
+        fi = parse_date(fecha_inicio) if fecha_inicio else None
+        ff = parse_date(fecha_fin) if fecha_fin else None
+    except Exception:
+        return None, None, None, JsonResponse({"detail": "Parámetros de fecha inválidos."}, status=400)
+    if not fi or not ff or fi > ff:
+        return None, None, None, JsonResponse(
+            {"detail": "Debe enviar fecha_inicio y fecha_fin válidas (YYYY-MM-DD) y fi <= ff."},
+            status=400
+        )
 
-                # Actualizar los pesos y cantidades
-                w = xi / Vt if Vt != 0 else 0
+    opciones, error = parametros_muestreo(request.GET)
+    if error:
+        return None, None, None, JsonResponse({"detail": error}, status=400)
+    opciones["formato"] = formatos.negociar(request, validos)
+    if opciones["formato"] is None:
+        return None, None, None, JsonResponse(
+            {"detail": f"formato debe ser uno de: {', '.join(validos)}."}, status=400
+        )
+    return fi, ff, opciones, None
+
+
+def parsear_ids(request):
+    """
+    Portafolios del parámetro ``ids`` (enteros separados por coma; todos si no
+    viene) como ``[(id, nombre)]`` ordenados por id. Devuelve
+    ``(portafolios, None)`` o ``(None, respuesta)``: 400 si ``ids`` no es una
+    lista de enteros, 404 si alguno no existe.
+    """
+    qs = Portafolio.objects.order_by("id")
+    ids = None
+    if request.GET.get("ids"):
+        try:
+            ids = {int(x) for x in request.GET["ids"].split(",")}
+        except ValueError:
+            return None, JsonResponse({"detail": "ids debe ser una lista de enteros separados por coma."}, status=400)
+        qs = qs.filter(id__in=ids)
+    portafolios = list(qs.values_list("id", "nombre"))
+    faltantes = sorted(ids - {pf_id for pf_id, _ in portafolios}) if ids is not None else []
+    if faltantes:
+        return None, JsonResponse({"detail": f"Portafolios inexistentes: {faltantes}."}, status=404)
+    return portafolios, None
+
+
+def precios_y_cantidades(pf_id, fi, ff):
+    """
+    Insumos del cálculo en línea: ``(simbolos, fechas, P, Q)`` con la matriz de
+    precios en [fi, ff] y las cantidades vigentes en cada fecha, o una respuesta
+    400 si el portafolio no tiene cantidades o no hay precios en el rango.
+    """
+    libro = cargar_libros([pf_id]).get(pf_id)
+    if libro is None:
+        return JsonResponse(
+            {"detail": "No hay cantidades (C_{i,0}) para este portafolio. Ejecute calc_cantidades_iniciales."},
+            status=400
+        )
+
+    activo_ids = libro.activo_ids
+    simbolos_map = dict(Activo.objects.filter(id__in=activo_ids).values_list("id", "simbolo"))
+    simbolos = [simbolos_map[aid] for aid in activo_ids]
+
+    # Precios en rango para esos activos (matriz fechas × activos)
+    fechas, P = cargar_matriz_precios(activo_ids, fi, ff)
+    if not fechas:
+        return JsonResponse({"detail": "No hay precios para el rango solicitado."}, status=400)
+    return simbolos, fechas, P, libro.cantidades(fechas)
 
-                # Actualizamos los datos en la base de datos
-                Cantidad.objects.filter(portafolio=pf, activo=activo).update(cantidad=xi)  # Eliminado 'fecha'
-                # Aquí puedes también actualizar el valor total en alguna tabla si es necesario
 
 class EvolucionPortafolioAPIView(View):
     """
     GET /api/portafolios/<pf_id>/evolucion/?fecha_inicio=YYYY-MM-DD&fecha_fin=YYYY-MM-DD
-    Devuelve Vt y w_{i,t} para el rango solicitado.
+        [&freq=W|M|Q] [&puntos=N] [&limite=N&cursor=...]
+    Devuelve Vt y w_{i,t} para el rango solicitado. ``freq`` remuestrea al cierre
+    de cada semana/mes/trimestre y ``puntos`` reduce V_t a N puntos con LTTB,
+    así el tamaño depende del ancho del gráfico y no del largo de la historia.
+    ``limite`` pagina por fecha; ``siguiente`` trae el cursor de la próxima página.
+    ``formato=columnar|binario`` (o ``Accept``) elige la serialización, ver
+    ``inversiones/formatos.py``.
+    Las respuestas se guardan en caché por versión de datos y llevan ETag
+    (If-None-Match -> 304).
     """
     def get(self, request, pf_id: int):
-        fecha_inicio = request.GET.get("fecha_inicio")
-        fecha_fin = request.GET.get("fecha_fin")
+        fi, ff, opciones, error = parametros_evolucion(request)
+        if error is not None:
+            return error
+
+        # Caché por versión de datos: el ETag cambia cuando cambian precios u operaciones
+        params = {**request.GET.dict(), "formato": opciones["formato"]}
+        clave = cache.clave_respuesta("evolucion", pf_id, params, cache.version_datos(pf_id))
+        return cache.respuesta_con_cache(request, clave, lambda: self._calcular(pf_id, fi, ff, opciones),
+                                         content_type=formatos.TIPOS[opciones["formato"]], vary="Accept")
 
-        # Validación básica de fechas
+    def _calcular(self, pf_id, fi, ff, opciones):
         try:
-            fi = parse_date(fecha_inicio) if fecha_inicio else None
-            ff = parse_date(fecha_fin) if fecha_fin else None
-        except Exception:
-            return JsonResponse({"detail": "Parámetros de fecha inválidos."}, status=400)
-        if not fi or not ff or fi > ff:
-            return JsonResponse(
-                {"detail": "Debe enviar fecha_inicio y fecha_fin válidas (YYYY-MM-DD) y fi <= ff."},
-                status=400
+            pf = Portafolio.objects.get(pk=pf_id)
+        except Portafolio.DoesNotExist:
+            return JsonResponse({"detail": f"Portafolio {pf_id} no existe."}, status=404)
+
+        # Valuaciones materializadas (refrescar_valuaciones)
+        materializado = leer_evolucion(pf.id, fi, ff)
+        if materializado is not None:
+            return self._respuesta(pf, fi, ff, *materializado, opciones)
+
+        # Sin materializar: cálculo en línea con el libro de posiciones
+        datos = precios_y_cantidades(pf.id, fi, ff)
+        if isinstance(datos, HttpResponse):
+            return datos
+        simbolos, fechas, P, Q = datos
+
+        # x_{i,t}, V_t y w_{i,t} en una sola pasada, con las cantidades vigentes en cada t
+        _, Vt, W = evolucion(P, Q)
+        # V_t en centavos, como el materializado: la respuesta no depende del camino
+        return self._respuesta(pf, fi, ff, fechas, simbolos, a_centavos(Vt), W, opciones)
+
+    @staticmethod
+    def _respuesta(pf, fi, ff, fechas, simbolos, Vt, W, opciones):
+        idx, siguiente = muestrear_y_paginar(fechas, Vt, opciones)
+        cabecera = {
+            "portafolio": {"id": pf.id, "nombre": pf.nombre},
+            "rango": {"inicio": fi.isoformat(), "fin": ff.isoformat()},
+        }
+        if opciones["limite"]:
+            cabecera["siguiente"] = siguiente
+        with seccion("serializacion"):
+            contenido, content_type = formatos.codificar(
+                opciones["formato"], cabecera, [fechas[i] for i in idx], simbolos, Vt[idx], W[idx]
             )
+        return HttpResponse(contenido, content_type=content_type)
 
+class AnaliticaPortafolioAPIView(View):
+    """
+    GET /api/portafolios/<pf_id>/analitica/?fecha_inicio=YYYY-MM-DD&fecha_fin=YYYY-MM-DD
+        [&ventana=21] [&series=0] [&freq=W|M|Q] [&puntos=N] [&limite=N&cursor=...]
+    Rendimiento diario y acumulado, volatilidad (total y móvil de ``ventana``
+    días, anualizadas), máximo drawdown y contribución de cada activo al
+    rendimiento, calculados en el servidor (``inversiones/analitica.py``) sobre
+    los mismos precios y cantidades que la evolución. ``series=0`` devuelve
+    solo el resumen y las contribuciones; ``freq``/``puntos``/``limite`` reducen
+    las series como en ``/evolucion/`` (las métricas usan siempre todas las fechas).
+    """
+    VENTANA = 21
+
+    def get(self, request, pf_id: int):
+        fi, ff, opciones, error = parametros_evolucion(request, ("json",))
+        if error is not None:
+            return error
+        try:
+            ventana = int(request.GET.get("ventana") or self.VENTANA)
+        except ValueError:
+            return JsonResponse({"detail": "ventana debe ser un entero."}, status=400)
+        if ventana < 2:
+            return JsonResponse({"detail": "ventana debe ser al menos 2."}, status=400)
+
+        clave = cache.clave_respuesta("analitica", pf_id, request.GET.dict(), cache.version_datos(pf_id))
+        return cache.respuesta_con_cache(request, clave,
+                                         lambda: self._calcular(request, pf_id, fi, ff, ventana, opciones))
+
+    @staticmethod
+    def _calcular(request, pf_id, fi, ff, ventana, opciones):
         try:
             pf = Portafolio.objects.get(pk=pf_id)
         except Portafolio.DoesNotExist:
             return JsonResponse({"detail": f"Portafolio {pf_id} no existe."}, status=404)
+        datos = precios_y_cantidades(pf.id, fi, ff)
+        if isinstance(datos, HttpResponse):
+            return datos
+        simbolos, fechas, P, Q = datos
+
+        resumen, series, contribuciones = analitica.analizar(fechas, simbolos, P, Q, ventana)
+        data = {
+            "portafolio": {"id": pf.id, "nombre": pf.nombre},
+            "rango": {"inicio": fi.isoformat(), "fin": ff.isoformat()},
+            "ventana": ventana,
+            "resumen": resumen,
+            "contribuciones": contribuciones,
+        }
+        with seccion("serializacion"):
+            if request.GET.get("series", "1").lower() not in ("0", "false"):
+                idx, siguiente = muestrear_y_paginar(fechas, series["rendimiento_acumulado"], opciones)
+                data["series"] = analitica.serializar_series(fechas, series, idx)
+                if opciones["limite"]:
+                    data["siguiente"] = siguiente
+            return JsonResponse(data, json_dumps_params={"ensure_ascii": False})
+
 
-        # Cantidades fijas c_{i,0}
-        cantidades_qs = Cantidad.objects.filter(portafolio=pf).select_related("activo")
-        if not cantidades_qs.exists():
-            return JsonResponse(
-                {"detail": "No hay cantidades (C_{i,0}) para este portafolio. Ejecute calc_cantidades_iniciales."},
-                status=400
+class BacktestPortafolioAPIView(View):
+    """
+    GET /api/portafolios/<pf_id>/backtest/?fecha_inicio=YYYY-MM-DD&fecha_fin=YYYY-MM-DD
+        [&frecuencia=ninguna,W,M,Q] [&banda=0,0.05] [&costo=0,0.001] [&v0=1000000]
+        [&series=1] [&freq=W|M|Q] [&puntos=N] [&limite=N&cursor=...]
+    Simula el rebalanceo hacia los weights del portafolio (``inversiones/backtest.py``)
+    para cada combinación de las listas ``frecuencia``, ``banda`` (0: sin banda)
+    y ``costo`` (fracción del monto negociado), repartidas en
+    ``BACKTEST_PROCESOS`` procesos. Devuelve el resumen de cada variante; con
+    ``series=1`` también su valor diario, reducido como en ``/evolucion/`` (los
+    puntos de ``puntos`` se eligen sobre la primera variante).
+    """
+    V0 = 1000000
+
+    def get(self, request, pf_id: int):
+        fi, ff, opciones, error = parametros_evolucion(request, ("json",))
+        if error is not None:
+            return error
+        try:
+            lote = backtest.variantes(
+                self._lista(request, "frecuencia", str, ["M"]),
+                self._lista(request, "banda", float, [0.0]),
+                self._lista(request, "costo", float, [0.0]),
             )
+            v0 = float(request.GET.get("v0") or self.V0)
+        except ValueError as e:
+            return JsonResponse({"detail": str(e)}, status=400)
+        if not v0 > 0:
+            return JsonResponse({"detail": "v0 debe ser positivo."}, status=400)
+        if len(lote) > settings.BACKTEST_MAX_VARIANTES:
+            return JsonResponse({"detail": f"A lo más {settings.BACKTEST_MAX_VARIANTES} variantes por petición."},
+                                status=400)
 
-        cantidades = {c.activo_id: c.cantidad for c in cantidades_qs}  # activo_id -> c_i
-        activos_map = {c.activo_id: c.activo.simbolo for c in cantidades_qs}
-        activo_ids = list(cantidades.keys())
-
-        # Precios en rango para esos activos
-        precios_qs = (Precio.objects
-                      .filter(activo_id__in=activo_ids, fecha__range=(fi, ff))
-                      .values("activo_id", "fecha", "precio"))
-        if not precios_qs:
-            return JsonResponse({"detail": "No hay precios para el rango solicitado."}, status=400)
-
-        # x_{i,t}, V_t y w_{i,t}
-        by_date = {}  # fecha -> {"xi": {activo_id: xi}, "Vt": Decimal}
-        for row in precios_qs:
-            aid = row["activo_id"]
-            fch = row["fecha"]
-            p = row["precio"]
-            ci = cantidades.get(aid)
-            if ci is None:
-                continue
-            xi = p * ci
-            d = by_date.setdefault(fch, {"xi": {}, "Vt": Decimal("0")})
-            d["xi"][aid] = xi
-            d["Vt"] += xi
-
-        fechas = sorted(by_date.keys())
-        vt_series, weights_series = [], []
-        for fch in fechas:
-            Vt = by_date[fch]["Vt"]
-            vt_series.append({"fecha": fch.isoformat(), "valor": float(Vt)})
-
-            xi_map = by_date[fch]["xi"]
-            w_list = []
-            if Vt != 0:
-                for aid, xi in xi_map.items():
-                    w_list.append({
-                        "activo": activos_map.get(aid, str(aid)),
-                        "valor": float(xi / Vt)
-                    })
-            weights_series.append({"fecha": fch.isoformat(), "w": w_list})
+        clave = cache.clave_respuesta("backtest", pf_id, request.GET.dict(), cache.version_datos(pf_id))
+        return cache.respuesta_con_cache(request, clave,
+                                         lambda: self._calcular(request, pf_id, fi, ff, lote, v0, opciones))
+
+    @staticmethod
+    def _lista(request, nombre, tipo, defecto):
+        """Lista separada por comas del parámetro ``nombre`` (ValueError si algún valor no es ``tipo``)."""
+        valor = request.GET.get(nombre)
+        if not valor:
+            return defecto
+        try:
+            return [tipo(x.strip()) for x in valor.split(",")]
+        except ValueError:
+            raise ValueError(f"{nombre} debe ser una lista separada por comas.")
+
+    @staticmethod
+    def _calcular(request, pf_id, fi, ff, lote, v0, opciones):
+        try:
+            pf = Portafolio.objects.get(pk=pf_id)
+        except Portafolio.DoesNotExist:
+            return JsonResponse({"detail": f"Portafolio {pf_id} no existe."}, status=404)
+        try:
+            fecha_w, simbolos, w, fechas, P = backtest.cargar_insumos(pf.id, fi, ff)
+        except ValueError as e:
+            return JsonResponse({"detail": str(e)}, status=400)
 
+        with seccion("backtest"):
+            resultados = backtest.ejecutar(fechas, P, w, v0, lote, procesos=settings.BACKTEST_PROCESOS)
         data = {
             "portafolio": {"id": pf.id, "nombre": pf.nombre},
-            "rango": {"inicio": fi.isoformat(), "fin": ff.isoformat()},
-            "Vt": vt_series,
-            "weights": weights_series,
+            "rango": {"inicio": fechas[0].isoformat(), "fin": fechas[-1].isoformat()},
+            "v0": v0,
+            "weights": {"fecha": fecha_w.isoformat(), "activos": dict(zip(simbolos, w.tolist()))},
+            "variantes": [{**v, "resumen": resumen} for v, (resumen, _) in zip(lote, resultados)],
         }
-        return JsonResponse(data, status=200, json_dumps_params={"ensure_ascii": False})
+        with seccion("serializacion"):
+            if request.GET.get("series", "").lower() in ("1", "true"):
+                idx, siguiente = muestrear_y_paginar(fechas, resultados[0][1], opciones)
+                data["series"] = {"fechas": [fechas[i].isoformat() for i in idx],
+                                  "valores": [V[idx].tolist() for _, V in resultados]}
+                if opciones["limite"]:
+                    data["siguiente"] = siguiente
+            return JsonResponse(data, json_dumps_params={"ensure_ascii": False})
+
+
+class EvolucionLoteAPIView(View):
+    """
+    GET /api/portafolios/evolucion/?fecha_inicio=YYYY-MM-DD&fecha_fin=YYYY-MM-DD[&ids=1,2,3]
+    Evolución de varios portafolios (todos si no se envía ``ids``) en una sola
+    respuesta: ``{"rango", "portafolios": [...], "sin_cantidades": [ids]}``, donde
+    cada elemento tiene la forma de la respuesta individual sin ``rango``.
+    Los precios de todos los activos se leen una vez y V_t de todos los
+    portafolios sale de un producto matricial (``evolucion_lote``), con un
+    número fijo de consultas sin importar cuántos portafolios se pidan.
+    Acepta ``freq``, ``puntos`` y ``limite``/``cursor`` (aplicados a cada
+    portafolio) y ``formato=json|columnar``.
+    """
+    FORMATOS = ("json", "columnar")
+
+    def get(self, request):
+        fi, ff, opciones, error = parametros_evolucion(request, self.FORMATOS)
+        if error is not None:
+            return error
+
+        portafolios, error = parsear_ids(request)
+        if error is not None:
+            return error
+        pf_ids = [pf_id for pf_id, _ in portafolios]
+
+        params = {**request.GET.dict(), "formato": opciones["formato"], "ids": ",".join(map(str, pf_ids))}
+        clave = cache.clave_respuesta("evolucion-lote", "lote", params, cache.version_lote(pf_ids))
+        content_type = formatos.TIPOS[opciones["formato"]]
+        calcular = lambda: HttpResponse(self._calcular(portafolios, fi, ff, opciones), content_type=content_type)
+        return cache.respuesta_con_cache(request, clave, calcular, content_type=content_type, vary="Accept")
+
+    @staticmethod
+    def _calcular(portafolios, fi, ff, opciones):
+        libros = cargar_libros([pf_id for pf_id, _ in portafolios])
+        resultados = evolucion_lote(libros, fi, ff)
+        activo_ids = {aid for libro in libros.values() for aid in libro.activo_ids}
+        simbolo_de = dict(Activo.objects.filter(id__in=activo_ids).values_list("id", "simbolo"))
+
+        partes = []
+        with seccion("serializacion"):
+            for pf_id, nombre in portafolios:
+                if pf_id not in resultados:
+                    continue
+                fechas, aids, Vt, W = resultados[pf_id]
+                idx, siguiente = muestrear_y_paginar(fechas, Vt, opciones)
+                cabecera = {"portafolio": {"id": pf_id, "nombre": nombre}}
+                if opciones["limite"]:
+                    cabecera["siguiente"] = siguiente
+                contenido, _ = formatos.codificar(
+                    opciones["formato"], cabecera, [fechas[i] for i in idx],
+                    [simbolo_de[aid] for aid in aids], Vt[idx], W[idx],
+                )
+                partes.append(contenido)
+            sin_cantidades = [pf_id for pf_id, _ in portafolios if pf_id not in resultados]
+            rango = json.dumps({"inicio": fi.isoformat(), "fin": ff.isoformat()})
+        return b"".join((
+            f'{{"rango": {rango}, "portafolios": ['.encode(), b", ".join(partes),
+            f'], "sin_cantidades": {json.dumps(sin_cantidades)}}}'.encode(),
+        ))
+
+
+class RiesgoLoteAPIView(View):
+    """
+    GET /api/portafolios/riesgo/?[ids=1,2,3] [&metodo=bootstrap|normal|historico]
+        [&escenarios=10000] [&horizonte=1] [&ventana=500] [&hasta=YYYY-MM-DD]
+        [&niveles=0.95,0.99] [&semilla=42]
+    VaR y CVaR de las tenencias actuales de cada portafolio (todos si no se
+    envía ``ids``) bajo escenarios de precios derivados de los rendimientos de
+    las últimas ``ventana`` fechas (``inversiones/escenarios.py``). Con la misma
+    semilla el resultado es el mismo; los bloques de escenarios se reparten en
+    ``ESCENARIOS_PROCESOS`` procesos.
+    """
+    ENTEROS = {"escenarios": (10000, 1), "horizonte": (1, 1), "ventana": (500, 2), "semilla": (42, 0)}
+
+    def get(self, request):
+        params = {}
+        for nombre, (defecto, minimo) in self.ENTEROS.items():
+            try:
+                params[nombre] = int(request.GET.get(nombre) or defecto)
+            except ValueError:
+                return JsonResponse({"detail": f"{nombre} debe ser un entero."}, status=400)
+            if params[nombre] < minimo:
+                return JsonResponse({"detail": f"{nombre} debe ser al menos {minimo}."}, status=400)
+        if params["escenarios"] > settings.ESCENARIOS_MAX:
+            return JsonResponse({"detail": f"A lo más {settings.ESCENARIOS_MAX} escenarios por petición."},
+                                status=400)
+        metodo = request.GET.get("metodo") or "bootstrap"
+        if metodo not in escenarios.METODOS:
+            return JsonResponse({"detail": f"metodo debe ser uno de: {', '.join(escenarios.METODOS)}."}, status=400)
+        try:
+            niveles = [float(x) for x in (request.GET.get("niveles") or "0.95,0.99").split(",")]
+        except ValueError:
+            niveles = []
+        if not niveles or not all(0 < n < 1 for n in niveles):
+            return JsonResponse({"detail": "niveles debe ser una lista de valores entre 0 y 1."}, status=400)
+        hasta = None
+        if request.GET.get("hasta"):
+            hasta = parse_date(request.GET["hasta"])
+            if hasta is None:
+                return JsonResponse({"detail": "Parámetro hasta inválido. Use formato YYYY-MM-DD."}, status=400)
+
+        portafolios, error = parsear_ids(request)
+        if error is not None:
+            return error
+        pf_ids = [pf_id for pf_id, _ in portafolios]
+
+        clave = cache.clave_respuesta("riesgo", "lote", {**request.GET.dict(), "ids": ",".join(map(str, pf_ids))},
+                                      cache.version_lote(pf_ids))
+        return cache.respuesta_con_cache(request, clave,
+                                         lambda: self._calcular(portafolios, metodo, niveles, hasta, params))
+
+    @staticmethod
+    def _calcular(portafolios, metodo, niveles, hasta, params):
+        try:
+            fecha, pf_ids, simbolos, X, R = escenarios.cargar_insumos([pf_id for pf_id, _ in portafolios], hasta,
+                                                                      params["ventana"])
+            with seccion("escenarios"):
+                pnl = escenarios.simular(R, X, metodo, params["escenarios"], params["horizonte"], params["semilla"],
+                                         procesos=settings.ESCENARIOS_PROCESOS)
+        except ValueError as e:
+            return JsonResponse({"detail": str(e)}, status=400)
+        nombres = dict(portafolios)
+        data = {
+            "fecha": fecha.isoformat(),
+            "metodo": metodo,
+            "escenarios": pnl.shape[0],
+            "horizonte": params["horizonte"],
+            "ventana": R.shape[0],
+            "semilla": params["semilla"],
+            "activos": simbolos,
+            "portafolios": [{"portafolio": {"id": pf_id, "nombre": nombres[pf_id]}, **r}
+                            for pf_id, r in zip(pf_ids, escenarios.medidas(pnl, X, niveles))],
+            "sin_cantidades": sorted({pf_id for pf_id, _ in portafolios} - set(pf_ids)),
+        }
+        return JsonResponse(data, json_dumps_params={"ensure_ascii": False})
+
+class ExportacionAPIView(View):
+    """
+    GET /api/portafolios/exportar/?formato=csv|ndjson|parquet[&ids=1,2,3]
+        [&fecha_inicio=YYYY-MM-DD] [&fecha_fin=YYYY-MM-DD]
+    Exportación masiva de V_t y w_{i,t} de varios portafolios (todos si no se
+    envía ``ids``) como tabla larga (``inversiones/exportacion.py``). La
+    respuesta es un ``StreamingHttpResponse``: se calcula y se envía de a
+    bloques de fechas, así que la memoria no crece con el rango. El cuerpo no
+    se guarda en la caché; el ETag permite contestar 304 sin recalcular.
+    """
+    def get(self, request):
+        formato = request.GET.get("formato") or "csv"
+        try:
+            exportacion.verificar_formato(formato)
+        except exportacion.ErrorExportacion as e:
+            return JsonResponse({"detail": str(e)}, status=400)
+        fi = parse_date(request.GET["fecha_inicio"]) if request.GET.get("fecha_inicio") else None
+        ff = parse_date(request.GET["fecha_fin"]) if request.GET.get("fecha_fin") else None
+        if (request.GET.get("fecha_inicio") and fi is None) or (request.GET.get("fecha_fin") and ff is None):
+            return JsonResponse({"detail": "Parámetros de fecha inválidos. Use formato YYYY-MM-DD."}, status=400)
+        if fi and ff and fi > ff:
+            return JsonResponse({"detail": "fecha_inicio debe ser <= fecha_fin."}, status=400)
+
+        portafolios, error = parsear_ids(request)
+        if error is not None:
+            return error
+        pf_ids = [pf_id for pf_id, _ in portafolios]
+
+        params = {**request.GET.dict(), "formato": formato, "ids": ",".join(map(str, pf_ids))}
+        clave = cache.clave_respuesta("exportacion", "lote", params, cache.version_lote(pf_ids))
+        return cache.respuesta_con_cache(request, clave, lambda: self._transmitir(formato, pf_ids, fi, ff),
+                                         guardar_cuerpo=False)
+
+    @staticmethod
+    def _transmitir(formato, pf_ids, fi, ff):
+        response = StreamingHttpResponse(exportacion.trozos(formato, exportacion.bloques(pf_ids, fi, ff)),
+                                         content_type=exportacion.FORMATOS[formato])
+        response["Content-Disposition"] = f'attachment; filename="evolucion.{formato}"'
+        return response
+
+
+def respuesta_encolada(trabajo, cuerpo=None):
+    """202 con el estado del trabajo y su URL de consulta en ``Location``."""
+    url = reverse("estado-trabajo", args=[trabajo.id])
+    response = JsonResponse({**(cuerpo or {"detail": "Trabajo encolado."}),
+                             "trabajo": trabajos.describir(trabajo), "estado_url": url}, status=202)
+    response["Location"] = url
+    return response
+
+
+class TrabajoAPIView(View):
+    """
+    GET /api/trabajos/<trabajo_id>/
+    Estado de un trabajo en segundo plano: pendiente, en_curso (con avance),
+    completado (con resultado) o fallido (con el error).
+    """
+
+    def get(self, request, trabajo_id: int):
+        en_curso = trabajos.leer_en_curso(trabajo_id)  # sin consultar la base (ver inversiones.trabajos)
+        if en_curso is not None:
+            return JsonResponse(en_curso)
+        trabajo = Trabajo.objects.filter(pk=trabajo_id).first()
+        if trabajo is None:
+            return JsonResponse({"detail": f"Trabajo {trabajo_id} no existe."}, status=404)
+        return JsonResponse(trabajos.describir(trabajo))
+
+
+class ImportacionAPIView(View):
+    """
+    POST /api/importaciones/ (multipart)
+    Encola ``import_datos`` sobre el archivo subido en ``archivo`` (.xlsx, .csv
+    o .parquet); ``weights`` es opcional. Los campos ``delta``, ``upsert``,
+    ``desde`` y ``fecha_inicial`` equivalen a las opciones del comando.
+    Responde 202 con el trabajo.
+    """
+    @method_decorator(csrf_exempt)
+    def post(self, request):
+        subidos = {campo: request.FILES.get(campo) for campo in ("archivo", "weights")}
+        if subidos["archivo"] is None:
+            return JsonResponse({"detail": "Falta el archivo (campo 'archivo')."}, status=400)
+        for campo, subido in subidos.items():
+            if subido is not None and os.path.splitext(subido.name)[1].lower() not in FORMATOS:
+                return JsonResponse({"detail": f"Formato no soportado en '{campo}': {subido.name}."}, status=400)
+
+        opciones = {"delta": request.POST.get("delta", "").lower() in ("1", "true"),
+                    "upsert": request.POST.get("upsert", "").lower() in ("1", "true")}
+        for campo in ("desde", "fecha_inicial"):
+            valor = request.POST.get(campo)
+            if valor:
+                if parse_date(valor) is None:
+                    return JsonResponse({"detail": f"Parámetro {campo} inválido. Use formato YYYY-MM-DD."},
+                                        status=400)
+                opciones[campo] = valor
+        if subidos["weights"] is not None:
+            opciones["weights_path"] = trabajos.guardar_subida(subidos["weights"])
+
+        trabajo = trabajos.encolar_importacion(trabajos.guardar_subida(subidos["archivo"]), opciones,
+                                               temporal=True)
+        return respuesta_encolada(trabajo, {"detail": "Importación encolada."})
+
 
 def viz_evolucion(request):
     # defaults (primer portafolio + rango total de precios)
+    # fecha mínima/máxima: cada consulta lee un extremo del índice precio_fecha_activo_idx
     pf = Portafolio.objects.order_by("id").first()
     fi = Precio.objects.order_by("fecha").values_list("fecha", flat=True).first()
     ff = Precio.objects.order_by("-fecha").values_list("fecha", flat=True).first()
@@ -174,4 +688,12 @@ def viz_evolucion(request):
             "ff": ff.isoformat() if ff else "2023-02-16",
         }
     }
-    return render(request, "inversiones/evolucion.html", ctx)
\ No newline at end of file
+    return render(request, "inversiones/evolucion.html", ctx)
+
+
+def metricas_prometheus(request):
+    """GET /metrics: métricas del proceso en formato de texto de Prometheus (solo IPs locales)."""
+    permitidas = getattr(settings, "METRICAS_IPS_PERMITIDAS", ("127.0.0.1", "::1"))
+    if request.META.get("REMOTE_ADDR") not in permitidas:
+        return JsonResponse({"detail": "Métricas disponibles solo desde la máquina local."}, status=403)
+    return HttpResponse(REGISTRO.exponer(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,5 +1,6 @@
 # portafolio_project/settings.py
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -32,6 +33,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'inversiones.middleware.MetricasMiddleware',  # primero: mide toda la petición (Server-Timing, /metrics)
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',  # Debe estar antes de 'AuthenticationMiddleware'
     'django.contrib.auth.middleware.AuthenticationMiddleware',  # Requiere 'SessionMiddleware'
@@ -65,13 +67,82 @@ WSGI_APPLICATION = 'portafolio_project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# DB_PERFIL: "desarrollo" (SQLite por defecto: journal de rollback, conexión por
+# petición) o "produccion": WAL (los lectores no esperan al escritor),
+# synchronous=NORMAL (seguro con WAL), mmap y caché de páginas, transacciones
+# IMMEDIATE (los escritores hacen cola con el timeout en vez de fallar al pasar
+# de lectura a escritura) y conexiones persistentes. WAL queda grabado en el
+# archivo de la base. Bajo ASGI las vistas async usan un hilo por petición:
+# conviene CONN_MAX_AGE=0 (ver la documentación de Django).
+DB_PERFILES = {
+    "desarrollo": {},
+    "produccion": {
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': 20,  # segundos de espera por el lock (busy_timeout)
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': (
+                'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; PRAGMA mmap_size=268435456; '
+                'PRAGMA cache_size=-65536; PRAGMA temp_store=MEMORY'
+            ),
+        },
+    },
+}
+DB_PERFIL = os.environ.get("DB_PERFIL", "desarrollo")
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        **DB_PERFILES[DB_PERFIL],
     }
 }
 
+# Reintentos con espera exponencial (desde DB_REINTENTO_ESPERA segundos) de las
+# escrituras que encuentran la base bloqueada (inversiones/bloqueos.py).
+DB_REINTENTOS = int(os.environ.get("DB_REINTENTOS", 4))
+DB_REINTENTO_ESPERA = 0.05
+
+
+# Caché de respuestas de la API de evolución (invalidada por versión de datos).
+# EVOLUCION_CACHE: "memoria" (LRU local por proceso), "archivo" o "redis".
+_EVOLUCION_CACHE = os.environ.get("EVOLUCION_CACHE", "memoria")
+_EVOLUCION_BACKENDS = {
+    "memoria": {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'evolucion',
+        'OPTIONS': {'MAX_ENTRIES': 256},  # desalojo LRU
+    },
+    "archivo": {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.cache' / 'evolucion',
+        'OPTIONS': {'MAX_ENTRIES': 1024},
+    },
+    "redis": {  # acotar con maxmemory + maxmemory-policy allkeys-lru en el servidor
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get("REDIS_URL", "redis://127.0.0.1:6379/1"),
+    },
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'evolucion': {
+        **_EVOLUCION_BACKENDS[_EVOLUCION_CACHE],
+        'TIMEOUT': None,  # se invalida por versión, no por tiempo
+    },
+}
+
+# Respuestas más grandes que esto no se guardan en caché
+EVOLUCION_CACHE_MAX_BYTES = 5 * 1024 * 1024
+
+# Métricas (inversiones/metricas.py): /metrics solo responde a estas IPs, y los comandos
+# dejan su última ejecución en METRICAS_TEXTFILE_DIR (textfile collector) si está definido.
+METRICAS_IPS_PERMITIDAS = ("127.0.0.1", "::1")
+METRICAS_TEXTFILE_DIR = os.environ.get("METRICAS_TEXTFILE_DIR") or None
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -114,9 +185,38 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Lotes grandes de operaciones (archivos de rebalanceo de 100k filas pesan ~10 MB en JSON)
+DATA_UPLOAD_MAX_MEMORY_SIZE = 32 * 1024 * 1024
+
 # Desactivar CSRF para el entorno de desarrollo
 CSRF_COOKIE_SECURE = False  # Asegúrate de que esté en False durante el desarrollo
 
 CSRF_TRUSTED_ORIGINS = [
     'http://127.0.0.1:8000',  # Agrega tu URL de desarrollo aquí
 ]
+
+# Instantánea de la matriz de precios (inversiones/matriz_precios.py), leída con
+# numpy.memmap. PRECIOS_MATRIZ_DIR="" la deshabilita.
+PRECIOS_MATRIZ_DIR = os.environ.get("PRECIOS_MATRIZ_DIR", str(BASE_DIR / ".cache" / "precios")) or None
+
+# Cola de trabajos en segundo plano (inversiones/trabajos.py): archivos de avance
+# y archivos subidos a /api/importaciones/ hasta que los procesa procesar_trabajos.
+TRABAJOS_DIR = os.environ.get("TRABAJOS_DIR") or str(BASE_DIR / ".cache" / "trabajos")
+
+# API de backtest (inversiones/backtest.py): procesos del pool que reparte las
+# variantes de una petición y máximo de variantes por petición.
+BACKTEST_PROCESOS = int(os.environ.get("BACKTEST_PROCESOS", 1))
+BACKTEST_MAX_VARIANTES = 500
+
+# API de escenarios y VaR/CVaR (inversiones/escenarios.py): procesos del pool que
+# reparte los bloques de escenarios y máximo de escenarios por petición.
+ESCENARIOS_PROCESOS = int(os.environ.get("ESCENARIOS_PROCESOS", 1))
+ESCENARIOS_MAX = 200000
+
+# Admin de tablas grandes (inversiones/admin.py): hasta cuántas filas se cuenta
+# exacto; más allá el listado informa una estimación.
+ADMIN_CONTEO_EXACTO = int(os.environ.get("ADMIN_CONTEO_EXACTO", 10000))
+
+# import_datos (inversiones/importacion.py): memoria residente máxima en MB; al
+# superarla después de un bloque la importación se aborta. 0: sin límite.
+IMPORTACION_MEMORIA_MAX_MB = int(os.environ.get("IMPORTACION_MEMORIA_MAX_MB", 0))
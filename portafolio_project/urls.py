@@ -15,5 +15,6 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('inversiones.urls')),
     path('grafico/', views.viz_evolucion, name='grafico'),
+    path('metrics', views.metricas_prometheus, name='metricas'),
     path('', RedirectView.as_view(url='/api/viz/', permanent=False)),
 ]